@@ -0,0 +1,317 @@
+import csv
+import hashlib
+import io
+import json
+import os
+
+import numpy as np
+
+import census_ingest
+import county_names
+import instrumentation
+import language_model
+
+logger = instrumentation.get_logger('aggregation')
+
+# 彙整層級的分組設定（區域、本島與離島、客家帶…），每組由縣市或「縣市+鄉鎮」組成
+GROUPINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'groupings.json')
+# 彙整結果的快取目錄（依分組定義、資料檔內容與年份分檔）
+AGGREGATE_CACHE_DIR = os.path.join(census_ingest.LANGUAGE_DATA_DIR, 'aggregates')
+# 直接由報表決定的層級，設定檔不能重新定義
+BASE_LEVELS = ['township', 'county']
+# 成員寫成 '*' 的組包含其他組沒有涵蓋的所有鄉鎮
+REMAINDER = '*'
+
+# 已算好的彙整結果（快取鍵 -> {層級: 結果}）
+_AGGREGATES = {}
+
+
+def load_groupings(path=GROUPINGS_PATH):
+    """讀取分組設定檔，回傳 {層級: {'label': 顯示名稱, 'groups': {組名: 成員列表}}}
+
+    groups 為 "folders" 時依報表所在的區域資料夾（Northern、Middle…）分組。
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as file:
+        groupings = json.load(file)
+    reserved = sorted(set(groupings) & set(BASE_LEVELS))
+    if reserved:
+        raise ValueError(f"分組設定不能使用層級名稱 {', '.join(reserved)}")
+    return groupings
+
+
+def levels(groupings=None):
+    """所有可用的層級：鄉鎮、縣市與設定檔中的彙整層級"""
+    groupings = load_groupings() if groupings is None else groupings
+    return BASE_LEVELS + list(groupings)
+
+
+def _member_name(member):
+    """成員名稱的標準寫法：縣市名稱查表，「縣市+鄉鎮」只統一異體字"""
+    return county_names.canonical_name(member) or county_names.fold_variants(member.strip())
+
+
+def base_level(level, groupings=None):
+    """層級畫在哪一種邊界上：成員全是整個縣市時用縣市邊界，否則用鄉鎮邊界"""
+    if level in BASE_LEVELS:
+        return level
+    groupings = load_groupings() if groupings is None else groupings
+    if level not in groupings:
+        raise ValueError(f"未知的層級 {level}（可用：{', '.join(levels(groupings))}）")
+    groups = groupings[level]['groups']
+    if groups == 'folders':
+        return 'county'
+    members = [member for group in groups.values() if group != REMAINDER for member in group]
+    return 'county' if all(county_names.canonical_name(member) for member in members) else 'township'
+
+
+def township_counts(store, year=None):
+    """鄉鎮層級的人數表：報表的「每百人相對人數」乘上人口換回人數
+
+    彙整必須以人數加總再除以總人口（人口加權），不能直接平均各鄉鎮的比例。
+    counts 的形狀為 (鄉鎮數, 2, 語言欄位數)，第二軸為主要 / 次要使用語言。
+    """
+    table = census_ingest.build_township_table(store, year)
+    population = table['population'].astype(np.float64)
+    shares = np.stack([table['primary'], table['secondary']], axis=1).astype(np.float64)
+    return {
+        'region': table['region'].tolist(),
+        'county': table['county'].tolist(),
+        'population': population,
+        'counts': shares * population[:, None, None] / 100,
+    }
+
+
+def resolve_groups(definition, counts, folders=None):
+    """將一個層級的分組定義對應到鄉鎮列號
+
+    回傳 (組名列表, 鄉鎮列號, 組別編號, 找不到的成員)；後兩個陣列一一對應，
+    同一個鄉鎮可以屬於多個組（自訂分組可以重疊）。
+    """
+    groups = definition['groups']
+    if groups == 'folders':
+        groups = folders or {}
+    rows_by_name = {}
+    for row, (region, county) in enumerate(zip(counts['region'], counts['county'])):
+        rows_by_name.setdefault(region, []).append(row)
+        rows_by_name.setdefault(county, []).append(row)
+
+    names = list(groups)
+    rows, ids, missing = [], [], []
+    covered = np.zeros(len(counts['region']), dtype=bool)
+    remainder = None
+    for group, name in enumerate(names):
+        if groups[name] == REMAINDER:
+            remainder = group
+            continue
+        for member in groups[name]:
+            matched = rows_by_name.get(_member_name(member))
+            if not matched:
+                missing.append(member)
+                continue
+            rows.extend(matched)
+            ids.extend([group] * len(matched))
+            covered[matched] = True
+    if remainder is not None:
+        rest = np.flatnonzero(~covered).tolist()
+        rows.extend(rest)
+        ids.extend([remainder] * len(rest))
+    return names, np.array(rows, dtype=np.intp), np.array(ids, dtype=np.intp), missing
+
+
+def _level_pairs(counts, groupings, folders):
+    """每個層級的 (組名列表, 鄉鎮列號, 組別編號)"""
+    size = len(counts['region'])
+    counties = list(dict.fromkeys(counts['county']))
+    county_ids = {county: i for i, county in enumerate(counties)}
+    pairs = {
+        'township': (counts['region'], np.arange(size), np.arange(size)),
+        'county': (counties, np.arange(size), np.array([county_ids[c] for c in counts['county']], dtype=np.intp)),
+    }
+    for level, definition in groupings.items():
+        names, rows, ids, missing = resolve_groups(definition, counts, folders)
+        if missing:
+            logger.warning(f"分組 {level} 找不到的成員：{'、'.join(missing)}")
+        pairs[level] = (names, rows, ids)
+    return pairs
+
+
+def compute_aggregates(store, groupings, year=None):
+    """以一次 group-by 算出所有層級的人口加權比例，回傳 {層級: 結果}
+
+    各層級的（鄉鎮列號, 組別編號）配對加上位移後串接成一個全域編號，
+    人口與各語言人數只用一次 np.add.at 加總，再除以各組的總人口。
+    結果的 primary / secondary 為每百人比例，沒有人口的組為 NaN。
+    """
+    counts = township_counts(store, year)
+    pairs = _level_pairs(counts, groupings, census_ingest.region_counties(store))
+    offsets = np.cumsum([0] + [len(names) for names, _, _ in pairs.values()])
+    rows = np.concatenate([level_rows for _, level_rows, _ in pairs.values()])
+    ids = np.concatenate([level_ids + offset for (_, _, level_ids), offset in zip(pairs.values(), offsets)])
+
+    # 人口一欄 + 主要 / 次要各語言人數
+    values = np.concatenate([counts['population'][:, None], counts['counts'].reshape(len(counts['region']), -1)],
+                            axis=1)
+    sums = np.zeros((offsets[-1], values.shape[1]))
+    np.add.at(sums, ids, values[rows])
+    members = np.bincount(ids, minlength=offsets[-1])
+
+    population = sums[:, 0]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        shares = np.where(population[:, None] > 0, sums[:, 1:] / population[:, None] * 100, np.nan)
+    shares = shares.reshape(len(sums), 2, -1)
+
+    results = {}
+    for (level, (names, _, _)), start, end in zip(pairs.items(), offsets[:-1], offsets[1:]):
+        results[level] = {
+            'regions': list(names),
+            'population': population[start:end],
+            'townships': members[start:end],
+            'primary': shares[start:end, 0],
+            'secondary': shares[start:end, 1],
+        }
+    return results
+
+
+def aggregate_key(groupings, store, year):
+    """彙整結果的快取鍵：分組定義、資料檔內容與年份"""
+    content = json.dumps({
+        'groupings': groupings,
+        'data': census_ingest.store_digest(store),
+        'store_version': census_ingest.STORE_VERSION,
+        'year': year,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def _save_aggregates(path, results):
+    arrays = {}
+    for level, result in results.items():
+        for field, value in result.items():
+            arrays[f"{level}.{field}"] = np.asarray(value)
+    # 先寫入暫存檔再取代，避免中斷時留下不完整的快取
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as file:
+        file.write(buffer.getvalue())
+    os.replace(path + '.tmp', path)
+
+
+def _load_aggregates(path):
+    results = {}
+    with np.load(path) as arrays:
+        for name in arrays.files:
+            level, field = name.rsplit('.', 1)
+            results.setdefault(level, {})[field] = arrays[name]
+    for result in results.values():
+        result['regions'] = result['regions'].tolist()
+    return results
+
+
+def aggregate(store=None, groupings=None, year=None, cache_dir=AGGREGATE_CACHE_DIR):
+    """所有層級的彙整結果（依分組定義快取在記憶體與 cache_dir）
+
+    year 未指定時使用最新的普查年份；同一組分組定義與資料只會計算一次。
+    """
+    store = census_ingest.ensure_store() if store is None else store
+    groupings = load_groupings() if groupings is None else groupings
+    years = census_ingest.census_years(store)
+    year = year or (years[-1] if years else None)
+
+    key = aggregate_key(groupings, store, year)
+    if key not in _AGGREGATES:
+        path = os.path.join(cache_dir, key + '.npz') if cache_dir else None
+        if path and os.path.exists(path):
+            _AGGREGATES[key] = _load_aggregates(path)
+        else:
+            _AGGREGATES[key] = compute_aggregates(store, groupings, year)
+            if path:
+                _save_aggregates(path, _AGGREGATES[key])
+    return _AGGREGATES[key]
+
+
+def level_table(store=None, level='region', year=None, groupings=None):
+    """某個層級的地圖語言數據表（主要+次要使用比例，與縣市、鄉鎮層級相同）"""
+    results = aggregate(store, groupings, year)
+    if level not in results:
+        raise ValueError(f"未知的層級 {level}（可用：{', '.join(results)}）")
+    result = results[level]
+    return language_model.make_table(
+        result['regions'], census_ingest._combined(result['primary'], result['secondary']),
+        list(census_ingest.MAP_LANGUAGES)
+    )
+
+
+def region_groups(level, store=None, groupings=None):
+    """{縣市或「縣市+鄉鎮」名稱: 組名}，地圖以此把成員的邊界換成所屬的組
+
+    成員屬於多個組時取設定檔中較前面的組。
+    """
+    store = census_ingest.ensure_store() if store is None else store
+    groupings = load_groupings() if groupings is None else groupings
+    counts = township_counts(store)
+    names, rows, ids, _ = resolve_groups(groupings[level], counts, census_ingest.region_counties(store))
+    groups = {}
+    for row, group in sorted(zip(rows.tolist(), ids.tolist()), key=lambda pair: pair[1]):
+        groups.setdefault(counts['region'][row], names[group])
+        groups.setdefault(counts['county'][row], names[group])
+    return groups
+
+
+def county_check(store, year=None):
+    """由鄉鎮彙整的縣市比例與報表縣市總計列的最大差距（百分點）"""
+    published, _ = census_ingest.county_language_data(store, year)
+    computed = level_table(store, 'county', year)
+    aligned = language_model.align_table(computed, published['regions'])
+    return float(np.nanmax(np.abs(aligned['values'] - published['values'])))
+
+
+def write_csv(path, results, selected):
+    """將各層級的彙整結果寫成 CSV（與 conclude.xlsx 相同的欄位：主要+次要相加）"""
+    with open(path, 'w', encoding='utf-8-sig', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['層級', '名稱', '鄉鎮數', '人口'] + list(census_ingest.MAP_LANGUAGES))
+        for level in selected:
+            result = results[level]
+            values = census_ingest._combined(result['primary'], result['secondary'])
+            for name, townships, population, row in zip(result['regions'], result['townships'],
+                                                        result['population'], values):
+                writer.writerow([level, name, int(townships), int(round(population))] + row.tolist())
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    groupings = load_groupings()
+    parser = argparse.ArgumentParser(description='依人口加權彙整各層級的語言使用比例')
+    parser.add_argument('--level', nargs='+', choices=levels(groupings),
+                        default=[level for level in levels(groupings) if level != 'township'],
+                        help='要列出的層級（預設為鄉鎮以外的所有層級）')
+    parser.add_argument('--year', type=int, help='普查年份（預設最新）')
+    parser.add_argument('--csv', help='將結果寫成 CSV 檔')
+    parser.add_argument('--no-cache', action='store_true', help='不讀寫磁碟快取')
+    args = parser.parse_args()
+    instrumentation.configure_logging()
+
+    store = census_ingest.ensure_store()
+    start = time.perf_counter()
+    results = aggregate(store, groupings, args.year, cache_dir=None if args.no_cache else AGGREGATE_CACHE_DIR)
+    seconds = time.perf_counter() - start
+
+    languages = list(census_ingest.MAP_LANGUAGES)
+    for level in args.level:
+        result = results[level]
+        label = groupings[level]['label'] if level in groupings else level
+        print(f"\n{label}（{level}）")
+        values = census_ingest._combined(result['primary'], result['secondary'])
+        for name, population, row in zip(result['regions'], result['population'], values):
+            shares = '  '.join(f"{language} {value:5.1f}" for language, value in zip(languages, row))
+            print(f"  {name:<12} 人口 {int(round(population)):>10,}  {shares}")
+    print(f"\n彙整 {len(results)} 個層級，耗時 {seconds * 1000:.1f} 毫秒；"
+          f"縣市彙整與報表總計最大相差 {county_check(store, args.year):.2f} 個百分點")
+    if args.csv:
+        write_csv(args.csv, results, args.level)
+        print(f"已寫入 {args.csv}")
@@ -0,0 +1,280 @@
+"""依設定檔批次產生多張語言地圖
+
+設定檔（JSON）：
+    {
+        "defaults": {"level": "county", "zoom": 9},
+        "matrix": {"region": [null, "Northern", "Southern"], "exclude_mandarin": [false, true]},
+        "maps": [{"name": "taipei_township", "level": "township", "counties": ["臺北市"]}]
+    }
+
+matrix 中各欄位的所有組合都會產生一張地圖（再加上 maps 中個別列出的地圖），
+其餘參數沿用 defaults。可用的參數與 create_language_map 相同，另有：
+    name    輸出檔名（未指定時由 matrix 的值組成）
+    region  報表的區域資料夾名稱（Northern、Middle…），等同列出該區域的縣市
+
+輸入（語言數據、邊界、設定、程式碼）都沒有變動的地圖會直接跳過。
+"""
+import argparse
+import contextlib
+import hashlib
+import inspect
+import io
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import folium
+
+import boundary_cache
+import census_ingest
+import instrumentation
+import taiwan_language_map_new as tlm
+
+logger = instrumentation.get_logger('batch_maps')
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 影響輸出結果的程式碼，任何一個改變都會讓所有地圖重建
+CODE_MODULES = [
+    'taiwan_language_map_new.py',
+    'language_model.py',
+    'census_ingest.py',
+    'county_names.py',
+    'geometry_prep.py',
+    'html_writer.py',
+    'boundary_cache.py',
+    'aggregation.py',
+    'groupings.json',
+    'static/language_map.js',
+    'static/language_popup.js',
+]
+MANIFEST_NAME = '.map_manifest.json'
+# 預設輸出到研究成果目錄
+DEFAULT_OUTPUT_DIR = os.path.normpath(os.path.join(CODE_DIR, '..', 'research', 'outputs', 'maps'))
+
+# 由批次程式統一控制、不能在設定檔中指定的參數
+RESERVED_OPTIONS = {'offline', 'refresh', 'cache_dir', 'sidecar_dir', 'geometry_report', 'store', 'groupings',
+                    'prepared', 'live'}
+MAP_OPTIONS = set(inspect.signature(tlm.create_language_map).parameters) - RESERVED_OPTIONS
+# 決定幾何前處理結果的參數（相同組合只需準備一次）
+GEOMETRY_OPTIONS = ['level', 'zoom', 'tolerance', 'precision', 'topojson']
+
+
+def code_version():
+    """相關程式碼與 folium 版本的雜湊"""
+    digest = hashlib.sha256(folium.__version__.encode('utf-8'))
+    for name in CODE_MODULES:
+        with open(os.path.join(CODE_DIR, name), 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def _slug(value):
+    """設定值轉成檔名的一部分"""
+    if isinstance(value, bool):
+        return 'on' if value else 'off'
+    if isinstance(value, (list, tuple)):
+        return '+'.join(_slug(item) for item in value)
+    return str(value).replace('/', '_').replace('&', '_').replace(' ', '_')
+
+
+def expand_specs(config):
+    """展開設定檔中的 matrix 與 maps，回傳地圖設定列表（每個都有 name）"""
+    defaults = config.get('defaults', {})
+    matrix = config.get('matrix', {})
+    specs = []
+
+    if matrix or not config.get('maps'):
+        keys = list(matrix)
+        for values in itertools.product(*(matrix[key] for key in keys)):
+            spec = dict(defaults)
+            spec.update(zip(keys, values))
+            if 'name' not in spec:
+                parts = [f"{key}-{_slug(value)}" for key, value in zip(keys, values) if value is not None]
+                spec['name'] = '_'.join(parts) or 'map'
+            specs.append(spec)
+    for entry in config.get('maps', []):
+        spec = dict(defaults)
+        spec.update(entry)
+        specs.append(spec)
+
+    names = [spec['name'] for spec in specs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"地圖名稱重複：{', '.join(duplicates)}")
+    for spec in specs:
+        unknown = set(spec) - MAP_OPTIONS - {'name', 'region'}
+        if unknown:
+            raise ValueError(f"{spec['name']}：不支援的參數 {', '.join(sorted(unknown))}")
+    return specs
+
+
+def map_options(spec, groups):
+    """將設定轉成 create_language_map 的參數（region 換成縣市列表）"""
+    options = {key: value for key, value in spec.items() if key in MAP_OPTIONS}
+    region = spec.get('region')
+    if region:
+        if region not in groups:
+            raise ValueError(f"{spec['name']}：找不到區域 {region}（可用：{', '.join(groups)}）")
+        options['counties'] = sorted(set(options.get('counties') or []) | set(groups[region]))
+    return options
+
+
+def _geometry_args(options):
+    defaults = inspect.signature(tlm.create_language_map).parameters
+    return tuple(options.get(key, defaults[key].default) for key in GEOMETRY_OPTIONS)
+
+
+def input_key(options, data_digest, geometry_digest, version):
+    """一張地圖所有輸入的雜湊，與上次相同時可跳過"""
+    content = json.dumps({
+        'options': options,
+        'data': data_digest,
+        'geometry': geometry_digest,
+        'code': version,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def render_map(name, options, output, cache_dir, stream=False):
+    """在工作行程中產生一張地圖，回傳 (名稱, 秒數, 是否成功, 輸出訊息)"""
+    start = time.perf_counter()
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log), instrumentation.capture_log(log):
+        m = tlm.create_language_map(
+            offline=True, cache_dir=cache_dir,
+            sidecar_dir=os.path.splitext(output)[0] + '_years', **options
+        )
+        if m:
+            tlm.save_map(m, output, stream)
+    return name, time.perf_counter() - start, m is not None, log.getvalue()
+
+
+def _load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def run_batch(config, output_dir, cache_dir=boundary_cache.DEFAULT_CACHE_DIR, workers=None,
+              offline=False, force=False, stream=False):
+    """批次產生地圖，回傳每張地圖的結果列表"""
+    wall_start = time.perf_counter()
+    specs = expand_specs(config)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # 在主行程先準備好共用的快取（語言資料檔、各組幾何前處理結果），工作行程只讀快取
+    store = census_ingest.ensure_store()
+    data_digest = census_ingest.store_digest(store)
+    groups = census_ingest.region_counties(store)
+    version = code_version()
+
+    jobs = []
+    prepared = {}
+    for spec in specs:
+        options = map_options(spec, groups)
+        geometry = _geometry_args(options)
+        if geometry not in prepared:
+            level, zoom, tolerance, precision, topojson = geometry
+            result = tlm.load_prepared_boundaries(level, offline, False, cache_dir, zoom, tolerance,
+                                                  precision, topojson)
+            entry = boundary_cache.cache_entry(tlm.boundary_url(level), cache_dir)
+            prepared[geometry] = entry['sha256'] if result and entry else None
+        output = os.path.join(output_dir, spec['name'] + '.html')
+        # 串流寫出的 HTML 位元組不同，切換方式時重新產生
+        key = input_key(dict(options, stream=True) if stream else options, data_digest, prepared[geometry], version)
+        jobs.append((spec['name'], options, output, key, prepared[geometry] is not None))
+
+    manifest = _load_manifest(output_dir)
+    results = []
+    pending = []
+    for name, options, output, key, has_geometry in jobs:
+        if not has_geometry:
+            results.append({'name': name, 'status': 'failed', 'seconds': 0.0, 'message': '缺少邊界數據'})
+        elif not force and manifest.get(name, {}).get('key') == key and os.path.exists(output):
+            results.append({'name': name, 'status': 'skipped', 'seconds': 0.0})
+        else:
+            pending.append((name, options, output, key))
+
+    if pending:
+        # 已完成的地圖即使批次中斷也寫進清單，下次不必重新產生
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(render_map, name, options, output, cache_dir, stream): (name, key)
+                           for name, options, output, key in pending}
+                for future in as_completed(futures):
+                    name, key = futures[future]
+                    try:
+                        _, seconds, ok, log = future.result()
+                    except Exception as e:
+                        # render_map 拋出例外，或工作行程異常結束（例如記憶體不足被終止）
+                        seconds, ok, log = 0.0, False, f'{type(e).__name__}: {e}'
+                    results.append({'name': name, 'status': 'built' if ok else 'failed',
+                                    'seconds': round(seconds, 3), 'message': log.strip()})
+                    if ok:
+                        manifest[name] = {'key': key, 'seconds': round(seconds, 3)}
+                    if ok:
+                        logger.info(f"  完成 {name}（{seconds:.2f} 秒）")
+                    else:
+                        logger.error(f"  失敗 {name}（{seconds:.2f} 秒）")
+        finally:
+            _save_manifest(output_dir, manifest)
+
+    order = {spec['name']: i for i, spec in enumerate(specs)}
+    results.sort(key=lambda row: order[row['name']])
+    return results, time.perf_counter() - wall_start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='依設定檔批次產生語言地圖')
+    parser.add_argument('config', help='地圖設定檔（JSON）')
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR, help='輸出目錄')
+    parser.add_argument('--cache-dir', default=boundary_cache.DEFAULT_CACHE_DIR, help='邊界快取目錄')
+    parser.add_argument('--workers', type=int, help='平行產生的行程數（預設為 CPU 數）')
+    parser.add_argument('--offline', action='store_true', help='只使用本地快取的邊界數據，不連網')
+    parser.add_argument('--force', action='store_true', help='忽略清單，全部重新產生')
+    parser.add_argument('--stream', action='store_true', help='以串流方式寫出 HTML（大量區域時記憶體較少）')
+    parser.add_argument('--report', help='將每張地圖的結果寫成 JSON 檔')
+    args = parser.parse_args()
+    instrumentation.configure_logging()
+
+    with open(args.config, 'r', encoding='utf-8') as file:
+        config = json.load(file)
+    try:
+        results, wall_seconds = run_batch(config, args.output_dir, args.cache_dir, args.workers,
+                                          args.offline, args.force, args.stream)
+    except ValueError as e:
+        print(f"設定檔錯誤：{e}")
+        return 1
+
+    status_names = {'built': '產生', 'skipped': '未變動', 'failed': '失敗'}
+    for row in results:
+        print(f"{row['name']:<40} {status_names[row['status']]:<6} {row['seconds']:>8.2f} 秒")
+        if row['status'] == 'failed' and row.get('message'):
+            print(f"    {row['message']}")
+    counts = {status: sum(row['status'] == status for row in results) for status in status_names}
+    print(f"共 {len(results)} 張：產生 {counts['built']}、未變動 {counts['skipped']}、失敗 {counts['failed']}，"
+          f"總耗時 {wall_seconds:.2f} 秒")
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as file:
+            json.dump({'wall_seconds': round(wall_seconds, 3), 'maps': results}, file, ensure_ascii=False, indent=2)
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""量測 create_language_map 各階段的耗時、記憶體與輸出大小
+
+用法：
+    python benchmarks/bench_pipeline.py --geojson twCounty2010.geo.json --scale 1 20 100 --output before.json
+    python benchmarks/bench_pipeline.py --scale 1 20 100 --output after.json --compare before.json
+
+依 create_language_map 的順序分別計時：語言數據載入（每次從資料檔讀起）、邊界載入（已簡化的快取）、名稱對應、
+圖層建立、彈窗、頁面腳本與 HTML 輸出（m.save，--stream 時改以 html_writer 串流寫出）。
+邊界簡化只在 1 倍時做一次（另外記錄在 meta），--scale 把簡化後的區域複製成多份（稍微平移），
+模擬鄉鎮、村里等級的區域數量；名稱對應之後的階段都以放大後的區域量測。
+每個設定先跑一次只計時，再開 tracemalloc 跑一次記錄各階段的峰值記憶體（--no-memory 時略過，
+tracemalloc 會讓流程慢數倍，放大 100 倍時尤其明顯）。
+結果寫成 JSON，--compare 與之前（例如上一個 commit）的結果逐階段比較。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import folium
+import numpy as np
+
+import boundary_cache
+import language_model
+import taiwan_language_map_new as tlm
+from bench_render_modes import scale_geojson
+
+STAGES = ['data_load', 'geometry_load', 'name_resolution', 'layers', 'popups', 'page_script', 'save']
+
+
+def git_commit():
+    """目前的 commit（不在 git 工作目錄中時回傳 None）"""
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def run_pipeline(cache_dir, factor, batched, zoom, output_dir, memory=False, stream=False):
+    """依 create_language_map 的步驟建立一次地圖，回傳 {階段: {seconds, peak_bytes}} 與輸出資訊"""
+    stages = {}
+
+    def timed(name, func, *args, **kwargs):
+        if memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        stages[name] = {
+            'seconds': round(time.perf_counter() - start, 4),
+            'peak_bytes': tracemalloc.get_traced_memory()[1] if memory else None,
+        }
+        return result
+
+    # 每次量測都用新的 LanguageMap，避免 default_map() 已載入的數據讓之後的量測變成 0
+    data, notes = timed('data_load', tlm.load_language_data, tlm.LanguageMap())
+    prepared = timed('geometry_load', tlm.load_prepared_boundaries, 'county', True, False, cache_dir, zoom)
+    geojson = scale_geojson(prepared[0], factor)
+
+    def resolve_names():
+        tlm.stamp_regions(geojson, 'county')
+        for feature in geojson['features']:
+            feature['properties']['row'] = language_model.region_row(data, feature['properties']['region_name'])
+    timed('name_resolution', resolve_names)
+
+    m = folium.Map(location=[23.5, 121], zoom_start=7.5, tiles='CartoDB positron')
+    layer = timed('layers', tlm.create_language_layers, m, geojson, False, None, batched, data)
+    layer.add_to(m)
+
+    def popups():
+        # 頁面上的彈窗在點擊時才產生；這裡量測伺服器端以同一份模板產生所有區域彈窗的成本
+        tlm.add_popup_assets(m)
+        for feature in geojson['features']:
+            name = feature['properties']['region_name']
+            tlm.create_popup_content(name, language_model.region_values(data, name), False, notes)
+    timed('popups', popups)
+
+    def page_script():
+        m.get_root().html.add_child(tlm.script_element('language_map.js', 'languageMapConfig', {
+            'layer': layer.get_name(),
+            'data': language_model.to_page_json(data),
+            'notes': notes,
+            'noDataColor': language_model.NO_DATA_COLOR,
+            'styles': {'data': tlm.REGION_STYLE, 'noData': tlm.NO_DATA_STYLE, 'highlight': tlm.HIGHLIGHT_STYLE},
+            'bindHighlight': False,
+            'exclude': ['華語'],
+            'excludeMandarin': False,
+            'years': [],
+            'year': None,
+            'yearFiles': {},
+        }))
+        tlm.add_legend(m)
+    timed('page_script', page_script)
+
+    path = os.path.join(output_dir, f"x{factor}_{'batched' if batched else 'per_feature'}.html")
+    timed('save', tlm.save_map, m, path, stream)
+    return stages, {'features': len(geojson['features']), 'html_bytes': os.path.getsize(path)}
+
+
+def _quiet(func, *args, **kwargs):
+    """執行時不輸出載入訊息"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+def benchmark(source, scales, modes, zoom, memory=True, stream=False):
+    """各放大倍數 × 輸出方式各跑一次，回傳 (meta, 結果列表)"""
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        cache_dir = os.path.join(workdir, 'cache')
+        content = json.dumps(source, ensure_ascii=False).encode('utf-8')
+        digest = boundary_cache.store(tlm.TAIWAN_GEOJSON_URL, content, cache_dir)
+
+        # 第一次載入時完成邊界簡化並寫入快取，之後各次量測都是讀取快取
+        start = time.perf_counter()
+        _quiet(tlm.load_prepared_boundaries, 'county', True, False, cache_dir, zoom)
+        prepare_seconds = time.perf_counter() - start
+        # 資料檔需要重建時先建好，量測到的只是讀取資料檔的時間
+        _quiet(tlm.LanguageMap().table, 'county')
+
+        for factor in scales:
+            for mode in modes:
+                batched = mode == 'batched'
+                stages, output = _quiet(run_pipeline, cache_dir, factor, batched, zoom, workdir, False, stream)
+                if memory:
+                    tracemalloc.start()
+                    try:
+                        memory_stages, _ = _quiet(run_pipeline, cache_dir, factor, batched, zoom, workdir, True, stream)
+                    finally:
+                        tracemalloc.stop()
+                    for name, stage in stages.items():
+                        stage['peak_bytes'] = memory_stages[name]['peak_bytes']
+                row = {
+                    'scale': factor,
+                    'mode': mode,
+                    'features': output['features'],
+                    'html_bytes': output['html_bytes'],
+                    'total_seconds': round(sum(stage['seconds'] for stage in stages.values()), 4),
+                    'peak_bytes': max(stage['peak_bytes'] for stage in stages.values()) if memory else None,
+                    'stages': stages,
+                }
+                results.append(row)
+                print_row(row)
+
+    meta = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'folium': folium.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'fixture_sha256': digest,
+        'fixture_features': len(source['features']),
+        'zoom': zoom,
+        'stream': stream,
+        'geometry_prepare_seconds': round(prepare_seconds, 4),
+        # 整個行程的最大常駐記憶體（Linux 為 KB）
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    return meta, results
+
+
+def print_row(row):
+    stages = '  '.join(f"{name} {stage['seconds']:.3f}" for name, stage in row['stages'].items())
+    peak = f"{row['peak_bytes'] / 2 ** 20:7.1f} MB" if row['peak_bytes'] is not None else '      - MB'
+    print(f"x{row['scale']:<4} {row['mode']:<12} {row['features']:>6} 區域  {row['html_bytes']:>12,} bytes  "
+          f"峰值 {peak}  共 {row['total_seconds']:.3f}s  |  {stages}")
+
+
+def compare(results, baseline, meta):
+    """與之前的結果逐階段比較，列印耗時與大小的變化"""
+    previous = {(row['scale'], row['mode']): row for row in baseline['results']}
+    print(f"\n與 {baseline['meta'].get('commit') or '之前的結果'} 比較（耗時 / HTML 大小 / 峰值記憶體的變化）")
+    for key in ('fixture_sha256', 'zoom'):
+        if baseline['meta'].get(key) != meta[key]:
+            print(f"注意：兩次量測的 {key} 不同，結果不能直接比較")
+    for row in results:
+        old = previous.get((row['scale'], row['mode']))
+        if not old:
+            continue
+
+        def change(new, before):
+            return f"{(new - before) / before * 100:+6.1f}%" if new is not None and before else '     -'
+        stages = '  '.join(f"{name} {change(stage['seconds'], old['stages'][name]['seconds'])}"
+                           for name, stage in row['stages'].items() if name in old['stages'])
+        print(f"x{row['scale']:<4} {row['mode']:<12} 共 {change(row['total_seconds'], old['total_seconds'])}  "
+              f"HTML {change(row['html_bytes'], old['html_bytes'])}  "
+              f"記憶體 {change(row['peak_bytes'], old['peak_bytes'])}  |  {stages}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='量測地圖產生流程各階段的耗時、記憶體與輸出大小')
+    parser.add_argument('--geojson', help='縣市邊界 GeoJSON（預設讀取邊界快取）')
+    parser.add_argument('--cache-dir', default=boundary_cache.DEFAULT_CACHE_DIR, help='邊界快取目錄')
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 20, 100], help='區域數量的放大倍數')
+    parser.add_argument('--modes', nargs='+', choices=['batched', 'per_feature'],
+                        default=['batched', 'per_feature'], help='圖層的輸出方式')
+    parser.add_argument('--zoom', type=float, default=10, help='邊界簡化的縮放層級')
+    parser.add_argument('--no-memory', action='store_true', help='不以 tracemalloc 量測峰值記憶體')
+    parser.add_argument('--stream', action='store_true', help='以串流方式寫出 HTML（html_writer）')
+    parser.add_argument('--output', help='將結果寫成 JSON 檔')
+    parser.add_argument('--compare', help='與之前寫出的 JSON 結果比較')
+    args = parser.parse_args()
+
+    if args.geojson:
+        with open(args.geojson, 'r', encoding='utf-8') as file:
+            source = json.load(file)
+    else:
+        source = boundary_cache.read_cached(tlm.TAIWAN_GEOJSON_URL, args.cache_dir)
+    if not source:
+        print("找不到邊界數據，請用 --geojson 指定檔案或先匯入快取")
+        return 1
+
+    meta, results = benchmark(source, args.scale, args.modes, args.zoom, not args.no_memory, args.stream)
+    print(f"邊界簡化 {meta['geometry_prepare_seconds']:.2f}s，最大常駐記憶體 {meta['max_rss_kb'] / 1024:.0f} MB")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            compare(results, json.load(file), meta)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'meta': meta, 'stages': STAGES, 'results': results}, file, ensure_ascii=False, indent=2)
+        print(f"結果已寫入 {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""比較空間索引的批次座標查詢與逐點測試每個多邊形的吞吐量
+
+用法：
+    python benchmarks/bench_point_lookup.py --geojson twCounty2010.geo.json --points 100000 1000000
+    python benchmarks/bench_point_lookup.py --level township --workers 1 4 --output lookup.json
+
+座標在邊界範圍內均勻隨機產生（固定亂數種子，含海上的點）。逐點測試對每個座標以純 Python
+的射線法檢查所有多邊形的所有邊，只量測 --naive-points 個座標再換算成每秒點數，
+同時確認兩種方法在這些座標上的結果相同。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+
+import boundary_cache
+import geometry_prep
+import point_lookup
+import taiwan_language_map_new as tlm
+
+
+def naive_locate(geojson, lon, lat):
+    """逐點檢查每個 feature 的每個多邊形（奇偶規則），回傳第一個包含座標的 feature 編號"""
+    polygons = [
+        (feature_id, [[tuple(point[:2]) for point in ring] for ring in polygon])
+        for feature_id, feature in enumerate(geojson['features'])
+        for polygon in geometry_prep.polygons(feature['geometry'])
+    ]
+    result = []
+    for x, y in zip(lon, lat):
+        found = point_lookup.NO_REGION
+        for feature_id, rings in polygons:
+            inside = False
+            for ring in rings:
+                for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+                    if (y0 > y) != (y1 > y) and x < x0 + (y - y0) * (x1 - x0) / (y1 - y0):
+                        inside = not inside
+            if inside:
+                found = feature_id
+                break
+        result.append(found)
+    return np.array(result, dtype=np.int32)
+
+
+def random_points(index, count, seed=0):
+    """在所有多邊形外框的範圍內均勻產生座標"""
+    bounds = index['polygon_bounds']
+    rng = np.random.default_rng(seed)
+    lon = rng.uniform(bounds[:, 0].min(), bounds[:, 2].max(), count)
+    lat = rng.uniform(bounds[:, 1].min(), bounds[:, 3].max(), count)
+    return lon, lat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='量測批次座標查詢的吞吐量')
+    parser.add_argument('--geojson', help='邊界 GeoJSON（預設讀取邊界快取）')
+    parser.add_argument('--level', choices=['county', 'township'], default='county', help='讀取快取時的行政區層級')
+    parser.add_argument('--cache-dir', default=boundary_cache.DEFAULT_CACHE_DIR, help='邊界快取目錄')
+    parser.add_argument('--points', type=int, nargs='+', default=[100_000, 1_000_000], help='查詢的座標數')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1], help='平行查詢的行程數')
+    parser.add_argument('--naive-points', type=int, default=2000, help='逐點測試量測的座標數')
+    parser.add_argument('--output', help='將結果寫成 JSON 檔')
+    args = parser.parse_args()
+
+    if args.geojson:
+        with open(args.geojson, 'r', encoding='utf-8') as file:
+            geojson = json.load(file)
+    else:
+        geojson = boundary_cache.read_cached(tlm.boundary_url(args.level), args.cache_dir)
+    if not geojson:
+        print("找不到邊界數據，請用 --geojson 指定檔案或先匯入快取")
+        return 1
+
+    start = time.perf_counter()
+    index = point_lookup.build_index(geojson)
+    build_seconds = time.perf_counter() - start
+    print(f"{index['features']} 個區域、{len(index['polygon_bounds'])} 個多邊形、{len(index['edges']):,} 條邊，"
+          f"建立索引 {build_seconds:.3f} 秒")
+
+    lon, lat = random_points(index, args.naive_points)
+    start = time.perf_counter()
+    expected = naive_locate(geojson, lon, lat)
+    naive_rate = args.naive_points / (time.perf_counter() - start)
+    agree = bool((point_lookup.locate(index, lon, lat) == expected).all())
+    print(f"逐點測試    {args.naive_points:>10,} 點  每秒 {naive_rate:>12,.0f} 點  結果一致：{'是' if agree else '否'}")
+
+    results = []
+    for count in args.points:
+        lon, lat = random_points(index, count)
+        for workers in args.workers:
+            start = time.perf_counter()
+            ids = point_lookup.locate(index, lon, lat, workers=workers)
+            seconds = time.perf_counter() - start
+            row = {
+                'points': count,
+                'workers': workers,
+                'seconds': round(seconds, 4),
+                'points_per_second': round(count / seconds),
+                'inside': int((ids != point_lookup.NO_REGION).sum()),
+                'speedup': round(count / seconds / naive_rate, 1),
+            }
+            results.append(row)
+            print(f"空間索引 ×{workers:<2} {count:>10,} 點  每秒 {row['points_per_second']:>12,} 點  "
+                  f"{seconds:.3f} 秒  為逐點測試的 {row['speedup']:,.0f} 倍")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({
+                'features': index['features'],
+                'polygons': len(index['polygon_bounds']),
+                'edges': len(index['edges']),
+                'build_seconds': round(build_seconds, 4),
+                'naive_points_per_second': round(naive_rate),
+                'naive_agrees': agree,
+                'results': results,
+            }, file, ensure_ascii=False, indent=2)
+        print(f"結果已寫入 {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""比較逐縣市圖層與合併圖層兩種輸出方式的 HTML 大小與載入成本
+
+用法：
+    python benchmarks/bench_render_modes.py --geojson twCounty2010.geo.json --scale 1 15
+
+--scale 會把每個縣市複製成多份（稍微平移），模擬鄉鎮等級的區域數量。
+頁面可互動前的成本以「JavaScript 物件數」與 Node.js 解析頁面腳本的時間估計
+（有安裝 node 時才會量測）。
+"""
+import argparse
+import copy
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import boundary_cache
+import geometry_prep
+import taiwan_language_map_new as tlm
+
+
+def scale_geojson(geojson, factor):
+    """將每個區域複製 factor 份並平移，保留原本的縣市名稱以便對應語言數據"""
+    if factor <= 1:
+        return geojson
+    features = []
+    for copy_index in range(factor):
+        offset = copy_index * 0.01
+        for feature in geojson['features']:
+            clone = copy.deepcopy(feature)
+            for polygon in geometry_prep.polygons(clone['geometry']):
+                for ring in polygon:
+                    for point in ring:
+                        point[0] += offset
+            features.append(clone)
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def js_parse_ms(html):
+    """以 Node.js 編譯頁面內嵌腳本所需的時間（毫秒），沒有 node 時回傳 None"""
+    node = shutil.which('node')
+    if not node:
+        return None
+    scripts = re.findall(r'<script>(.*?)</script>', html, re.S)
+    with tempfile.NamedTemporaryFile('w', suffix='.js', delete=False, encoding='utf-8') as file:
+        file.write('\n;\n'.join(scripts))
+        path = file.name
+    try:
+        code = ("const vm=require('vm'),fs=require('fs');const src=fs.readFileSync(process.argv[1],'utf8');"
+                "const t=process.hrtime.bigint();new vm.Script(src);"
+                "console.log(Number(process.hrtime.bigint()-t)/1e6);")
+        result = subprocess.run([node, '-e', code, path], capture_output=True, text=True)
+        return round(float(result.stdout.strip()), 1) if result.returncode == 0 else None
+    finally:
+        os.remove(path)
+
+
+def run_mode(cache_dir, batched, zoom, output_dir):
+    """建立一次地圖並記錄各項數據"""
+    start = time.perf_counter()
+    m = tlm.create_language_map(offline=True, cache_dir=cache_dir, zoom=zoom, batched=batched)
+    build_seconds = time.perf_counter() - start
+
+    path = os.path.join(output_dir, 'batched.html' if batched else 'per_feature.html')
+    start = time.perf_counter()
+    m.save(path)
+    save_seconds = time.perf_counter() - start
+
+    with open(path, 'r', encoding='utf-8') as file:
+        html = file.read()
+    return {
+        'mode': 'batched' if batched else 'per_feature',
+        'build_seconds': round(build_seconds, 3),
+        'save_seconds': round(save_seconds, 3),
+        'html_bytes': len(html.encode('utf-8')),
+        'geojson_layers': html.count('L.geoJson('),
+        'js_functions': html.count('function '),
+        'js_parse_ms': js_parse_ms(html),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比較逐縣市圖層與合併圖層的輸出成本')
+    parser.add_argument('--geojson', help='縣市邊界 GeoJSON（預設讀取邊界快取）')
+    parser.add_argument('--cache-dir', default=boundary_cache.DEFAULT_CACHE_DIR, help='邊界快取目錄')
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 15], help='區域數量的放大倍數')
+    parser.add_argument('--zoom', type=float, default=10, help='邊界簡化的縮放層級')
+    parser.add_argument('--output', help='將結果寫成 JSON 檔')
+    args = parser.parse_args()
+
+    if args.geojson:
+        with open(args.geojson, 'r', encoding='utf-8') as file:
+            source = json.load(file)
+    else:
+        source = boundary_cache.read_cached(tlm.TAIWAN_GEOJSON_URL, args.cache_dir)
+    if not source:
+        print("找不到邊界數據，請用 --geojson 指定檔案或先匯入快取")
+        return 1
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for factor in args.scale:
+            # 將放大後的邊界寫入暫存快取，讓 create_language_map 照常以離線模式讀取
+            cache_dir = os.path.join(workdir, f'cache_{factor}')
+            content = json.dumps(scale_geojson(source, factor), ensure_ascii=False).encode('utf-8')
+            boundary_cache.store(tlm.TAIWAN_GEOJSON_URL, content, cache_dir)
+
+            for batched in (False, True):
+                row = run_mode(cache_dir, batched, args.zoom, workdir)
+                row['scale'] = factor
+                row['features'] = len(source['features']) * max(factor, 1)
+                results.append(row)
+                print(f"x{factor:<4} {row['mode']:<12} {row['features']:>6} 區域  "
+                      f"{row['html_bytes']:>12,} bytes  圖層 {row['geojson_layers']:>5}  "
+                      f"建立 {row['build_seconds']:.2f}s  存檔 {row['save_seconds']:.2f}s  "
+                      f"JS 解析 {row['js_parse_ms'] if row['js_parse_ms'] is not None else '-'} ms")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
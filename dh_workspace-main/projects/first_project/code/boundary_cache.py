@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import instrumentation
+
+logger = instrumentation.get_logger('boundary_cache')
+
+# 預設快取目錄：data/processed/boundaries
+DEFAULT_CACHE_DIR = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'processed', 'boundaries'
+))
+INDEX_FILE = 'index.json'
+
+
+def _url_key(url):
+    """以 URL 的雜湊值作為索引鍵，避免特殊字元影響檔名"""
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+
+
+def _blob_path(cache_dir, digest):
+    """內容雜湊對應的快取檔案路徑"""
+    return os.path.join(cache_dir, 'blobs', digest + '.geo.json')
+
+
+def _load_index(cache_dir):
+    """讀取快取索引（URL -> 內容雜湊、ETag、Last-Modified）"""
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    try:
+        with open(index_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"快取索引損壞，將重新建立: {e}")
+        return {}
+
+
+def _save_index(cache_dir, index):
+    """先寫入暫存檔再取代，避免中斷時留下不完整的索引"""
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(index, file, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, index_path)
+
+
+def store(url, content, cache_dir=DEFAULT_CACHE_DIR, etag=None, last_modified=None):
+    """將下載或匯入的內容寫入快取，回傳內容的 SHA-256 雜湊"""
+    digest = hashlib.sha256(content).hexdigest()
+    blob_path = _blob_path(cache_dir, digest)
+
+    # 相同內容只存一份
+    if not os.path.exists(blob_path):
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        tmp_path = blob_path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(content)
+        os.replace(tmp_path, blob_path)
+
+    index = _load_index(cache_dir)
+    index[_url_key(url)] = {
+        'url': url,
+        'sha256': digest,
+        'etag': etag,
+        'last_modified': last_modified,
+        'fetched_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    _save_index(cache_dir, index)
+    return digest
+
+
+def cache_entry(url, cache_dir=DEFAULT_CACHE_DIR):
+    """取得某個 URL 的快取紀錄，沒有則回傳 None"""
+    entry = _load_index(cache_dir).get(_url_key(url))
+    if entry and os.path.exists(_blob_path(cache_dir, entry['sha256'])):
+        return entry
+    return None
+
+
+def read_cached(url, cache_dir=DEFAULT_CACHE_DIR):
+    """直接從本地快取讀取 GeoJSON，不連網"""
+    entry = cache_entry(url, cache_dir)
+    if not entry:
+        return None
+    with open(_blob_path(cache_dir, entry['sha256']), 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def fetch(url, cache_dir=DEFAULT_CACHE_DIR, timeout=10, retries=3, backoff=1.0):
+    """帶逾時與重試的下載；若伺服器回應 304 則沿用快取內容
+
+    會依快取中記錄的 ETag / Last-Modified 發出條件式請求，
+    內容未變更時不必重新下載整份檔案。
+    """
+    # 只有真正連網時才載入 requests，離線讀取快取不需要
+    import requests
+
+    entry = cache_entry(url, cache_dir)
+    headers = {}
+    if entry:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    last_error = None
+    for attempt in range(1, retries + 1):
+        try:
+            response = requests.get(url, headers=headers, timeout=timeout)
+            if response.status_code == 304 and entry:
+                return read_cached(url, cache_dir)
+            response.raise_for_status()
+            # 先確認內容是合法的 JSON 才寫入快取
+            data = json.loads(response.content)
+            store(url, response.content, cache_dir,
+                  etag=response.headers.get('ETag'),
+                  last_modified=response.headers.get('Last-Modified'))
+            return data
+        except (requests.RequestException, ValueError) as e:
+            last_error = e
+            # 4xx（逾時與限流除外）重試也不會成功
+            status = getattr(getattr(e, 'response', None), 'status_code', None)
+            if status and 400 <= status < 500 and status not in (408, 429):
+                break
+            if attempt < retries:
+                wait = backoff * (2 ** (attempt - 1))
+                logger.warning(f"下載失敗（第 {attempt} 次），{wait:.0f} 秒後重試：{e}")
+                time.sleep(wait)
+
+    logger.error(f"無法下載台灣地理數據：{last_error}")
+    return None
+
+
+def seed_cache(path, url, cache_dir=DEFAULT_CACHE_DIR):
+    """將本地的 GeoJSON 檔案匯入快取，供離線環境使用"""
+    with open(path, 'rb') as file:
+        content = file.read()
+    # 確認檔案內容可以解析
+    json.loads(content)
+    digest = store(url, content, cache_dir)
+    logger.info(f"已將 {path} 匯入快取（{digest[:12]}）")
+    return digest
+
+
+def export_cache(url, path, cache_dir=DEFAULT_CACHE_DIR):
+    """將快取內容複製到指定位置，方便搬到其他建置主機"""
+    entry = cache_entry(url, cache_dir)
+    if not entry:
+        return False
+    shutil.copyfile(_blob_path(cache_dir, entry['sha256']), path)
+    return True
+
+
+def load_boundaries(url, cache_dir=DEFAULT_CACHE_DIR, offline=False, refresh=False,
+                    timeout=10, retries=3):
+    """取得邊界 GeoJSON：預設優先讀快取，必要時才連網
+
+    - offline=True：只讀快取，完全不連網
+    - refresh=True：連網確認是否有更新（條件式請求）
+    - 連網失敗時退回使用舊的快取內容
+    """
+    if offline:
+        data = read_cached(url, cache_dir)
+        if data is None:
+            logger.error(f"離線模式下找不到快取：{url}（可用 --seed 匯入本地檔案）")
+        return data
+
+    if not refresh:
+        data = read_cached(url, cache_dir)
+        if data is not None:
+            return data
+
+    data = fetch(url, cache_dir, timeout=timeout, retries=retries)
+    if data is None:
+        data = read_cached(url, cache_dir)
+        if data is not None:
+            logger.warning("改用本地快取的地理數據")
+    return data
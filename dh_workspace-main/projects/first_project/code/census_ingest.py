@@ -0,0 +1,487 @@
+import csv
+import glob
+import hashlib
+import io
+import json
+import os
+import re
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import county_names
+import instrumentation
+import language_model
+
+logger = instrumentation.get_logger('census_ingest')
+
+# 普查報表所在目錄
+LANGUAGE_DATA_DIR = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'processed', 'Language_data'
+))
+# 所有報表解析後的欄式資料（單一 .npz 檔，內含各報表的 mtime / 雜湊清單）
+STORE_PATH = os.path.join(LANGUAGE_DATA_DIR, 'census_store.npz')
+# 人工整理的縣市備註（沿用 language_data.csv 的「備注」欄）
+NOTES_CSV = os.path.join(LANGUAGE_DATA_DIR, 'language_data.csv')
+
+# 資料檔格式版本；解析方式改變時遞增，舊版的資料檔會整個重新解析
+STORE_VERSION = 3
+
+# 固定的語言欄位順序，主要與次要使用語言都依此排列（主要語言沒有「不知或無」，填 0）
+LANGUAGE_SCHEMA = ['mandarin', 'taiwanese', 'hakka', 'indigenous', 'other', 'unknown']
+
+# 報表表頭（中文或英文）-> 固定欄位；比對前會去除空白並轉小寫
+HEADER_ALIASES = {
+    '國語': 'mandarin',
+    'mandarin': 'mandarin',
+    '閩南語': 'taiwanese',
+    'taiwanese': 'taiwanese',
+    '客語': 'hakka',
+    'hakka': 'hakka',
+    '原住民族語': 'indigenous',
+    'indigenous': 'indigenous',
+    '其他': 'other',
+    '其他語言': 'other',
+    'other': 'other',
+    'otherlanguage': 'other',
+    '不知或無': 'unknown',
+    'unknownornone': 'unknown',
+}
+
+# 地圖使用的語言名稱 -> 固定欄位（主要與次要相加）
+MAP_LANGUAGES = {
+    '華語': 'mandarin',
+    '閩南語': 'taiwanese',
+    '客家話': 'hakka',
+    '原住民語': 'indigenous',
+}
+
+TOWNSHIP_SECTION = '按鄉鎮市區別分'
+AGE_SECTION = '按年齡分'
+
+
+def clean_label(value):
+    """去除報表標籤中的全形空白與縮排"""
+    return re.sub(r'\s+', '', str(value)) if value is not None else ''
+
+
+def _to_number(value):
+    """報表中的數值欄位，空白或 '-' 視為 0"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace(',', ''))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _census_year(rows):
+    """從報表標題的「民國 N 年」推算西元年"""
+    for row in rows[:6]:
+        for value in row:
+            match = re.search(r'民國\s*(\d+)\s*年', str(value or ''))
+            if match:
+                return int(match.group(1)) + 1911
+    return None
+
+
+def _header_columns(rows):
+    """找出人口數與各語言欄位所在的欄號
+
+    回傳 (人口欄, 主要語言欄位, 次要語言欄位)，後兩者為「固定欄位 -> 欄號」。
+    表頭先列主要語言區塊，從重複出現的第一個欄位（國語）起是次要語言區塊；
+    之後的欄位一律屬於次要語言，只出現在次要區塊的「不知或無」也是。
+    人口欄以單位「（人）」/「(person)」辨認，標題列（…常住人口使用語言情形）不算。
+    """
+    population_column = None
+    for row in rows[:15]:
+        for column, value in enumerate(row):
+            text = clean_label(value).lower()
+            if population_column is None and ('人口（人）' in text or text.endswith('(person)')):
+                population_column = column
+        mapped = [(column, HEADER_ALIASES.get(clean_label(value).lower())) for column, value in enumerate(row)]
+        mapped = [(column, key) for column, key in mapped if key]
+        if len(mapped) > 1:
+            primary, secondary = {}, {}
+            block = primary
+            for column, key in mapped:
+                if block is primary and key in primary:
+                    block = secondary
+                block.setdefault(key, column)
+            return population_column, primary, secondary
+    return population_column, {}, {}
+
+
+def parse_workbook(path):
+    """解析一份縣市報表，回傳各分類（按鄉鎮市區別分、按年齡分…）的資料列"""
+    # openpyxl 只在解析報表時才需要，讀取已建好的資料檔不必載入
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    sections = {}
+    county = None
+    year = None
+    try:
+        for sheet in workbook.worksheets:
+            rows = list(sheet.iter_rows(values_only=True))
+            year = year or _census_year(rows)
+            population_column, primary, secondary = _header_columns(rows)
+            if population_column is None or not primary:
+                continue
+            if 'unknown' in primary:
+                raise ValueError(f'{path}：主要語言區塊不應有「不知或無」欄位（第 {primary["unknown"] + 1} 欄）')
+
+            section = None
+            for row in rows:
+                label = clean_label(row[1] if len(row) > 1 else None)
+                if label.startswith('按'):
+                    section = label
+                    sections.setdefault(section, [])
+                    continue
+                if label.startswith('註'):
+                    section = None
+                    continue
+                if not section or not label or row[population_column] is None:
+                    continue
+                sections[section].append({
+                    'label': label,
+                    'population': _to_number(row[population_column]),
+                    'primary': [_to_number(row[primary[key]]) if key in primary else 0.0
+                                for key in LANGUAGE_SCHEMA],
+                    'secondary': [_to_number(row[secondary[key]]) if key in secondary else 0.0
+                                  for key in LANGUAGE_SCHEMA],
+                })
+    finally:
+        workbook.close()
+
+    # 鄉鎮市區分類的第一列是縣市總計
+    townships = sections.get(TOWNSHIP_SECTION, [])
+    if townships:
+        county = county_names.canonical_name(townships[0]['label']) or townships[0]['label']
+    return {'path': path, 'county': county, 'year': year, 'sections': sections}
+
+
+def find_workbooks(data_dir=LANGUAGE_DATA_DIR):
+    """列出各區域資料夾中的縣市報表
+
+    其他普查年份的報表可放在子資料夾（例如 2010/Northern/Taipei.xlsx），
+    年份由報表標題判斷；資料夾最上層的彙整檔與 Excel 開啟報表時的暫存檔（~$ 開頭）不列入。
+    """
+    return sorted(
+        path for path in glob.glob(os.path.join(data_dir, '*', '**', '*.xlsx'), recursive=True)
+        if not os.path.basename(path).startswith('~$')
+    )
+
+
+def file_sha256(path):
+    """計算檔案內容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _workbook_rows(workbook, source):
+    """將一份報表攤平成資料列：(來源, 縣市, 年份, 分類, 序號, 標籤, 人口, 主要, 次要)"""
+    rows = []
+    for section, section_rows in workbook['sections'].items():
+        for position, row in enumerate(section_rows):
+            rows.append((source, workbook['county'] or '', workbook['year'] or 0, section, position,
+                         row['label'], row['population'], row['primary'], row['secondary']))
+    return rows
+
+
+def _read_notes(notes_csv=NOTES_CSV):
+    """讀取 language_data.csv 的備註欄，回傳 {標準縣市名稱: 備註}"""
+    notes = {}
+    if not notes_csv or not os.path.exists(notes_csv):
+        return notes
+    with open(notes_csv, 'r', encoding='utf-8-sig') as file:
+        for row in list(csv.reader(file))[2:]:
+            if len(row) > 5 and row[0].strip() and row[5].strip():
+                notes[county_names.canonical_name(row[0]) or row[0].strip()] = row[5].strip()
+    return notes
+
+
+def _notes_entry(notes_csv, old=None):
+    """備註檔的清單項目（路徑、大小、修改時間與 SHA-256），檔案不存在時回傳 None
+
+    路徑、大小與修改時間都與 old 相同時沿用舊的雜湊，不重新讀檔。
+    """
+    if not notes_csv or not os.path.exists(notes_csv):
+        return None
+    stat = os.stat(notes_csv)
+    entry = {'path': os.path.abspath(notes_csv), 'size': stat.st_size, 'mtime': stat.st_mtime}
+    if old and all(old.get(key) == value for key, value in entry.items()):
+        entry['sha256'] = old['sha256']
+    else:
+        entry['sha256'] = file_sha256(notes_csv)
+    return entry
+
+
+def _notes_fresh(store, notes_csv):
+    """資料檔中的備註是否與目前的備註檔相同（比對路徑、大小與修改時間）"""
+    if 'notes_manifest' not in store:
+        return False
+    old = json.loads(str(store['notes_manifest']))
+    if not notes_csv or not os.path.exists(notes_csv):
+        return old is None
+    stat = os.stat(notes_csv)
+    return old is not None and (old['path'], old['size'], old['mtime']) == (
+        os.path.abspath(notes_csv), stat.st_size, stat.st_mtime)
+
+
+def _store_data_dir(store):
+    """資料檔建立時的報表目錄（絕對路徑），舊資料檔沒有記錄時回傳 None"""
+    if store is None or 'data_dir' not in store:
+        return None
+    return str(store['data_dir'])
+
+
+def load_store(store_path=STORE_PATH):
+    """一次讀入整個欄式資料檔，回傳 {欄位: numpy 陣列}，檔案不存在時回傳 None"""
+    if not os.path.exists(store_path):
+        return None
+    with np.load(store_path) as store:
+        return {name: store[name] for name in store.files}
+
+
+def store_version(store):
+    """資料檔的格式版本（加入版本號之前的資料檔為 1）"""
+    return int(store['version']) if 'version' in store else 1
+
+
+def _store_manifest(store):
+    return json.loads(str(store['manifest'])) if store is not None else {}
+
+
+def build_store(paths=None, workers=None, store_path=STORE_PATH, notes_csv=NOTES_CSV,
+                data_dir=LANGUAGE_DATA_DIR, force=False):
+    """以多個行程平行解析報表並寫成單一 .npz 欄式資料檔
+
+    每份報表在清單中記錄大小、修改時間與 SHA-256；大小與修改時間不變、
+    或內容雜湊不變的報表直接沿用舊資料，只有變動過的報表會重新解析。
+    回傳 (store, 重新解析的報表數, 沿用的報表數)。
+    """
+    paths = paths or find_workbooks(data_dir)
+    old_store = None if force else load_store(store_path)
+    if old_store is not None and store_version(old_store) != STORE_VERSION:
+        old_store = None
+    old_manifest = _store_manifest(old_store)
+    old_notes = json.loads(str(old_store['notes_manifest'])) if old_store and 'notes_manifest' in old_store else None
+    # 資料檔原本對應另一個報表目錄時，大小與修改時間相同也要重新計算雜湊
+    same_dir = _store_data_dir(old_store) == os.path.abspath(data_dir)
+
+    manifest = {}
+    reused, changed = [], []
+    for path in paths:
+        source = os.path.relpath(path, data_dir).replace(os.sep, '/')
+        stat = os.stat(path)
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime}
+        old = old_manifest.get(source)
+        if same_dir and old and old['size'] == entry['size'] and old['mtime'] == entry['mtime']:
+            entry['sha256'] = old['sha256']
+        else:
+            entry['sha256'] = file_sha256(path)
+        manifest[source] = entry
+        if old and old['sha256'] == entry['sha256']:
+            reused.append(source)
+        else:
+            changed.append((source, path))
+
+    rows = []
+    if reused:
+        keep = np.isin(old_store['source'], reused)
+        rows.extend(zip(*(old_store[name][keep].tolist() for name in
+                          ('source', 'county', 'year', 'section', 'position', 'label',
+                           'population', 'primary', 'secondary'))))
+    if len(changed) == 1:
+        # 只改了一份報表時（例如編輯中）直接解析，省下啟動行程的時間
+        source, path = changed[0]
+        rows.extend(_workbook_rows(parse_workbook(path), source))
+    elif changed:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for (source, _), workbook in zip(changed, pool.map(parse_workbook, [path for _, path in changed])):
+                rows.extend(_workbook_rows(workbook, source))
+    # 依來源與原本的列順序排列，結果與全部重新解析時相同
+    order = {source: i for i, source in enumerate(manifest)}
+    sections = {}
+    rows.sort(key=lambda row: (order[row[0]], sections.setdefault((row[0], row[3]), len(sections)), row[4]))
+
+    notes = _read_notes(notes_csv)
+    columns = list(zip(*rows)) if rows else [[]] * 9
+    store = {
+        'source': np.array(columns[0], dtype=str),
+        'county': np.array(columns[1], dtype=str),
+        'year': np.array(columns[2], dtype=np.int16),
+        'section': np.array(columns[3], dtype=str),
+        'position': np.array(columns[4], dtype=np.int32),
+        'label': np.array(columns[5], dtype=str),
+        'population': np.array(columns[6], dtype=np.int64),
+        'primary': np.array(columns[7], dtype=np.float32).reshape(-1, len(LANGUAGE_SCHEMA)),
+        'secondary': np.array(columns[8], dtype=np.float32).reshape(-1, len(LANGUAGE_SCHEMA)),
+        'schema': np.array(LANGUAGE_SCHEMA),
+        'note_county': np.array(list(notes), dtype=str),
+        'note_text': np.array(list(notes.values()), dtype=str),
+        'manifest': np.array(json.dumps(manifest, ensure_ascii=False)),
+        'notes_manifest': np.array(json.dumps(_notes_entry(notes_csv, old_notes), ensure_ascii=False)),
+        'data_dir': np.array(os.path.abspath(data_dir)),
+        'version': np.array(STORE_VERSION),
+    }
+
+    # 先寫入暫存檔再取代，避免中斷時留下不完整的資料檔
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **store)
+    os.makedirs(os.path.dirname(store_path), exist_ok=True)
+    tmp_path = store_path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(buffer.getvalue())
+    os.replace(tmp_path, store_path)
+    return store, len(changed), len(reused)
+
+
+def ensure_store(workers=None, store_path=STORE_PATH, data_dir=LANGUAGE_DATA_DIR, notes_csv=NOTES_CSV):
+    """讀取欄式資料檔；換了報表目錄，或 data_dir 的報表、備註檔有新增、刪除或修改時先增量重建"""
+    store = load_store(store_path)
+    if store is not None and store_version(store) == STORE_VERSION:
+        manifest = _store_manifest(store)
+        paths = find_workbooks(data_dir)
+        sources = [os.path.relpath(path, data_dir).replace(os.sep, '/') for path in paths]
+        fresh = (_store_data_dir(store) == os.path.abspath(data_dir) and _notes_fresh(store, notes_csv)
+                 and sorted(sources) == sorted(manifest))
+        if fresh and all(
+            os.path.getsize(path) == manifest[source]['size']
+            and os.path.getmtime(path) == manifest[source]['mtime']
+            for path, source in zip(paths, sources)
+        ):
+            return store
+    store, _, _ = build_store(workers=workers, store_path=store_path, notes_csv=notes_csv, data_dir=data_dir)
+    return store
+
+
+def store_digest(store):
+    """資料檔內容的摘要（各報表的 SHA-256 與備註），用來判斷輸出是否需要重建"""
+    manifest = _store_manifest(store)
+    content = json.dumps({
+        'workbooks': {source: entry['sha256'] for source, entry in sorted(manifest.items())},
+        'notes': [store['note_county'].tolist(), store['note_text'].tolist()],
+    }, ensure_ascii=False)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def region_counties(store):
+    """依報表所在的區域資料夾分組縣市，例如 {'Northern': ['臺北市', ...]}"""
+    groups = {}
+    for source, county in sorted(set(zip(store['source'].tolist(), store['county'].tolist()))):
+        parts = source.split('/')
+        # 其他年份的報表放在年份資料夾下（2010/Northern/...）
+        region = parts[-2]
+        if county and county not in groups.setdefault(region, []):
+            groups[region].append(county)
+    return groups
+
+
+def _combined(primary, secondary, schema=LANGUAGE_SCHEMA):
+    """主要與次要使用比例相加，取出地圖使用的語言欄位（區域數 × 語言數）"""
+    columns = [list(schema).index(key) for key in MAP_LANGUAGES.values()]
+    return np.round(primary[:, columns] + secondary[:, columns], 1)
+
+
+def census_years(store):
+    """資料檔中有的普查年份（由舊到新）"""
+    return sorted(int(year) for year in np.unique(store['year']) if year)
+
+
+def _year_rows(store, year):
+    """指定年份的資料列遮罩；未指定時使用最新的年份"""
+    years = census_years(store)
+    if year is None and years:
+        year = years[-1]
+    return store['year'] == (year or 0)
+
+
+def county_language_data(store, year=None):
+    """縣市層級（各報表鄉鎮分類的總計列）的語言數據表與備註"""
+    rows = np.flatnonzero((store['section'] == TOWNSHIP_SECTION) & (store['position'] == 0)
+                          & _year_rows(store, year))
+    table = language_model.make_table(
+        store['county'][rows].tolist(),
+        _combined(store['primary'][rows], store['secondary'][rows], store['schema']),
+        list(MAP_LANGUAGES)
+    )
+    notes = dict(zip(store['note_county'].tolist(), store['note_text'].tolist()))
+    return table, notes
+
+
+def age_band_label(label):
+    """年齡層標籤轉成半形，例如「６－１４歲」->「6-14歲」"""
+    return unicodedata.normalize('NFKC', label)
+
+
+def county_age_data(store, year=None):
+    """縣市 × 年齡層的語言數據表（values 形狀為 縣市數 × 語言數 × 年齡層數）
+
+    各報表「按年齡分」的資料列一次取出，依縣市與年齡層的編號直接填入矩陣；
+    年齡層依報表中的順序排列，總計列不算年齡層。
+    """
+    rows = np.flatnonzero((store['section'] == AGE_SECTION) & (store['position'] > 0)
+                          & _year_rows(store, year))
+    counties = list(dict.fromkeys(store['county'][rows].tolist()))
+    county_ids = {county: i for i, county in enumerate(counties)}
+    positions, first, band_ids = np.unique(store['position'][rows], return_index=True, return_inverse=True)
+    values = np.full((len(counties), len(MAP_LANGUAGES), len(positions)), np.nan, dtype=np.float32)
+    values[[county_ids[county] for county in store['county'][rows].tolist()], :, band_ids] = _combined(
+        store['primary'][rows], store['secondary'][rows], store['schema']
+    )
+    bands = [age_band_label(label) for label in store['label'][rows][first].tolist()]
+    return language_model.make_table(counties, values, list(MAP_LANGUAGES), bands)
+
+
+def build_township_table(store, year=None):
+    """取出各鄉鎮市區的資料列（欄式，每個欄位一個陣列）"""
+    rows = np.flatnonzero((store['section'] == TOWNSHIP_SECTION) & (store['position'] > 0)
+                          & _year_rows(store, year))
+    county = store['county'][rows]
+    township = store['label'][rows]
+    return {
+        'region': np.char.add(county, township),
+        'county': county,
+        'township': township,
+        'year': store['year'][rows],
+        'population': store['population'][rows],
+        'primary': store['primary'][rows],
+        'secondary': store['secondary'][rows],
+    }
+
+
+def township_language_data(table):
+    """轉成地圖使用的語言數據表（區域為「縣市+鄉鎮」，數值為主要+次要使用比例）"""
+    return language_model.make_table(
+        table['region'].tolist(), _combined(table['primary'], table['secondary']), list(MAP_LANGUAGES)
+    )
+
+
+def load_township_data(workers=None, year=None, store=None):
+    """載入鄉鎮市區層級的語言數據，回傳 (語言數據表, 欄式表格)"""
+    table = build_township_table(ensure_store(workers) if store is None else store, year)
+    logger.info(f"成功載入 {len(table['region'])} 個鄉鎮市區的語言數據")
+    return township_language_data(table), table
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='將普查報表解析成單一欄式資料檔')
+    parser.add_argument('--workers', type=int, help='平行解析的行程數（預設為 CPU 數）')
+    parser.add_argument('--force', action='store_true', help='忽略清單，全部重新解析')
+    parser.add_argument('--store', default=STORE_PATH, help='輸出的 .npz 檔')
+    args = parser.parse_args()
+    instrumentation.configure_logging()
+
+    start = time.perf_counter()
+    store, parsed, reused = build_store(workers=args.workers, store_path=args.store, force=args.force)
+    print(f"重新解析 {parsed} 份、沿用 {reused} 份報表，共 {len(store['label'])} 列，"
+          f"耗時 {time.perf_counter() - start:.2f} 秒 -> {args.store}")
@@ -0,0 +1,203 @@
+import itertools
+
+# 縣市的標準名稱與行政區代碼
+COUNTY_CODES = {
+    '臺北市': '63000',
+    '新北市': '65000',
+    '桃園市': '68000',
+    '臺中市': '66000',
+    '臺南市': '67000',
+    '高雄市': '64000',
+    '基隆市': '10017',
+    '新竹市': '10018',
+    '嘉義市': '10020',
+    '新竹縣': '10004',
+    '苗栗縣': '10005',
+    '彰化縣': '10007',
+    '南投縣': '10008',
+    '雲林縣': '10009',
+    '嘉義縣': '10010',
+    '屏東縣': '10013',
+    '宜蘭縣': '10002',
+    '花蓮縣': '10015',
+    '臺東縣': '10014',
+    '澎湖縣': '10016',
+    '金門縣': '09020',
+    '連江縣': '09007',
+}
+
+# 異體字：標準字 -> 常見寫法
+CHAR_VARIANTS = {
+    '臺': ['台'],
+    '雲': ['云'],  # 云林縣 -> 雲林縣
+    '栗': ['慄'],  # 苗慄縣 -> 苗栗縣
+}
+
+# 因行政區劃調整而改名的縣市（2010 年的邊界資料仍使用舊名）
+FORMER_NAMES = {
+    '臺北縣': '新北市',
+    '桃園縣': '桃園市',
+    '臺中縣': '臺中市',
+    '臺南縣': '臺南市',
+    '高雄縣': '高雄市',
+}
+
+# 普查報表中的英文名稱
+ENGLISH_NAMES = {
+    'Taipei City': '臺北市',
+    'New Taipei City': '新北市',
+    'Taoyuan City': '桃園市',
+    'Taichung City': '臺中市',
+    'Tainan City': '臺南市',
+    'Kaohsiung City': '高雄市',
+    'Keelung City': '基隆市',
+    'Hsinchu City': '新竹市',
+    'Chiayi City': '嘉義市',
+    'Hsinchu County': '新竹縣',
+    'Miaoli County': '苗栗縣',
+    'Changhua County': '彰化縣',
+    'Nantou County': '南投縣',
+    'Yunlin County': '雲林縣',
+    'Chiayi County': '嘉義縣',
+    'Pingtung County': '屏東縣',
+    'Yilan County': '宜蘭縣',
+    'Hualien County': '花蓮縣',
+    'Taitung County': '臺東縣',
+    'Penghu County': '澎湖縣',
+    'Kinmen County': '金門縣',
+    'Lienchiang County': '連江縣',
+}
+
+CODE_TO_NAME = {code: name for name, code in COUNTY_CODES.items()}
+
+
+def fold_variants(name):
+    """將異體字統一成標準字"""
+    for standard, variants in CHAR_VARIANTS.items():
+        for variant in variants:
+            name = name.replace(variant, standard)
+    return name
+
+
+def _spellings(name):
+    """列出一個名稱所有的異體字寫法"""
+    options = [[char] + CHAR_VARIANTS.get(char, []) for char in name]
+    return {''.join(chars) for chars in itertools.product(*options)}
+
+
+def build_county_index():
+    """建立「各種寫法 -> 縣市代碼」的查詢表，只需在載入時建立一次"""
+    index = {}
+    aliases = {name: name for name in COUNTY_CODES}
+    aliases.update(FORMER_NAMES)
+    aliases.update(ENGLISH_NAMES)
+
+    for alias, canonical in aliases.items():
+        for spelling in _spellings(alias):
+            index[spelling] = COUNTY_CODES[canonical]
+    return index
+
+
+COUNTY_INDEX = build_county_index()
+
+
+def resolve_county(name, index=COUNTY_INDEX):
+    """將任意寫法的縣市名稱轉為縣市代碼，無法對應時回傳 None"""
+    if not name:
+        return None
+    name = name.strip()
+    code = index.get(name)
+    if code is None:
+        code = index.get(fold_variants(name))
+    return code
+
+
+def canonical_name(name, index=COUNTY_INDEX):
+    """將任意寫法的縣市名稱轉為標準名稱，無法對應時回傳 None"""
+    code = resolve_county(name, index)
+    return CODE_TO_NAME[code] if code else None
+
+
+def stamp_features(geojson, name_property='COUNTYNAME', index=COUNTY_INDEX):
+    """將縣市代碼與標準名稱寫入每個 feature 的屬性，回傳無法對應的名稱列表
+
+    之後的樣式與彈窗只要讀取 county_code / county_name 屬性即可。
+    """
+    unmatched = []
+    for feature in geojson['features']:
+        properties = feature.setdefault('properties', {})
+        raw_name = properties.get(name_property)
+        code = resolve_county(raw_name, index)
+        properties['county_code'] = code
+        properties['county_name'] = CODE_TO_NAME[code] if code else None
+        properties['region_name'] = properties['county_name']
+        if code is None:
+            unmatched.append(raw_name)
+    return unmatched
+
+
+def duplicate_aliases(geojson, key_property='county_name', name_properties=('COUNTYNAME',)):
+    """不同的原始名稱對應到同一區域的情形（例如臺中縣與臺中市），回傳 {區域: [原始名稱…]}"""
+    names = {}
+    for feature in geojson['features']:
+        properties = feature['properties']
+        key = properties.get(key_property)
+        if key is not None:
+            raw_name = ''.join(str(properties.get(name) or '') for name in name_properties)
+            names.setdefault(key, set()).add(raw_name)
+    return {key: sorted(raw) for key, raw in names.items() if len(raw) > 1}
+
+
+# 鄉鎮市區的行政層級字尾（比對時忽略，板橋市與板橋區視為同一地區）
+TOWNSHIP_SUFFIXES = '鄉鎮市區'
+
+# 改名後字根不同的鄉鎮（標準縣市名稱, 舊名稱） -> 現行名稱
+TOWNSHIP_RENAMES = {
+    ('高雄市', '三民鄉'): '那瑪夏區',  # 2008 年改名，避免與三民區混淆
+}
+
+
+def town_stem(name):
+    """去除空白與行政層級字尾，例如「中　區」->「中」、「板橋市」->「板橋」"""
+    name = fold_variants(''.join(str(name or '').split()))
+    if len(name) > 1 and name[-1] in TOWNSHIP_SUFFIXES:
+        name = name[:-1]
+    return name
+
+
+def build_township_index(townships, index=COUNTY_INDEX):
+    """建立「(縣市代碼, 鄉鎮字根) -> 鄉鎮鍵值」的查詢表
+
+    townships 為 (縣市名稱, 鄉鎮名稱, 鄉鎮鍵值) 的序列。
+    """
+    township_index = {}
+    for county, township, key in townships:
+        township_index[(resolve_county(county, index), town_stem(township))] = key
+    return township_index
+
+
+def resolve_township(county, township, township_index, index=COUNTY_INDEX):
+    """將邊界資料中的縣市與鄉鎮名稱對應到鄉鎮鍵值，無法對應時回傳 None"""
+    code = resolve_county(county, index)
+    if code is None:
+        return None
+    township = ''.join(str(township or '').split())
+    township = TOWNSHIP_RENAMES.get((CODE_TO_NAME[code], fold_variants(township)), township)
+    return township_index.get((code, town_stem(township)))
+
+
+def stamp_townships(geojson, township_index, county_property='COUNTYNAME',
+                    town_property='TOWNNAME', index=COUNTY_INDEX):
+    """將縣市與鄉鎮鍵值寫入每個 feature 的屬性，回傳無法對應的名稱列表"""
+    unmatched = []
+    for feature in geojson['features']:
+        properties = feature.setdefault('properties', {})
+        code = resolve_county(properties.get(county_property), index)
+        properties['county_code'] = code
+        properties['county_name'] = CODE_TO_NAME[code] if code else None
+        properties['region_name'] = resolve_township(
+            properties.get(county_property), properties.get(town_property), township_index, index
+        )
+        if properties['region_name'] is None:
+            unmatched.append(f"{properties.get(county_property)}{properties.get(town_property)}")
+    return unmatched
@@ -0,0 +1,415 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+
+import instrumentation
+
+logger = instrumentation.get_logger('geometry_prep')
+
+# 各縮放層級的簡化容許誤差（單位：經緯度），約為該層級一個像素的大小
+ZOOM_TOLERANCES = {
+    6: 0.02,
+    7: 0.01,
+    8: 0.005,
+    9: 0.0025,
+    10: 0.001,
+    11: 0.0005,
+    12: 0.0002,
+}
+
+# 座標保留的小數位數（5 位約等於 1 公尺）
+DEFAULT_PRECISION = 5
+
+
+def tolerance_for_zoom(zoom, tolerances=ZOOM_TOLERANCES):
+    """依縮放層級取得簡化容許誤差，未列出的層級以像素大小推算"""
+    zoom = int(math.floor(zoom))
+    if zoom in tolerances:
+        return tolerances[zoom]
+    # 一個像素對應的經度寬度
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def polygons(geometry):
+    """將 Polygon / MultiPolygon 統一成多邊形列表"""
+    if not geometry:
+        return []
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    return []
+
+
+def _clean_ring(ring, precision):
+    """座標取捨並移除連續重複的點，回傳不含結尾重複點的 tuple 列表"""
+    points = []
+    for x, y in (coord[:2] for coord in ring):
+        if precision is not None:
+            point = (round(x, precision), round(y, precision))
+        else:
+            point = (x, y)
+        if not points or points[-1] != point:
+            points.append(point)
+    if len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    return points
+
+
+def count_vertices(geometry):
+    """計算幾何的頂點數"""
+    return sum(len(ring) for polygon in polygons(geometry) for ring in polygon)
+
+
+def build_topology(geojson, precision=DEFAULT_PRECISION):
+    """將 GeoJSON 轉成共用邊（arc）的拓樸結構
+
+    相鄰縣市的邊界只會存成一條 arc，簡化時兩側會得到相同的結果，
+    不會出現縫隙或重疊。回傳 (arcs, shapes)，shapes 對應每個 feature，
+    內容為「多邊形 -> 環 -> arc 編號」，負數（~i）代表反向使用該 arc。
+    """
+    rings = []
+    for feature in geojson['features']:
+        feature_rings = []
+        for polygon in polygons(feature.get('geometry')):
+            polygon_rings = []
+            for ring in polygon:
+                points = _clean_ring(ring, precision)
+                if len(points) >= 3:
+                    polygon_rings.append(points)
+            if polygon_rings:
+                feature_rings.append(polygon_rings)
+        rings.append(feature_rings)
+
+    # 找出接合點：同一個點在不同環中的前後鄰點不同，代表邊界在此分岔
+    neighbours = {}
+    junctions = set()
+    for feature_rings in rings:
+        for polygon_rings in feature_rings:
+            for points in polygon_rings:
+                n = len(points)
+                for i, point in enumerate(points):
+                    pair = (points[i - 1], points[(i + 1) % n])
+                    seen = neighbours.get(point)
+                    if seen is None:
+                        neighbours[point] = pair
+                    elif seen != pair and seen != (pair[1], pair[0]):
+                        junctions.add(point)
+
+    arcs = []
+    arc_index = {}
+
+    def add_arc(points):
+        key = tuple(points)
+        if key in arc_index:
+            return arc_index[key]
+        reverse_key = key[::-1]
+        if reverse_key in arc_index:
+            return ~arc_index[reverse_key]
+        arc_index[key] = len(arcs)
+        arcs.append(list(points))
+        return len(arcs) - 1
+
+    shapes = []
+    for feature_rings in rings:
+        feature_shape = []
+        for polygon_rings in feature_rings:
+            polygon_shape = []
+            for points in polygon_rings:
+                cuts = [i for i, point in enumerate(points) if point in junctions]
+                if not cuts:
+                    # 沒有接合點的環（島嶼或完全被包圍的區域）：以最小點為起點，整圈作為一條 arc
+                    start = points.index(min(points))
+                    rotated = points[start:] + points[:start]
+                    polygon_shape.append([add_arc(rotated + [rotated[0]])])
+                    continue
+                rotated = points[cuts[0]:] + points[:cuts[0]] + [points[cuts[0]]]
+                offsets = [i - cuts[0] for i in cuts] + [len(points)]
+                ring_arcs = []
+                for start, end in zip(offsets, offsets[1:]):
+                    ring_arcs.append(add_arc(rotated[start:end + 1]))
+                polygon_shape.append(ring_arcs)
+            feature_shape.append(polygon_shape)
+        shapes.append(feature_shape)
+
+    return arcs, shapes
+
+
+def _segment_distance(point, start, end):
+    """點到線段的距離"""
+    px, py = point
+    ax, ay = start
+    bx, by = end
+    dx, dy = bx - ax, by - ay
+    if dx == 0 and dy == 0:
+        return math.hypot(px - ax, py - ay)
+    t = ((px - ax) * dx + (py - ay) * dy) / (dx * dx + dy * dy)
+    t = max(0.0, min(1.0, t))
+    return math.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+def simplify_arc(points, tolerance):
+    """Douglas-Peucker 簡化，保留兩端點；封閉的 arc 至少保留四個點"""
+    n = len(points)
+    if n <= 2 or tolerance <= 0:
+        return list(points)
+
+    closed = points[0] == points[-1]
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    # 封閉的 arc 前兩次分割一定保留，避免整個環退化成線
+    stack = [(0, n - 1, 2 if closed else 0)]
+    while stack:
+        first, last, forced = stack.pop()
+        if last - first < 2:
+            continue
+        max_distance = -1.0
+        index = first
+        for i in range(first + 1, last):
+            distance = _segment_distance(points[i], points[first], points[last])
+            if distance > max_distance:
+                max_distance = distance
+                index = i
+        if max_distance > tolerance or forced:
+            keep[index] = True
+            stack.append((first, index, max(forced - 1, 0)))
+            stack.append((index, last, max(forced - 1, 0)))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def _ring_from_arcs(arc_refs, arcs):
+    """依 arc 編號組回完整的環"""
+    ring = []
+    for ref in arc_refs:
+        points = arcs[ref] if ref >= 0 else arcs[~ref][::-1]
+        ring.extend(points if not ring else points[1:])
+    return ring
+
+
+def _ring_area(ring):
+    """環的面積（用於挑選退化時要保留的環）"""
+    return abs(sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:]))) / 2
+
+
+def _kept_shapes(arcs, shapes, original_arcs=None):
+    """簡化後仍保留的環，to_geojson 與 to_topojson 共用
+
+    內環退化（少於三個不同點）時捨棄，外環退化時整個多邊形捨棄；整個區域都被簡化掉時，
+    把面積最大的原始外環加在 arc 列表最後。回傳 (arc 列表, 各 feature 保留的多邊形 arc 編號)。
+    """
+    arcs = list(arcs)
+    kept = []
+    for feature_shape in shapes:
+        feature_polygons = []
+        for polygon_shape in feature_shape:
+            rings = []
+            for ring_index, arc_refs in enumerate(polygon_shape):
+                if len(set(_ring_from_arcs(arc_refs, arcs))) >= 3:
+                    rings.append(arc_refs)
+                elif ring_index == 0:
+                    # 外環退化時整個多邊形捨棄（小島在低縮放層級本來就看不到）
+                    break
+            else:
+                if rings:
+                    feature_polygons.append(rings)
+
+        if not feature_polygons and feature_shape and original_arcs is not None:
+            # 整個縣市都被簡化掉時，保留面積最大的原始外環
+            outer = max((_ring_from_arcs(p[0], original_arcs) for p in feature_shape), key=_ring_area)
+            arcs.append(outer)
+            feature_polygons.append([[len(arcs) - 1]])
+        kept.append(feature_polygons)
+    return arcs, kept
+
+
+def to_geojson(geojson, arcs, shapes, original_arcs=None):
+    """將拓樸結構組回 GeoJSON，屬性沿用原始 feature"""
+    arcs, kept = _kept_shapes(arcs, shapes, original_arcs)
+    features = []
+    for feature, feature_shape in zip(geojson['features'], kept):
+        feature_polygons = [[[list(point) for point in _ring_from_arcs(arc_refs, arcs)] for arc_refs in polygon]
+                            for polygon in feature_shape]
+        if len(feature_polygons) == 1:
+            geometry = {'type': 'Polygon', 'coordinates': feature_polygons[0]}
+        elif feature_polygons:
+            geometry = {'type': 'MultiPolygon', 'coordinates': feature_polygons}
+        else:
+            geometry = None
+        features.append({'type': 'Feature', 'properties': feature.get('properties', {}), 'geometry': geometry})
+
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def to_topojson(geojson, arcs, shapes, object_name='counties', quantization=100000, original_arcs=None):
+    """輸出 TopoJSON：arc 以整數量化並做差分編碼，在瀏覽器端用 topojson-client 解碼
+
+    保留的環與 to_geojson 相同，只輸出用得到的 arc；沒有任何環時回傳沒有 arc 的拓樸。
+    """
+    arcs, kept = _kept_shapes(arcs, shapes, original_arcs)
+    used = sorted({ref if ref >= 0 else ~ref
+                   for feature_shape in kept for polygon in feature_shape
+                   for arc_refs in polygon for ref in arc_refs})
+    index = {old: new for new, old in enumerate(used)}
+    arcs = [arcs[old] for old in used]
+
+    geometries = []
+    for feature, feature_shape in zip(geojson['features'], kept):
+        feature_shape = [[[index[ref] if ref >= 0 else ~index[~ref] for ref in arc_refs] for arc_refs in polygon]
+                         for polygon in feature_shape]
+        if len(feature_shape) == 1:
+            geometry = {'type': 'Polygon', 'arcs': feature_shape[0]}
+        elif feature_shape:
+            geometry = {'type': 'MultiPolygon', 'arcs': feature_shape}
+        else:
+            geometry = {'type': None}
+        geometry['properties'] = feature.get('properties', {})
+        geometries.append(geometry)
+
+    objects = {object_name: {'type': 'GeometryCollection', 'geometries': geometries}}
+    if not arcs:
+        return {'type': 'Topology', 'objects': objects, 'arcs': []}
+
+    xs = [x for arc in arcs for x, _ in arc]
+    ys = [y for arc in arcs for _, y in arc]
+    x0, y0 = min(xs), min(ys)
+    kx = (max(xs) - x0) / (quantization - 1) or 1
+    ky = (max(ys) - y0) / (quantization - 1) or 1
+
+    encoded_arcs = []
+    for arc in arcs:
+        encoded = []
+        previous = (0, 0)
+        for x, y in arc:
+            qx, qy = int(round((x - x0) / kx)), int(round((y - y0) / ky))
+            encoded.append([qx - previous[0], qy - previous[1]])
+            previous = (qx, qy)
+        encoded_arcs.append(encoded)
+
+    return {
+        'type': 'Topology',
+        'transform': {'scale': [kx, ky], 'translate': [x0, y0]},
+        'objects': objects,
+        'arcs': encoded_arcs,
+    }
+
+
+def json_size(data):
+    """輸出到 HTML 時的位元組數"""
+    return len(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def geometry_report(before, after, name_property='COUNTYNAME'):
+    """比較簡化前後的位元組數與各區域的頂點數"""
+    rows = []
+    for original, simplified in zip(before['features'], after['features']):
+        rows.append({
+            'name': original.get('properties', {}).get(name_property),
+            'vertices_before': count_vertices(original.get('geometry')),
+            'vertices_after': count_vertices(simplified.get('geometry')),
+        })
+    return {
+        'bytes_before': json_size(before),
+        'bytes_after': json_size(after),
+        'vertices_before': sum(row['vertices_before'] for row in rows),
+        'vertices_after': sum(row['vertices_after'] for row in rows),
+        'features': rows,
+    }
+
+
+def log_report(report, tolerance=None):
+    """以表格記錄簡化報告（logger.info）"""
+    title = f"容許誤差 {tolerance}" if tolerance is not None else "簡化結果"
+    logger.info(f"=== {title} ===")
+    logger.info(f"大小：{report['bytes_before']:,} -> {report['bytes_after']:,} bytes "
+                f"({report['bytes_after'] / max(report['bytes_before'], 1):.1%})")
+    logger.info(f"頂點：{report['vertices_before']:,} -> {report['vertices_after']:,}")
+    for row in report['features']:
+        logger.info(f"  {row['name']}\t{row['vertices_before']:>7,} -> {row['vertices_after']:>7,}")
+
+
+def prepare_geometry(geojson, tolerance=None, zoom=None, precision=DEFAULT_PRECISION,
+                     topojson=False, name_property='COUNTYNAME'):
+    """幾何前處理：座標取捨、共用邊簡化，必要時輸出 TopoJSON
+
+    tolerance 未指定時依 zoom 從 ZOOM_TOLERANCES 取得；兩者都未指定則不簡化。
+    回傳 (處理後的 GeoJSON, TopoJSON 或 None, 報告)。
+    """
+    if tolerance is None:
+        tolerance = tolerance_for_zoom(zoom) if zoom is not None else 0
+
+    arcs, shapes = build_topology(geojson, precision)
+    simplified_arcs = [simplify_arc(arc, tolerance) for arc in arcs]
+    prepared = to_geojson(geojson, simplified_arcs, shapes, original_arcs=arcs)
+    report = geometry_report(geojson, prepared, name_property)
+    report['tolerance'] = tolerance
+    report['arcs'] = len(arcs)
+
+    topology = None
+    if topojson:
+        topology = to_topojson(prepared, simplified_arcs, shapes, original_arcs=arcs)
+        report['bytes_topojson'] = json_size(topology)
+    return prepared, topology, report
+
+
+def prepare_geometry_cached(geojson, digest, cache_dir, tolerance=None, zoom=None,
+                            precision=DEFAULT_PRECISION, topojson=False, name_property='COUNTYNAME'):
+    """與 prepare_geometry 相同，但以「邊界內容雜湊 + 前處理參數」為鍵快取結果
+
+    鄉鎮等級的邊界點數多，簡化需要數秒；內容與參數不變時直接讀檔。
+    """
+    options = json.dumps([tolerance, zoom, precision, topojson, name_property])
+    key = digest[:16] + '-' + hashlib.sha1(options.encode('utf-8')).hexdigest()[:12]
+    path = os.path.join(cache_dir, 'prepared', key + '.json')
+
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                cached = json.load(file)
+            return cached['geojson'], cached['topology'], cached['report']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    prepared, topology, report = prepare_geometry(
+        geojson, tolerance=tolerance, zoom=zoom, precision=precision,
+        topojson=topojson, name_property=name_property
+    )
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump({'geojson': prepared, 'topology': topology, 'report': report},
+                  file, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    return prepared, topology, report
+
+
+def prepare_levels(geojson, zooms, precision=DEFAULT_PRECISION, tolerances=ZOOM_TOLERANCES):
+    """一次建立拓樸，產生多個縮放層級的簡化結果（拓樸只計算一次）"""
+    arcs, shapes = build_topology(geojson, precision)
+    levels = {}
+    for zoom in zooms:
+        tolerance = tolerance_for_zoom(zoom, tolerances)
+        simplified_arcs = [simplify_arc(arc, tolerance) for arc in arcs]
+        levels[zoom] = to_geojson(geojson, simplified_arcs, shapes, original_arcs=arcs)
+    return levels
+
+
+if __name__ == '__main__':
+    import boundary_cache
+    from taiwan_language_map_new import TAIWAN_GEOJSON_URL
+
+    parser = argparse.ArgumentParser(description='比較不同簡化容許誤差下的檔案大小與頂點數')
+    parser.add_argument('--zoom', type=float, nargs='+', default=[7, 9, 11], help='要比較的縮放層級')
+    parser.add_argument('--precision', type=int, default=DEFAULT_PRECISION, help='座標小數位數')
+    parser.add_argument('--offline', action='store_true', help='只使用本地快取的邊界數據')
+    parser.add_argument('--cache-dir', default=boundary_cache.DEFAULT_CACHE_DIR, help='邊界快取目錄')
+    args = parser.parse_args()
+    instrumentation.configure_logging()
+
+    source = boundary_cache.load_boundaries(TAIWAN_GEOJSON_URL, args.cache_dir, offline=args.offline)
+    if source:
+        for zoom in args.zoom:
+            _, _, report = prepare_geometry(source, zoom=zoom, precision=args.precision, topojson=True)
+            log_report(report, report['tolerance'])
+            logger.info(f"TopoJSON：{report['bytes_topojson']:,} bytes")
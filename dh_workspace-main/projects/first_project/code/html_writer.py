@@ -0,0 +1,143 @@
+"""以串流方式寫出地圖 HTML：頁面外殼由 folium 產生，幾何 JSON 逐個 feature 直接寫入檔案
+
+m.save 會把整個頁面（含所有幾何的 JSON 字串）先組成一個字串再寫出，鄉鎮、村里等級時
+同一份幾何在記憶體中會有好幾份字串副本。這裡先把各圖層的幾何換成小的佔位數據讓 folium
+產生頁面外殼，再把外殼中的佔位文字換成逐段編碼的幾何，記憶體用量大約只有一個 feature。
+"""
+import gzip
+import json
+import uuid
+
+import folium
+from folium.features import GeoJsonStyleMapper
+from folium.template import Template
+
+# 串流編碼時逐層展開的深度：FeatureCollection 逐個 feature、TopoJSON 逐條 arc
+STREAM_DEPTH = 2
+# 與 folium（jinja 的 tojson）相同的跳脫，讓 JSON 可以安全地放在 <script> 中
+_HTML_ESCAPES = {'<': '\\u003c', '>': '\\u003e', '&': '\\u0026', "'": '\\u0027'}
+_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+# 寫入檔案的緩衝大小
+BUFFER_SIZE = 1 << 20
+
+
+def _escape(text):
+    for char, escaped in _HTML_ESCAPES.items():
+        if char in text:
+            text = text.replace(char, escaped)
+    return text
+
+
+def iter_json(value, depth=STREAM_DEPTH):
+    """將 value 編碼成 JSON 片段的序列
+
+    前 depth 層的 dict / list 逐項展開，更深的值整個交給 C 實作的編碼器，
+    每個片段最多只有一個 feature（或一條 arc）的大小。
+    """
+    if depth <= 0 or not isinstance(value, (dict, list)) or not value:
+        yield _escape(_ENCODER.encode(value))
+    elif isinstance(value, dict):
+        separator = '{'
+        for key, item in value.items():
+            yield separator + _escape(_ENCODER.encode(str(key))) + ':'
+            yield from iter_json(item, depth - 1)
+            separator = ','
+        yield '}'
+    else:
+        separator = '['
+        for item in value:
+            yield separator
+            yield from iter_json(item, depth - 1)
+            separator = ','
+        yield ']'
+
+
+def _nested(path, leaf):
+    """依 'objects.counties' 這類路徑建立巢狀 dict"""
+    for key in reversed(path.split('.')):
+        leaf = {key: leaf}
+    return leaf
+
+
+def _stub(layer, token):
+    """取代圖層數據的佔位數據（保留 folium render 時會讀取的結構，但不含任何幾何）"""
+    if isinstance(layer, folium.TopoJson):
+        return dict(_nested(layer.object_path, {'geometries': []}), type=token)
+    return {'type': token, 'features': []}
+
+
+def _prepare(layer):
+    """先以完整數據做完 folium 在 render 時才做的樣式計算，換成佔位數據後結果不變"""
+    if isinstance(layer, folium.TopoJson):
+        layer.style_data()
+    elif (layer.style or layer.highlight) and layer.data['features']:
+        mapper = GeoJsonStyleMapper(layer.data, layer.feature_identifier, layer)
+        if layer.style:
+            layer.style_map = mapper.get_style_map(layer.style_function)
+        if layer.highlight:
+            layer.highlight_map = mapper.get_highlight_map(layer.highlight_function)
+
+
+def geometry_layers(m):
+    """地圖中內嵌數據的 GeoJson / TopoJson 圖層"""
+    layers = []
+    stack = [m]
+    while stack:
+        element = stack.pop()
+        embedded = getattr(element, 'embed', False) and isinstance(getattr(element, 'data', None), dict)
+        if embedded and isinstance(element, (folium.GeoJson, folium.TopoJson)):
+            layers.append(element)
+        stack.extend(element._children.values())
+    return layers
+
+
+def render_shell(m):
+    """產生頁面外殼，回傳 (HTML 片段列表, 圖層列表)：第 i 個片段之後接著第 i 個圖層的數據"""
+    placeholders = []
+    saved = []
+    try:
+        for layer in geometry_layers(m):
+            _prepare(layer)
+            saved.append((layer, layer.data))
+            layer.data = _stub(layer, f"stream-{uuid.uuid4().hex}")
+            placeholders.append((Template('{{ data|tojson }}').render(data=layer.data), layer))
+        html = m.get_root().render()
+    finally:
+        for layer, data in saved:
+            layer.data = data
+
+    positions = []
+    for text, layer in placeholders:
+        if html.count(text) != 1:
+            raise ValueError(f"頁面中找不到圖層 {layer.get_name()} 的數據位置")
+        positions.append((html.index(text), len(text), layer))
+    positions.sort(key=lambda position: position[0])
+
+    pieces = []
+    start = 0
+    for index, length, _ in positions:
+        pieces.append(html[start:index])
+        start = index + length
+    pieces.append(html[start:])
+    return pieces, [layer for _, _, layer in positions]
+
+
+def write_map(m, path, compress=None):
+    """以串流方式將地圖寫成 HTML，compress 未指定時依副檔名（.gz）決定是否以 gzip 壓縮
+
+    幾何以緊湊的 JSON 輸出（不排序鍵值、中文不跳脫），內容與 m.save 相同但位元組不同。
+    """
+    if compress is None:
+        compress = path.endswith('.gz')
+    pieces, layers = render_shell(m)
+    if compress:
+        file = gzip.open(path, 'wt', encoding='utf-8', newline='')
+    else:
+        file = open(path, 'w', encoding='utf-8', newline='', buffering=BUFFER_SIZE)
+    with file:
+        for piece, layer in zip(pieces, layers + [None]):
+            file.write(piece)
+            if layer is not None:
+                for chunk in iter_json(layer.data):
+                    file.write(chunk)
+    return path
@@ -0,0 +1,228 @@
+import contextlib
+import io
+import json
+import logging
+import os
+import time
+import tracemalloc
+
+# 所有模組的 logger 都在這個名稱之下（language_map.census_ingest …）
+LOGGER_NAME = 'language_map'
+# 量測事件（計時區段、計數、輸出大小）以 DEBUG 等級寫入這個 logger
+METRICS_LOGGER_NAME = LOGGER_NAME + '.metrics'
+# 以環境變數開啟效能分析（cprofile / tracemalloc）與 JSON lines 輸出，不必改命令列
+PROFILE_ENV = 'LANGUAGE_MAP_PROFILE'
+LOG_JSON_ENV = 'LANGUAGE_MAP_LOG_JSON'
+PROFILE_MODES = ['cprofile', 'tracemalloc']
+
+metrics_logger = logging.getLogger(METRICS_LOGGER_NAME)
+logger = logging.getLogger(LOGGER_NAME + '.instrumentation')
+
+# collect() 開啟中的事件列表
+_collectors = []
+
+
+def get_logger(name):
+    """模組的 logger（language_map.<模組名稱>），由 configure_logging 統一設定輸出"""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """每筆紀錄輸出成一行 JSON：時間、嚴重程度、logger、訊息，以及量測事件的欄位
+
+    嚴重程度寫在 severity，level 留給事件欄位（地圖的行政區層級）。
+    """
+
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 3),
+            'severity': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(verbose=False, json_path=None):
+    """命令列程式的 logging 設定：終端機只顯示訊息本身，json_path 另寫一份 JSON lines
+
+    verbose=True 時終端機也顯示量測事件；json_path 未指定時讀取 LANGUAGE_MAP_LOG_JSON。
+    量測事件只在有地方接收時（verbose、JSON 檔或 collect()）才計算。
+    """
+    root = logging.getLogger(LOGGER_NAME)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    root.propagate = False
+
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter('%(message)s'))
+    console.setLevel(logging.DEBUG if verbose else logging.INFO)
+    root.addHandler(console)
+
+    json_path = json_path or os.environ.get(LOG_JSON_ENV)
+    if json_path:
+        json_handler = logging.FileHandler(json_path, encoding='utf-8')
+        json_handler.setFormatter(JsonLinesFormatter())
+        json_handler.setLevel(logging.DEBUG)
+        root.addHandler(json_handler)
+    root.setLevel(logging.DEBUG if verbose or json_path else logging.INFO)
+    return root
+
+
+def enabled():
+    """是否有地方接收量測事件（需要額外計算的量測，例如輸出大小，只在此時進行）"""
+    return bool(_collectors) or metrics_logger.isEnabledFor(logging.DEBUG)
+
+
+def _describe(event):
+    if event['event'] == 'span':
+        return f"{event['name']} {event['seconds'] * 1000:.1f} ms"
+    if event['event'] == 'bytes':
+        return f"{event['name']} {event['bytes']:,} bytes"
+    return f"{event['name']} = {event['value']}"
+
+
+def emit(event, name, **fields):
+    """記錄一個量測事件：交給開啟中的 collect()，並以 DEBUG 等級寫入 metrics logger"""
+    record = {'event': event, 'name': name, **fields}
+    for events in _collectors:
+        events.append(record)
+    if metrics_logger.isEnabledFor(logging.DEBUG):
+        metrics_logger.debug(_describe(record), extra={'fields': record})
+
+
+def _memory_fields():
+    """開啟 tracemalloc 時附上目前與峰值的記憶體用量"""
+    if not tracemalloc.is_tracing():
+        return {}
+    current, peak = tracemalloc.get_traced_memory()
+    return {'memory_bytes': current, 'peak_bytes': peak}
+
+
+@contextlib.contextmanager
+def span(name, **fields):
+    """計時區段：結束時記錄耗時；區塊內可在回傳的 dict 中補上欄位（例如區域數）"""
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        emit('span', name, seconds=round(time.perf_counter() - start, 4), **fields, **_memory_fields())
+
+
+def stage_timer(prefix, **fields):
+    """依序執行的各階段計時：回傳 lap(名稱)，記錄上一次呼叫（或建立時）到現在的耗時
+
+    適合把一個長函數切成多段計時，不必把每一段包進 with 區塊。
+    """
+    last = time.perf_counter()
+
+    def lap(name, **extra):
+        nonlocal last
+        now = time.perf_counter()
+        emit('span', f"{prefix}.{name}", seconds=round(now - last, 4), **fields, **extra, **_memory_fields())
+        last = time.perf_counter()
+
+    return lap
+
+
+def count(name, value=1, **fields):
+    """計數事件（例如對應成功 / 失敗的區域數）"""
+    emit('counter', name, value=value, **fields)
+
+
+def size(name, content, **fields):
+    """輸出大小事件：content 為字串時以 UTF-8 計算位元組數"""
+    length = len(content.encode('utf-8')) if isinstance(content, str) else len(content)
+    emit('bytes', name, bytes=length, **fields)
+
+
+@contextlib.contextmanager
+def collect():
+    """收集區塊內的所有量測事件（不需設定 logging），回傳事件列表"""
+    events = []
+    _collectors.append(events)
+    try:
+        yield events
+    finally:
+        _collectors.remove(events)
+
+
+def summarize(events):
+    """將事件列表整理成 {'spans': {名稱: 秒}, 'counters': {名稱: 值}, 'bytes': {名稱: 位元組}}"""
+    summary = {'spans': {}, 'counters': {}, 'bytes': {}}
+    for event in events:
+        if event['event'] == 'span':
+            summary['spans'][event['name']] = round(summary['spans'].get(event['name'], 0) + event['seconds'], 4)
+        elif event['event'] == 'counter':
+            summary['counters'][event['name']] = summary['counters'].get(event['name'], 0) + event['value']
+        elif event['event'] == 'bytes':
+            summary['bytes'][event['name']] = summary['bytes'].get(event['name'], 0) + event['bytes']
+    return summary
+
+
+@contextlib.contextmanager
+def profiled(mode=None, output=None, limit=20):
+    """在 cProfile 或 tracemalloc 下執行區塊（mode 未指定時讀取 LANGUAGE_MAP_PROFILE）
+
+    cprofile：結果寫到 output（可用 snakeviz / pstats 開啟），並記錄累計耗時最高的函數；
+    tracemalloc：記錄峰值記憶體與配置最多的程式行，計時區段也會附上記憶體用量。
+    """
+    mode = mode or os.environ.get(PROFILE_ENV)
+    if not mode:
+        yield
+        return
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"未知的效能分析方式 {mode}（可用：{', '.join(PROFILE_MODES)}）")
+
+    if mode == 'cprofile':
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if output:
+                profiler.dump_stats(output)
+                logger.info(f"cProfile 結果已寫入 {output}")
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(limit)
+            logger.info(stream.getvalue().rstrip())
+        return
+
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        emit('memory', 'peak', value=peak)
+        lines = [f"峰值記憶體 {peak / 2 ** 20:.1f} MB，配置最多的程式行："]
+        for stat in snapshot.statistics('lineno')[:limit]:
+            lines.append(f"  {stat.size / 2 ** 20:8.2f} MB  {stat.traceback}")
+        logger.info('\n'.join(lines))
+        if output:
+            snapshot.dump(output)
+            logger.info(f"tracemalloc 快照已寫入 {output}")
+
+
+@contextlib.contextmanager
+def capture_log(stream, level=logging.INFO):
+    """區塊內的訊息只寫到 stream（例如批次工作行程回傳給主行程的輸出），結束後恢復原本的設定"""
+    root = logging.getLogger(LOGGER_NAME)
+    saved = root.handlers[:], root.level, root.propagate
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    root.handlers = [handler]
+    root.setLevel(level)
+    root.propagate = False
+    try:
+        yield stream
+    finally:
+        root.handlers, level, root.propagate = saved[0], saved[1], saved[2]
+        root.setLevel(level)
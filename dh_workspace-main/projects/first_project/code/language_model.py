@@ -0,0 +1,155 @@
+import numpy as np
+
+# 地圖上的語言（矩陣的欄順序）與對應顏色
+LANGUAGES = ['華語', '閩南語', '客家話', '原住民語']
+LANGUAGE_COLORS = {
+    '華語': '#FF6B6B',     # 紅色
+    '閩南語': '#4ECB71',   # 綠色
+    '客家話': '#6B8EFF',   # 藍色
+    '原住民語': '#FFD93D'  # 黃色
+}
+NO_DATA_COLOR = '#cccccc'
+
+
+def make_table(regions, values, languages=LANGUAGES, bands=None):
+    """建立語言數據表：區域索引 + 數值矩陣
+
+    values 的形狀為 (區域數, 語言數)，或加上年齡層時為 (區域數, 語言數, 年齡層數)；
+    每個區域只存一列，其他寫法的名稱在查詢前先對應成標準名稱。
+    """
+    regions = [str(region) for region in regions]
+    values = np.asarray(values, dtype=np.float32)
+    if values.shape[:2] != (len(regions), len(languages)):
+        raise ValueError(f"數值矩陣的形狀 {values.shape} 與區域數 {len(regions)}、語言數 {len(languages)} 不符")
+    return {
+        'regions': regions,
+        'languages': list(languages),
+        'bands': list(bands) if bands is not None else None,
+        'values': values,
+        'index': {region: i for i, region in enumerate(regions)},
+    }
+
+
+def empty_table(languages=LANGUAGES):
+    """沒有任何區域的數據表"""
+    return make_table([], np.zeros((0, len(languages))), languages)
+
+
+def table_from_dict(data, languages=LANGUAGES):
+    """由 {區域: {語言: 數值}} 建立數據表（缺少的語言填 0）"""
+    regions = list(data)
+    values = [[data[region].get(language, 0.0) for language in languages] for region in regions]
+    return make_table(regions, np.array(values, dtype=np.float32).reshape(len(regions), len(languages)),
+                      languages)
+
+
+def align_table(table, regions):
+    """依指定的區域順序重排數據表，沒有數據的區域填 NaN
+
+    不同普查年份對齊到同一份區域列表後，頁面只需載入一次區域名稱與幾何。
+    """
+    values = np.full((len(regions),) + table['values'].shape[1:], np.nan, dtype=np.float32)
+    for i, region in enumerate(regions):
+        row = region_row(table, region)
+        if row is not None:
+            values[i] = table['values'][row]
+    return make_table(regions, values, table['languages'], table['bands'])
+
+
+def region_row(table, region):
+    """區域在矩陣中的列號，找不到時回傳 None"""
+    return table['index'].get(region)
+
+
+def language_mask(table, exclude=()):
+    """參與比較的語言遮罩（排除的語言為 False）"""
+    return np.array([language not in exclude for language in table['languages']])
+
+
+def dominant_languages(table, exclude=(), values=None):
+    """以 argmax 一次算出每個區域使用比例最高的語言列號
+
+    排除的語言以遮罩設為 -inf；全部被排除或數值皆為 NaN 的區域回傳 -1。
+    有年齡層時回傳 (區域數, 年齡層數) 的陣列。
+    """
+    values = table['values'] if values is None else values
+    mask = language_mask(table, exclude).reshape((1, -1) + (1,) * (values.ndim - 2))
+    masked = np.where(mask & ~np.isnan(values), values, -np.inf)
+    dominant = masked.argmax(axis=1)
+    return np.where(np.isfinite(masked.max(axis=1)), dominant, -1)
+
+
+def dominant_colors(table, exclude=()):
+    """每個區域的主要語言顏色（沒有數據時為灰色）"""
+    palette = np.array([LANGUAGE_COLORS.get(language, NO_DATA_COLOR) for language in table['languages']]
+                       + [NO_DATA_COLOR])
+    return palette[dominant_languages(table, exclude)]
+
+
+def region_values(table, region, band=None):
+    """單一區域的 {語言: 數值}，供彈窗顯示用；找不到時回傳 None"""
+    row = region_row(table, region)
+    if row is None:
+        return None
+    values = table['values'][row] if band is None else table['values'][row, :, band]
+    if np.isnan(values).all():
+        return None
+    return {language: round(float(value), 1) for language, value in zip(table['languages'], values)
+            if not np.isnan(value)}
+
+
+def page_columns(table):
+    """數值按語言分成欄陣列（四捨五入到一位小數，沒有數據為 None）"""
+    columns = np.round(np.moveaxis(table['values'], 1, 0).astype(float), 1)
+    return np.where(np.isnan(columns), None, columns).tolist()
+
+
+def page_colors(table):
+    """預先算好的主要語言顏色：包含華語 / 排除華語兩種模式"""
+    return {
+        'normal': dominant_colors(table).tolist(),
+        'exclude': dominant_colors(table, ['華語']).tolist(),
+    }
+
+
+def band_payload(table):
+    """年齡層的頁面數據：數值與主要語言各攤平成一個數字陣列
+
+    {"bands": [...], "values": [...], "dominant": {"normal": [...], "exclude": [...]}}
+    values 依 (年齡層, 語言, 區域) 的順序攤平，dominant 依 (年齡層, 區域)，
+    主要語言以語言的欄號表示（-1 為沒有數據），頁面再以欄號查顏色。
+    """
+    values = np.round(table['values'].transpose(2, 1, 0).astype(float), 1)
+    return {
+        'bands': table['bands'],
+        'values': np.where(np.isnan(values), None, values).ravel().tolist(),
+        'dominant': {
+            'normal': dominant_languages(table).T.ravel().tolist(),
+            'exclude': dominant_languages(table, ['華語']).T.ravel().tolist(),
+        },
+    }
+
+
+def year_payload(table, year, ages=None):
+    """單一年份的頁面數據（不含區域名稱，區域順序與頁面上的 regions 相同）"""
+    payload = {'year': year, 'columns': page_columns(table), 'colors': page_colors(table)}
+    if ages is not None:
+        payload['ages'] = band_payload(ages)
+    return payload
+
+
+def to_page_json(table, ages=None):
+    """頁面使用的精簡格式：語言名稱列一次，數值按語言分成欄陣列
+
+    {"languages": [...], "columns": [[華語...], [閩南語...], ...], "colors": {"normal": [...], "exclude": [...]}}
+    區域名稱不輸出，頁面上的 feature 以 row 屬性（region_row 的列號）對應到欄陣列。
+    ages 為對齊到同一份區域的年齡層數據表時，另外輸出 band_payload。
+    """
+    payload = {
+        'languages': table['languages'],
+        'columns': page_columns(table),
+        'colors': page_colors(table),
+    }
+    if ages is not None:
+        payload['ages'] = band_payload(ages)
+    return payload
@@ -0,0 +1,374 @@
+"""本地語言地圖伺服器：邊界與語言數據只載入一次，各種變化由 JSON 端點按需提供
+
+用法：
+    python map_server.py --offline --port 8000
+    瀏覽器開啟 http://127.0.0.1:8000/?level=township
+    level 可以是鄉鎮、縣市或 groupings 設定檔中的彙整層級（例如 region）
+
+端點（皆支援 ETag / If-None-Match 與 gzip）：
+    /                           地圖頁面（不含任何彈窗 HTML），參數 level、year、exclude
+    /geometry?level=            簡化後的邊界（只保留 region_name / county_name 屬性）
+    /style?level=&year=&exclude=華語
+                                各區域的主要語言顏色，順序與 /geometry 的 features 相同
+    /popup/<區域>?level=&year=&exclude=華語
+                                點擊區域時才載入的彈窗 HTML
+
+簡化後的幾何與語言數據表常駐記憶體，產生過的回應以 LRU 快取，
+重複的請求不需重新計算或壓縮。
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import folium
+
+import aggregation
+import boundary_cache
+import census_ingest
+import instrumentation
+import language_model
+import taiwan_language_map_new as tlm
+
+logger = instrumentation.get_logger('map_server')
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8000
+DEFAULT_CACHE_SIZE = 256     # LRU 保留的回應數
+GZIP_MIN_BYTES = 1024        # 小於此大小的回應不壓縮
+STATUS_TEXT = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+               405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class MissingBoundaries(Exception):
+    """缺少某個層級的邊界數據（快取中沒有且無法下載）"""
+
+
+def create_state(offline=False, cache_dir=boundary_cache.DEFAULT_CACHE_DIR, zoom=10,
+                 cache_size=DEFAULT_CACHE_SIZE, tiles='CartoDB positron'):
+    """伺服器的共用狀態：語言資料檔、分組設定、各層級的幾何與數據表、回應快取"""
+    store = census_ingest.ensure_store()
+    return {
+        'offline': offline,
+        'cache_dir': cache_dir,
+        'zoom': zoom,
+        'tiles': tiles,
+        'store': store,
+        'years': census_ingest.census_years(store),
+        'groupings': aggregation.load_groupings(),
+        'levels': {},        # level -> {'geojson', 'regions', 'township_index'}
+        'tables': {},        # (level, year) -> (數據表, 備註, 鄉鎮索引)
+        'responses': OrderedDict(),
+        'cache_size': cache_size,
+        # route 在執行緒中執行：每個幾何或數據表各有一把載入鎖，LRU 另有一把鎖
+        'lock': threading.Lock(),
+        'load_locks': {},
+    }
+
+
+def _load_lock(state, key):
+    """某個幾何或數據表的載入鎖：同一份數據同時被請求時只載入一次，其他請求等待結果"""
+    with state['lock']:
+        return state['load_locks'].setdefault(key, threading.Lock())
+
+
+def load_level(state, level):
+    """載入並對應好某個層級的邊界（只做一次），缺少邊界時回傳 None"""
+    if level in state['levels']:
+        return state['levels'][level]
+    with _load_lock(state, ('level', level)):
+        if level not in state['levels']:
+            geometry = _prepare_level(state, level)
+            if geometry is None:
+                return None
+            state['levels'][level] = geometry
+    return state['levels'][level]
+
+
+def _prepare_level(state, level):
+    prepared = tlm.load_prepared_boundaries(level, state['offline'], False, state['cache_dir'], state['zoom'],
+                                            groupings=state['groupings'])
+    if not prepared:
+        return None
+    geojson = prepared[0]
+    # 鄉鎮索引取自最新年份的數據表，與 /style 預設年份的數據表共用同一次載入
+    _, _, township_index = _language_table(state, level, state['years'][-1] if state['years'] else None)
+    unmatched = tlm.stamp_regions(geojson, level, township_index, state['store'], state['groupings'])
+    if unmatched:
+        logger.warning(f"無法對應名稱的區域：{'、'.join(str(name) for name in unmatched)}")
+
+    # 頁面只需要區域名稱，其他原始屬性不輸出
+    features = [{
+        'type': 'Feature',
+        'properties': {key: feature['properties'].get(key) for key in ('region_name', 'county_name')},
+        'geometry': feature['geometry'],
+    } for feature in geojson['features']]
+    return {
+        'geojson': {'type': 'FeatureCollection', 'features': features},
+        'regions': [feature['properties']['region_name'] or '' for feature in features],
+        'township_index': township_index,
+    }
+
+
+def _language_table(state, level, year):
+    """某個層級與年份的 (數據表, 備註, 鄉鎮索引)，只載入一次並常駐記憶體"""
+    key = (level, year)
+    if key not in state['tables']:
+        with _load_lock(state, ('table',) + key):
+            if key not in state['tables']:
+                state['tables'][key] = tlm.load_language_table(level, year, state['store'], state['groupings'])
+    return state['tables'][key]
+
+
+def load_table(state, level, year):
+    """某個層級與年份的 (數據表, 備註)，載入後常駐記憶體"""
+    table, notes, _ = _language_table(state, level, year)
+    return table, notes
+
+
+def parse_options(state, query):
+    """由查詢字串取得 (level, year, exclude)；不合法時拋出 ValueError"""
+    level = query.get('level', ['county'])[0]
+    if level not in aggregation.levels(state['groupings']):
+        raise ValueError(f"不支援的層級：{level}")
+    year = query.get('year', [''])[0]
+    if year:
+        year = int(year)
+        if year not in state['years']:
+            raise ValueError(f"沒有 {year} 年的普查數據")
+    else:
+        year = state['years'][-1] if state['years'] else None
+    exclude = tuple(sorted(language for value in query.get('exclude', []) for language in value.split(',')
+                           if language))
+    return level, year, exclude
+
+
+def style_payload(state, level, year, exclude):
+    """各區域的主要語言顏色（順序與幾何相同）"""
+    geometry = load_level(state, level)
+    table, _ = load_table(state, level, year)
+    aligned = language_model.align_table(table, geometry['regions'])
+    return {
+        'level': level,
+        'year': year,
+        'exclude': list(exclude),
+        'colors': language_model.dominant_colors(aligned, exclude).tolist(),
+    }
+
+
+def popup_payload(state, level, year, exclude, region):
+    """單一區域的彈窗 HTML（排除的語言不列出）"""
+    table, notes = load_table(state, level, year)
+    lang_data = language_model.region_values(table, region)
+    if lang_data:
+        lang_data = {language: value for language, value in lang_data.items() if language not in exclude}
+    return {'region': region, 'year': year, 'html': tlm.create_popup_content(region, lang_data, False, notes)}
+
+
+def render_page(state, level, year, exclude):
+    """地圖頁面：只有底圖、控制項與靜態的 static/map_server.js，幾何、顏色與彈窗都由端點提供"""
+    m = folium.Map(location=[23.8, 121.0], zoom_start=7.5, tiles=state['tiles'])
+    years = state['years']
+    year_slider = ''
+    if len(years) > 1:
+        year_slider = f'''
+        <div style="font-weight: bold; margin: 12px 0 6px; color: #333; font-size: 14px;">
+            普查年份：<span id="census-year-label">{year}</span>
+        </div>
+        <input type="range" id="census-year" min="0" max="{len(years) - 1}" step="1"
+               value="{years.index(year)}" style="width: 100%;">
+        <div style="display: flex; justify-content: space-between; font-size: 11px; color: #666;">
+            <span>{years[0]}</span><span>{years[-1]}</span>
+        </div>
+        '''
+    exclude_mandarin = '華語' in exclude
+    page_html = '''
+    <div id="language-toggle" style="position: fixed; top: 10px; right: 10px; z-index: 1000;
+                background-color: white; border: 2px solid #ccc; border-radius: 8px; padding: 15px;
+                box-shadow: 0 2px 10px rgba(0,0,0,0.3); font-family: Arial, sans-serif;">
+        <div style="font-weight: bold; margin-bottom: 12px; color: #333; font-size: 14px;">語言顯示模式</div>
+        <label style="display: block; margin-bottom: 10px; cursor: pointer; font-size: 13px;">
+            <input type="radio" name="language_mode" value="normal"''' + ('' if exclude_mandarin else ' checked') + '''
+                   style="margin-right: 8px; transform: scale(1.2);"> 包含華語
+        </label>
+        <label style="display: block; cursor: pointer; font-size: 13px;">
+            <input type="radio" name="language_mode" value="exclude"''' + (' checked' if exclude_mandarin else '') + '''
+                   style="margin-right: 8px; transform: scale(1.2);"> 排除華語
+        </label>''' + year_slider + '''
+    </div>
+    '''
+    m.get_root().html.add_child(folium.Element(page_html))
+    m.get_root().html.add_child(tlm.script_element('map_server.js', 'languageServerConfig', {
+        'map': m.get_name(),
+        'level': level,
+        'years': years,
+        'year': year,
+        'exclude': list(exclude),
+        'modeExclude': ['華語'],
+        'noDataColor': language_model.NO_DATA_COLOR,
+        'styles': {'data': tlm.REGION_STYLE, 'noData': tlm.NO_DATA_STYLE, 'highlight': tlm.HIGHLIGHT_STYLE},
+    }))
+    # 彈窗 HTML 由 /popup 提供，頁面只需要共用的樣式
+    m.get_root().header.add_child(folium.Element(tlm.POPUP_CSS))
+    tlm.add_legend(m)
+    return m.get_root().render()
+
+
+def cached_response(state, key, content_type, build):
+    """由 LRU 取出回應，沒有時呼叫 build() 產生並計算 ETag 與 gzip 版本"""
+    responses = state['responses']
+    with state['lock']:
+        if key in responses:
+            responses.move_to_end(key)
+            return responses[key]
+    body = build()
+    if not isinstance(body, (bytes, str)):
+        body = json.dumps(body, ensure_ascii=False, separators=(',', ':'))
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    response = {
+        'type': content_type,
+        'body': body,
+        'gzip': gzip.compress(body, 6) if len(body) >= GZIP_MIN_BYTES else None,
+        'etag': '"' + hashlib.sha1(body).hexdigest()[:20] + '"',
+    }
+    with state['lock']:
+        responses[key] = response
+        responses.move_to_end(key)
+        while len(responses) > state['cache_size']:
+            responses.popitem(last=False)
+    return response
+
+
+def route(state, path, query):
+    """依路徑產生回應，回傳 (狀態碼, 回應)；找不到時狀態碼為 404"""
+    json_type = 'application/json; charset=utf-8'
+    level, year, exclude = parse_options(state, query)
+    if path in ('/', '/index.html'):
+        return 200, cached_response(state, ('page', level, year, exclude), 'text/html; charset=utf-8',
+                                    lambda: render_page(state, level, year, exclude))
+    if path in ('/geometry', '/style') and load_level(state, level) is None:
+        raise MissingBoundaries(f"缺少 {level} 層級的邊界數據")
+    if path == '/geometry':
+        return 200, cached_response(state, ('geometry', level), json_type,
+                                    lambda: load_level(state, level)['geojson'])
+    if path == '/style':
+        return 200, cached_response(state, ('style', level, year, exclude), json_type,
+                                    lambda: style_payload(state, level, year, exclude))
+    if path.startswith('/popup/'):
+        region = unquote(path[len('/popup/'):])
+        table, _ = load_table(state, level, year)
+        if language_model.region_row(table, region) is None:
+            return 404, None
+        return 200, cached_response(state, ('popup', level, year, exclude, region), json_type,
+                                    lambda: popup_payload(state, level, year, exclude, region))
+    return 404, None
+
+
+def _message(status, text):
+    body = text.encode('utf-8')
+    return {'type': 'text/plain; charset=utf-8', 'body': body, 'gzip': None, 'etag': None}
+
+
+def encode_response(status, response, request_headers, head=False):
+    """組成 HTTP 回應（處理 If-None-Match 與 Accept-Encoding），回傳 (實際狀態碼, 位元組)"""
+    headers = {'Content-Type': response['type'], 'Vary': 'Accept-Encoding'}
+    body = response['body']
+    if response['etag']:
+        headers['ETag'] = response['etag']
+        headers['Cache-Control'] = 'no-cache'
+        if request_headers.get('if-none-match') == response['etag']:
+            status, body = 304, b''
+    if body and response['gzip'] is not None and 'gzip' in request_headers.get('accept-encoding', ''):
+        headers['Content-Encoding'] = 'gzip'
+        body = response['gzip']
+    headers['Content-Length'] = str(len(body))
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT[status]}"] + [f"{key}: {value}" for key, value in headers.items()]
+    return status, ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (b'' if head else body)
+
+
+async def handle_connection(state, reader, writer):
+    """處理一個連線上的請求（支援 keep-alive）"""
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            start = time.perf_counter()
+            try:
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            except ValueError:
+                status, response, method, target = 400, _message(400, '無法解析的請求'), '-', '-'
+            else:
+                url = urlsplit(target)
+                if method not in ('GET', 'HEAD'):
+                    status, response = 405, _message(405, '只支援 GET / HEAD')
+                else:
+                    try:
+                        # 第一次載入幾何或數據表需要數秒，在執行緒中進行以免卡住其他連線
+                        status, response = await loop.run_in_executor(
+                            None, route, state, url.path, parse_qs(url.query))
+                        if response is None:
+                            response = _message(status, '找不到')
+                    except ValueError as e:
+                        status, response = 400, _message(400, str(e))
+                    except MissingBoundaries as e:
+                        status, response = 500, _message(500, str(e))
+                    except Exception:
+                        logger.exception(f"處理請求時發生錯誤：{method} {unquote(target)}")
+                        status, response = 500, _message(500, '伺服器錯誤')
+
+            status, data = encode_response(status, response, headers, head=method == 'HEAD')
+            writer.write(data)
+            await writer.drain()
+            logger.info(f"{method} {unquote(target)} {status} {(time.perf_counter() - start) * 1000:.1f} ms")
+            if headers.get('connection', '').lower() == 'close':
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(state, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    server = await asyncio.start_server(lambda r, w: handle_connection(state, r, w), host, port)
+    logger.info(f"語言地圖伺服器：http://{host}:{port}/")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地語言地圖伺服器')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='監聽位址')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='監聽埠號')
+    parser.add_argument('--offline', action='store_true', help='只使用本地快取的邊界數據，不連網')
+    parser.add_argument('--cache-dir', default=boundary_cache.DEFAULT_CACHE_DIR, help='邊界快取目錄')
+    parser.add_argument('--zoom', type=float, default=10, help='依縮放層級決定邊界簡化程度')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE, help='快取的回應數')
+    parser.add_argument('--tiles', default='CartoDB positron', help='底圖名稱或圖磚網址')
+    parser.add_argument('--preload', nargs='*', choices=aggregation.levels(), default=['county'],
+                        help='啟動時先載入的層級')
+    args = parser.parse_args()
+    instrumentation.configure_logging()
+
+    state = create_state(args.offline, args.cache_dir, args.zoom, args.cache_size, args.tiles)
+    for level in args.preload:
+        load_level(state, level)
+    try:
+        asyncio.run(serve(state, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
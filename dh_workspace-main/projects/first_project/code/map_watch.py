@@ -0,0 +1,271 @@
+"""監看模式：報表、備註或邊界變動時只重寫小的即時數據檔，開啟中的頁面自動套用
+
+用法：
+    python map_watch.py --offline --port 8001
+    python map_watch.py --offline --level township --output township.html --port 8001
+    瀏覽器開啟 http://127.0.0.1:8001/taiwan_language_map.html
+
+語言資料檔、數據表與前處理後的幾何常駐記憶體（LanguageMap），每隔 --interval 秒檢查：
+    報表（*.xlsx）與備註（language_data.csv）   資料檔增量重建（只重新解析變動的報表），重新計算
+                                               各年份的數值與顏色，只寫出 <輸出>_years/live.json
+    分組設定（groupings.json）與邊界快取清單   重新產生整個頁面，頁面偵測到新版本後自動重新載入
+區域清單或普查年份改變時，頁面上 feature 的列號與年份滑桿也會改變，同樣重新產生整個頁面。
+頁面以 fetch 讀取即時數據檔，需以 HTTP 開啟（--port 以內建的靜態檔案伺服器提供輸出目錄）。
+"""
+import argparse
+import functools
+import http.server
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+import aggregation
+import boundary_cache
+import census_ingest
+import geometry_prep
+import instrumentation
+import language_model
+import taiwan_language_map_new as tlm
+
+logger = instrumentation.get_logger('map_watch')
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8001
+DEFAULT_INTERVAL = 0.2    # 檢查檔案的間隔（秒）
+DEFAULT_POLL = 500        # 頁面讀取即時數據檔的間隔（毫秒）
+SETTLE_SECONDS = 0.1      # 偵測到變動後等檔案不再改變才處理（編輯器常分多次寫入）
+LIVE_FILE = 'live.json'
+
+
+def watched_files(atlas):
+    """{路徑: 類別}：'data' 只需重算數值，'page' 需要重新產生頁面"""
+    data_dir, _, notes_csv = atlas.paths()
+    files = {path: 'data' for path in census_ingest.find_workbooks(data_dir)}
+    files[notes_csv] = 'data'
+    files[atlas.groupings_path or aggregation.GROUPINGS_PATH] = 'page'
+    files[os.path.join(atlas.cache_dir, boundary_cache.INDEX_FILE)] = 'page'
+    return files
+
+
+def snapshot(atlas):
+    """各監看檔案的 (類別, 修改時間, 大小)，不存在的檔案不列入（新增與刪除也會被偵測到）"""
+    result = {}
+    for path, category in watched_files(atlas).items():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        result[path] = (category, stat.st_mtime_ns, stat.st_size)
+    return result
+
+
+def changed_files(before, after):
+    """兩次快照間變動的檔案，回傳 {路徑: 類別}"""
+    return {
+        path: (after.get(path) or before[path])[0]
+        for path in set(before) | set(after)
+        if before.get(path) != after.get(path)
+    }
+
+
+def create_state(atlas, output, level='county', year=None, options=None, poll=DEFAULT_POLL, stream=False):
+    """監看模式的狀態：數據來源、頁面設定、目前頁面的版本與區域，以及上一次寫出的數據表"""
+    sidecar_dir = os.path.splitext(output)[0] + '_years'
+    return {
+        'atlas': atlas,
+        'output': output,
+        'level': level,
+        'year': year,
+        'options': options or {},
+        'poll': poll,
+        'stream': stream,
+        'sidecar_dir': sidecar_dir,
+        'live_path': os.path.join(sidecar_dir, LIVE_FILE),
+        'page': None,        # 頁面版本，頁面重新產生時改變
+        'version': 0,        # 即時數據檔的版本，每次寫出時遞增
+        'regions': None,     # 頁面上的區域順序（feature 的 row 屬性對應到這份清單）
+        'years': None,
+        'tables': {},        # 年份 -> 上一次寫出的數據表，用來找出變動的區域
+    }
+
+
+def render_page(state):
+    """重新產生整個頁面（幾何、控制項與內嵌的數據），並寫出對應的即時數據檔；失敗時回傳 False"""
+    atlas = state['atlas']
+    page = f"{time.time_ns():x}"
+    live_url = f"{os.path.basename(os.path.normpath(state['sidecar_dir']))}/{LIVE_FILE}"
+    m = atlas.create_map(
+        level=state['level'], year=state['year'], sidecar_dir=state['sidecar_dir'],
+        live={'file': live_url, 'poll': state['poll'], 'page': page}, **state['options']
+    )
+    if m is None:
+        return False
+    atlas.save(m, state['output'], state['stream'])
+    state['page'] = page
+    state['regions'] = atlas.table(state['level'], state['year'])[0]['regions']
+    state['years'] = atlas.years
+    state['tables'] = {}
+    write_live(state)
+    return True
+
+
+def live_tables(state):
+    """各年份對齊到頁面區域的 {年份: (語言數據表, 年齡層數據表或 None)}"""
+    atlas, level = state['atlas'], state['level']
+    base, _, township_index = atlas.table(level, state['year'])
+    tables = tlm.year_language_tables(atlas.store, atlas.years, base, level, township_index, atlas.groupings)
+    return {year: (table, tlm.age_table(atlas.store, year, base, level)) for year, table in tables.items()}
+
+
+def changed_regions(old, new):
+    """兩份對齊到同一份區域的數據表中數值不同的區域（old 為 None 時回傳空列表）"""
+    if old is None:
+        return []
+    if old['values'].shape != new['values'].shape:
+        return list(new['regions'])
+    a, b = old['values'], new['values']
+    same = ((a == b) | (np.isnan(a) & np.isnan(b))).reshape(len(new['regions']), -1).all(axis=1)
+    return [new['regions'][row] for row in np.flatnonzero(~same)]
+
+
+def write_live(state):
+    """寫出即時數據檔（各年份的數值、顏色與備註），回傳 {年份: 變動的區域}
+
+    先寫到暫存檔再換名，頁面不會讀到寫到一半的內容。
+    """
+    atlas = state['atlas']
+    tables = live_tables(state)
+    _, notes, _ = atlas.table(state['level'], state['year'])
+    changed = {year: changed_regions(state['tables'].get(year), table) for year, (table, _) in tables.items()}
+    state['version'] += 1
+    payload = {
+        'page': state['page'],
+        'version': state['version'],
+        'notes': notes,
+        'years': {year: language_model.year_payload(table, year, ages) for year, (table, ages) in tables.items()},
+    }
+    os.makedirs(state['sidecar_dir'], exist_ok=True)
+    tmp_path = state['live_path'] + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(payload, file, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, state['live_path'])
+    state['tables'] = {year: table for year, (table, _) in tables.items()}
+    return changed
+
+
+def update(state, files):
+    """處理一批變動的檔案，回傳 ('data', {年份: 變動的區域}) 或 ('page', None)"""
+    atlas = state['atlas']
+    page = 'page' in files.values()
+    atlas.reload(boundaries=page)
+    regions = atlas.table(state['level'], state['year'])[0]['regions']
+    if page or regions != state['regions'] or atlas.years != state['years']:
+        if not render_page(state):
+            raise RuntimeError("無法重新產生頁面")
+        return 'page', None
+    return 'data', write_live(state)
+
+
+def _describe(files, kind, changed, seconds):
+    names = '、'.join(sorted(os.path.basename(path) for path in files))
+    if kind == 'page':
+        return f"{names} 變動：重新產生頁面（{seconds:.3f} 秒）"
+    regions = sorted({region for year_regions in changed.values() for region in year_regions})
+    shown = '、'.join(regions[:10]) + ('…' if len(regions) > 10 else '')
+    return f"{names} 變動：更新 {len(regions)} 個區域的數據（{seconds:.3f} 秒）" + (f"：{shown}" if regions else '')
+
+
+def watch(state, interval=DEFAULT_INTERVAL, settle=SETTLE_SECONDS):
+    """持續檢查監看的檔案，有變動時更新即時數據檔或重新產生頁面（Ctrl+C 結束）"""
+    atlas = state['atlas']
+    before = snapshot(atlas)
+    while True:
+        time.sleep(interval)
+        after = snapshot(atlas)
+        if after == before:
+            continue
+        # 等檔案寫完：連續兩次快照相同才處理
+        while True:
+            time.sleep(settle)
+            settled = snapshot(atlas)
+            if settled == after:
+                break
+            after = settled
+        files = changed_files(before, after)
+        before = after
+        start = time.perf_counter()
+        try:
+            with instrumentation.span('watch.update', files=len(files)) as fields:
+                kind, changed = update(state, files)
+                fields['kind'] = kind
+        except Exception as e:
+            # 報表儲存到一半或內容有誤：保留目前的頁面與數據，下次變動時再試
+            logger.error(f"更新失敗，保留目前的頁面：{e}")
+            continue
+        logger.info(_describe(files, kind, changed, time.perf_counter() - start))
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    """靜態檔案伺服器，每個請求的記錄改寫到 DEBUG"""
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(directory, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """在背景執行緒以靜態檔案伺服器提供輸出目錄，回傳伺服器"""
+    server = http.server.ThreadingHTTPServer((host, port), functools.partial(_QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='監看報表與邊界，變動時只更新頁面的數據')
+    parser.add_argument('--output', default='taiwan_language_map.html', help='輸出的 HTML 檔名')
+    parser.add_argument('--level', choices=aggregation.levels(), default='county',
+                        help='地圖的行政區層級，或 groupings.json 中的彙整層級')
+    parser.add_argument('--year', type=int, help='頁面初始顯示的普查年份（預設最新）')
+    parser.add_argument('--offline', action='store_true', help='只使用本地快取的邊界數據，不連網')
+    parser.add_argument('--cache-dir', default=boundary_cache.DEFAULT_CACHE_DIR, help='邊界快取目錄')
+    parser.add_argument('--data-dir', help='普查報表目錄（預設為 census_ingest 的目錄）')
+    parser.add_argument('--store', help='欄式資料檔（預設放在報表目錄中）')
+    parser.add_argument('--notes', help='縣市備註 CSV（預設放在報表目錄中）')
+    parser.add_argument('--groupings', help='分組設定檔')
+    parser.add_argument('--zoom', type=float, default=10, help='依縮放層級決定邊界簡化程度')
+    parser.add_argument('--precision', type=int, default=geometry_prep.DEFAULT_PRECISION, help='座標小數位數')
+    parser.add_argument('--topojson', action='store_true', help='以 TopoJSON 輸出幾何，由瀏覽器端解碼')
+    parser.add_argument('--batched', action='store_true', help='所有區域合併成單一圖層輸出')
+    parser.add_argument('--tiles', default='CartoDB positron', help='底圖名稱或圖磚網址')
+    parser.add_argument('--exclude-mandarin', action='store_true', help='頁面預設為排除華語模式')
+    parser.add_argument('--counties', nargs='+', help='只畫出這些縣市')
+    parser.add_argument('--stream', action='store_true', help='以串流方式寫出 HTML')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help='檢查檔案的間隔（秒）')
+    parser.add_argument('--poll', type=int, default=DEFAULT_POLL, help='頁面讀取即時數據檔的間隔（毫秒）')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='靜態檔案伺服器的監聽位址')
+    parser.add_argument('--port', type=int, help='以靜態檔案伺服器提供輸出目錄（未指定時不啟動）')
+    parser.add_argument('--verbose', action='store_true', help='顯示各階段的耗時、計數與輸出大小')
+    args = parser.parse_args()
+    instrumentation.configure_logging(args.verbose)
+
+    atlas = tlm.LanguageMap(args.data_dir, args.store, args.notes, args.groupings, args.cache_dir, args.offline)
+    options = {
+        'zoom': args.zoom, 'precision': args.precision, 'topojson': args.topojson, 'batched': args.batched,
+        'tiles': args.tiles, 'exclude_mandarin': args.exclude_mandarin, 'counties': args.counties,
+    }
+    state = create_state(atlas, args.output, args.level, args.year, options, args.poll, args.stream)
+    start = time.perf_counter()
+    if not render_page(state):
+        raise SystemExit("地圖創建失敗")
+    logger.info(f"地圖已保存為 '{args.output}'（{time.perf_counter() - start:.1f} 秒），開始監看報表與邊界")
+    if args.port:
+        serve(os.path.dirname(os.path.abspath(args.output)), args.host, args.port)
+        logger.info(f"瀏覽器開啟 http://{args.host}:{args.port}/{os.path.basename(args.output)}")
+    else:
+        logger.info("頁面需以 HTTP 開啟才能自動更新（可加上 --port）")
+    try:
+        watch(state, args.interval)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,398 @@
+"""將大量經緯度座標批次對應到縣市（或鄉鎮）與該區域的語言使用比例
+
+用法：
+    python point_lookup.py schools.csv schools_language.csv --lon-column lon --lat-column lat --offline
+    python point_lookup.py survey.csv survey_language.csv --level township --workers 4 --offline
+
+索引只建立一次：未簡化的邊界中每個多邊形的外框以 STR（Sort-Tile-Recursive）打包成 R-tree，
+每個多邊形的邊再依緯度分帶（prepared polygon），查詢時只需比對座標所在那一帶的邊。
+查詢以 numpy 一次處理一整批座標：沿樹逐層展開候選多邊形，再以射線法計算交點數，
+不需要 shapely / rtree。CSV 以固定列數的區塊讀寫，記憶體不隨檔案大小增加；
+--workers 以多個行程平行查詢各區塊。
+"""
+import argparse
+import collections
+import csv
+import itertools
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import aggregation
+import boundary_cache
+import census_ingest
+import geometry_prep
+import instrumentation
+import taiwan_language_map_new as tlm
+
+logger = instrumentation.get_logger('point_lookup')
+
+# R-tree 每個節點的子節點數
+NODE_CAPACITY = 16
+# 多邊形分帶時每一帶平均的邊數，以及每個多邊形最多的帶數
+EDGES_PER_BAND = 4
+MAX_BANDS = 4096
+# 每次查詢處理的座標數（限制展開候選時中間陣列的大小）
+CHUNK_SIZE = 1 << 16
+# CSV 每次讀入的列數
+CSV_CHUNK_ROWS = 100_000
+# 不在任何區域內的座標
+NO_REGION = -1
+
+
+def _group_bounds(bounds, starts):
+    """每組外框的聯集（starts 為各組在 bounds 中的起點）"""
+    return np.column_stack([
+        np.minimum.reduceat(bounds[:, 0], starts),
+        np.minimum.reduceat(bounds[:, 1], starts),
+        np.maximum.reduceat(bounds[:, 2], starts),
+        np.maximum.reduceat(bounds[:, 3], starts),
+    ])
+
+
+def str_pack(bounds, capacity=NODE_CAPACITY):
+    """Sort-Tile-Recursive：依外框中心先按經度切成縱條、每條內再按緯度排序，每 capacity 個一組
+
+    回傳 (排序後的順序, 各組的起點)；縱條的大小是 capacity 的倍數，同一組不會跨越縱條。
+    """
+    count = len(bounds)
+    slices = max(1, math.ceil(math.sqrt(math.ceil(count / capacity))))
+    slice_size = slices * capacity
+    center_x = bounds[:, 0] + bounds[:, 2]
+    center_y = bounds[:, 1] + bounds[:, 3]
+    order = np.argsort(center_x, kind='stable')
+    for start in range(0, count, slice_size):
+        part = order[start:start + slice_size]
+        order[start:start + slice_size] = part[np.argsort(center_y[part], kind='stable')]
+    return order, np.arange(0, count, capacity)
+
+
+def build_tree(bounds, capacity=NODE_CAPACITY):
+    """由外框建立 STR 打包的 R-tree，回傳 (葉層的項目順序, 由根到葉的各層節點)
+
+    每層節點為 {bounds, start, end}：葉層的 start / end 指向項目順序，其他層指向下一層的節點。
+    """
+    items, starts = str_pack(bounds, capacity)
+    level = {'bounds': _group_bounds(bounds[items], starts), 'start': starts,
+             'end': np.append(starts[1:], len(items))}
+    levels = [level]
+    while len(level['bounds']) > 1:
+        order, starts = str_pack(level['bounds'], capacity)
+        # 依打包順序重排這一層（每個節點記錄自己的子節點範圍，重排不影響更低的層）
+        for key in ('bounds', 'start', 'end'):
+            level[key] = level[key][order]
+        level = {'bounds': _group_bounds(level['bounds'], starts), 'start': starts,
+                 'end': np.append(starts[1:], len(order))}
+        levels.append(level)
+    return items, levels[::-1]
+
+
+def _band_range(values, low, height, bands):
+    """緯度所在的帶（依多邊形外框等分），超出範圍時取最近的一帶"""
+    band = np.floor((values - low) / height * bands)
+    return np.clip(band, 0, bands - 1).astype(np.int64)
+
+
+def _prepare_polygon(edges, box):
+    """將多邊形的邊依緯度分帶，回傳 (帶數, 各帶的邊數, 依帶排列的邊序號)
+
+    一條邊出現在它的緯度範圍涵蓋的每一帶；射線法只需要比對跨過座標緯度的邊，
+    這些邊一定在座標所在的那一帶裡。
+    """
+    bands = int(min(MAX_BANDS, max(1, len(edges) // EDGES_PER_BAND)))
+    height = box[3] - box[1]
+    if height <= 0:
+        bands = 1
+        height = 1.0
+    low = _band_range(np.minimum(edges[:, 1], edges[:, 3]), box[1], height, bands)
+    high = _band_range(np.maximum(edges[:, 1], edges[:, 3]), box[1], height, bands)
+    counts = high - low + 1
+    edge = np.repeat(np.arange(len(edges)), counts)
+    band = np.repeat(low, counts) + _ranges(counts)
+    order = np.argsort(band, kind='stable')
+    return bands, np.bincount(band, minlength=bands), edge[order]
+
+
+def _ranges(counts):
+    """把每段長度展開成段內的序號，例如 [2, 3] -> [0, 1, 0, 1, 2]"""
+    total = int(counts.sum())
+    return np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+def build_index(geojson, capacity=NODE_CAPACITY):
+    """由 GeoJSON 建立空間索引，只需建立一次；feature 的順序即查詢結果的區域編號
+
+    MultiPolygon 的每個多邊形各自是 R-tree 的一個項目，洞以同一個多邊形內的奇偶規則處理。
+    """
+    polygon_bounds, polygon_feature, edge_blocks = [], [], []
+    band_counts, band_sizes, band_edges = [], [], []
+    edge_total = 0
+    for feature_id, feature in enumerate(geojson['features']):
+        for polygon in geometry_prep.polygons(feature['geometry']):
+            rings = [np.asarray(ring, dtype=np.float64)[:, :2] for ring in polygon if len(ring) >= 3]
+            if not rings:
+                continue
+            # 每個環的點與下一個點相連（最後一點接回第一點；已閉合的環多一條長度為 0 的邊，不影響結果）
+            edges = np.vstack([np.hstack([ring, np.roll(ring, -1, axis=0)]) for ring in rings])
+            box = np.array([edges[:, 0].min(), edges[:, 1].min(), edges[:, 0].max(), edges[:, 1].max()])
+            bands, sizes, members = _prepare_polygon(edges, box)
+            polygon_bounds.append(box)
+            polygon_feature.append(feature_id)
+            edge_blocks.append(edges)
+            band_counts.append(bands)
+            band_sizes.append(sizes)
+            band_edges.append(members + edge_total)
+            edge_total += len(edges)
+
+    index = {
+        'features': len(geojson['features']),
+        'polygon_bounds': np.array(polygon_bounds, dtype=np.float64).reshape(-1, 4),
+        'polygon_feature': np.array(polygon_feature, dtype=np.int32),
+        'edges': np.vstack(edge_blocks) if edge_blocks else np.zeros((0, 4)),
+        'band_count': np.array(band_counts, dtype=np.int64),
+        # 第 p 個多邊形的帶在 band_start 中從 band_offset[p] 開始
+        'band_offset': np.cumsum([0] + band_counts[:-1], dtype=np.int64),
+        'band_start': np.cumsum([0] + [int(size) for sizes in band_sizes for size in sizes], dtype=np.int64),
+        'band_edges': np.concatenate(band_edges) if band_edges else np.zeros(0, dtype=np.int64),
+        'items': np.zeros(0, dtype=np.int64),
+        'tree': [],
+    }
+    if polygon_bounds:
+        index['items'], index['tree'] = build_tree(index['polygon_bounds'], capacity)
+    index['item_bounds'] = index['polygon_bounds'][index['items']]
+    return index
+
+
+def _candidates(index, x, y):
+    """沿 R-tree 逐層展開，回傳外框包含座標的 (座標序號, 多邊形編號) 配對"""
+    levels = index['tree']
+    root = levels[0]['bounds'][0]
+    point = np.flatnonzero((x >= root[0]) & (y >= root[1]) & (x <= root[2]) & (y <= root[3]))
+    node = np.zeros(len(point), dtype=np.int64)
+    for depth, level in enumerate(levels):
+        start, end = level['start'][node], level['end'][node]
+        counts = end - start
+        point = np.repeat(point, counts)
+        node = np.repeat(start, counts) + _ranges(counts)
+        bounds = levels[depth + 1]['bounds'] if depth + 1 < len(levels) else index['item_bounds']
+        box = bounds[node]
+        px, py = x[point], y[point]
+        keep = (px >= box[:, 0]) & (py >= box[:, 1]) & (px <= box[:, 2]) & (py <= box[:, 3])
+        point, node = point[keep], node[keep]
+    return point, index['items'][node]
+
+
+def _contains(index, x, y, point, polygon):
+    """射線法：只比對座標所在緯度帶的邊，回傳每個 (座標, 多邊形) 配對是否在多邊形內"""
+    box = index['polygon_bounds'][polygon]
+    bands = index['band_count'][polygon]
+    height = box[:, 3] - box[:, 1]
+    px, py = x[point], y[point]
+    band = _band_range(py, box[:, 1], np.where(height > 0, height, 1.0), bands)
+    slot = index['band_offset'][polygon] + band
+    start = index['band_start'][slot]
+    counts = index['band_start'][slot + 1] - start
+    pair = np.repeat(np.arange(len(point)), counts)
+    edges = index['edges'][index['band_edges'][np.repeat(start, counts) + _ranges(counts)]]
+    ex, ey = px[pair], py[pair]
+    x0, y0, x1, y1 = edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3]
+    crosses = (y0 > ey) != (y1 > ey)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crosses &= ex < x0 + (ey - y0) * (x1 - x0) / (y1 - y0)
+    return np.bincount(pair[crosses], minlength=len(point)) % 2 == 1
+
+
+def _locate_chunk(index, x, y):
+    """一批座標所在的 feature 編號；落在相鄰區域共用的邊界上時取編號較小者"""
+    result = np.full(len(x), NO_REGION, dtype=np.int32)
+    if not len(index['items']) or not len(x):
+        return result
+    point, polygon = _candidates(index, x, y)
+    inside = _contains(index, x, y, point, polygon)
+    point, feature = point[inside], index['polygon_feature'][polygon[inside]]
+    found = np.full(len(x), np.iinfo(np.int32).max, dtype=np.int32)
+    np.minimum.at(found, point, feature)
+    return np.where(found == np.iinfo(np.int32).max, NO_REGION, found).astype(np.int32)
+
+
+# 工作行程中的索引（由 initializer 傳入一次，之後每個區塊只傳座標）
+_WORKER_INDEX = None
+
+
+def _init_worker(index):
+    global _WORKER_INDEX
+    _WORKER_INDEX = index
+
+
+def _worker_locate(x, y):
+    return _locate_chunk(_WORKER_INDEX, x, y)
+
+
+def locate_chunks(index, chunks, workers=None):
+    """依序查詢 (附帶資料, 經度, 緯度) 區塊，逐一產生 (附帶資料, feature 編號)
+
+    workers > 1 時以多個行程平行查詢，同時最多只有 2 × workers 個區塊在處理中，
+    輸入可以是讀檔時才產生的迭代器（CSV 串流），結果依輸入順序產生。
+    """
+    if not workers or workers <= 1:
+        for payload, lon, lat in chunks:
+            x, y = np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+            yield payload, _locate_chunk(index, x, y)
+        return
+    pending = collections.deque()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(index,)) as pool:
+        for payload, lon, lat in chunks:
+            pending.append((payload, pool.submit(_worker_locate, np.asarray(lon, dtype=np.float64),
+                                                 np.asarray(lat, dtype=np.float64))))
+            if len(pending) >= 2 * workers:
+                payload, future = pending.popleft()
+                yield payload, future.result()
+        while pending:
+            payload, future = pending.popleft()
+            yield payload, future.result()
+
+
+def locate(index, lon, lat, workers=None, chunk_size=CHUNK_SIZE):
+    """每個座標所在的 feature 編號（int32 陣列），不在任何區域內（或座標為 NaN）時為 NO_REGION"""
+    x = np.asarray(lon, dtype=np.float64).ravel()
+    y = np.asarray(lat, dtype=np.float64).ravel()
+    if len(x) != len(y):
+        raise ValueError(f"經度 {len(x)} 筆與緯度 {len(y)} 筆數量不同")
+    chunks = ((None, x[start:start + chunk_size], y[start:start + chunk_size])
+              for start in range(0, len(x), chunk_size))
+    results = [ids for _, ids in locate_chunks(index, chunks, workers)]
+    return np.concatenate(results) if results else np.zeros(0, dtype=np.int32)
+
+
+def load_index(level='county', year=None, offline=False, refresh=False,
+               cache_dir=boundary_cache.DEFAULT_CACHE_DIR, store=None):
+    """以未簡化的邊界建立某個行政區層級的索引，並附上各區域的名稱、縣市代碼與語言數據
+
+    level 與 create_language_map 相同（county、township 或 groupings.json 的彙整層級）；
+    缺少邊界時回傳 None。
+    """
+    store = census_ingest.ensure_store() if store is None else store
+    table, _, township_index = tlm.load_language_table(level, year, store)
+    geojson = tlm.download_taiwan_geojson(offline, refresh, cache_dir, tlm.boundary_url(level))
+    if not geojson:
+        return None
+    unmatched = tlm.stamp_regions(geojson, level, township_index)
+    if unmatched:
+        logger.warning(f"無法對應名稱的區域：{'、'.join(str(name) for name in unmatched)}")
+
+    with instrumentation.span('point_lookup.build_index', level=level) as fields:
+        index = build_index(geojson)
+        fields.update(polygons=len(index['polygon_bounds']), edges=len(index['edges']))
+    properties = [feature['properties'] for feature in geojson['features']]
+    # 最後多一列給 NO_REGION（-1）：查不到的座標直接索引到 None / NaN
+    values = np.full((len(properties) + 1, len(table['languages'])), np.nan, dtype=np.float32)
+    for i, props in enumerate(properties):
+        row = table['index'].get(props['region_name'])
+        if row is not None:
+            values[i] = table['values'][row]
+    index.update({
+        'level': level,
+        'year': year,
+        'languages': table['languages'],
+        'regions': np.array([props['region_name'] for props in properties] + [None], dtype=object),
+        'county_codes': np.array([props['county_code'] for props in properties] + [None], dtype=object),
+        'values': values,
+    })
+    return index
+
+
+def lookup(index, lon, lat, workers=None, chunk_size=CHUNK_SIZE):
+    """座標陣列所在的區域與語言使用比例
+
+    回傳 {'feature': 編號, 'region': 區域名稱, 'county_code': 縣市代碼,
+    'values': (座標數, 語言數) 的比例矩陣, 'languages': 欄位順序}；查不到的座標為 None / NaN。
+    """
+    feature = locate(index, lon, lat, workers, chunk_size)
+    return {
+        'feature': feature,
+        'region': index['regions'][feature],
+        'county_code': index['county_codes'][feature],
+        'values': index['values'][feature],
+        'languages': index['languages'],
+    }
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _csv_chunks(reader, lon_position, lat_position, chunk_rows):
+    while True:
+        rows = list(itertools.islice(reader, chunk_rows))
+        if not rows:
+            return
+        lon = [_to_float(row[lon_position]) if len(row) > lon_position else math.nan for row in rows]
+        lat = [_to_float(row[lat_position]) if len(row) > lat_position else math.nan for row in rows]
+        yield rows, lon, lat
+
+
+def lookup_csv(index, input_path, output_path, lon_column='lon', lat_column='lat',
+               chunk_rows=CSV_CHUNK_ROWS, workers=None):
+    """逐區塊讀入 CSV、查詢並寫出，在每列後面加上區域、縣市代碼與各語言比例，回傳 (列數, 查到的列數)
+
+    經緯度無法解析的列保留原樣，新增的欄位留空。
+    """
+    total = found = 0
+    with open(input_path, 'r', encoding='utf-8-sig', newline='') as source, \
+            open(output_path, 'w', encoding='utf-8-sig', newline='') as target:
+        reader = csv.reader(source)
+        writer = csv.writer(target)
+        header = next(reader, None)
+        if header is None:
+            raise ValueError(f"{input_path} 是空的檔案")
+        for column in (lon_column, lat_column):
+            if column not in header:
+                raise ValueError(f"{input_path} 找不到欄位 {column}（現有欄位：{', '.join(header)}）")
+        writer.writerow(header + ['區域', '縣市代碼'] + list(index['languages']))
+
+        # 新增的欄位只由區域決定，每個區域（含最後的 NO_REGION）先組好一次
+        suffixes = [
+            [region or '', code or ''] + ['' if np.isnan(share) else round(float(share), 2) for share in shares]
+            for region, code, shares in zip(index['regions'], index['county_codes'], index['values'])
+        ]
+        chunks = _csv_chunks(reader, header.index(lon_column), header.index(lat_column), chunk_rows)
+        for rows, feature in locate_chunks(index, chunks, workers):
+            writer.writerows(row + suffixes[i] for row, i in zip(rows, feature.tolist()))
+            total += len(rows)
+            found += int((feature != NO_REGION).sum())
+    return total, found
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='將 CSV 中的經緯度對應到縣市（或鄉鎮）與語言使用比例')
+    parser.add_argument('input', help='輸入的 CSV（第一列為欄位名稱）')
+    parser.add_argument('output', help='輸出的 CSV')
+    parser.add_argument('--lon-column', default='lon', help='經度欄位')
+    parser.add_argument('--lat-column', default='lat', help='緯度欄位')
+    parser.add_argument('--level', choices=aggregation.levels(), default='county',
+                        help='行政區層級，或 groupings.json 中的彙整層級')
+    parser.add_argument('--year', type=int, help='普查年份（預設最新）')
+    parser.add_argument('--chunk-rows', type=int, default=CSV_CHUNK_ROWS, help='每次讀入的列數')
+    parser.add_argument('--workers', type=int, help='平行查詢的行程數（預設不使用多行程）')
+    parser.add_argument('--offline', action='store_true', help='只使用本地快取的邊界數據，不連網')
+    parser.add_argument('--refresh', action='store_true', help='連網檢查邊界數據是否有更新')
+    parser.add_argument('--cache-dir', default=boundary_cache.DEFAULT_CACHE_DIR, help='邊界快取目錄')
+    args = parser.parse_args()
+    instrumentation.configure_logging()
+
+    start = time.perf_counter()
+    index = load_index(args.level, args.year, args.offline, args.refresh, args.cache_dir)
+    if index is None:
+        print("無法建立索引：缺少地理數據")
+    else:
+        built = time.perf_counter() - start
+        total, found = lookup_csv(index, args.input, args.output, args.lon_column, args.lat_column,
+                                  args.chunk_rows, args.workers)
+        seconds = time.perf_counter() - start - built
+        print(f"{total:,} 列中 {found:,} 列落在區域內，索引 {built:.2f} 秒、查詢 {seconds:.2f} 秒 "
+              f"（每秒 {total / max(seconds, 1e-9):,.0f} 列） -> {args.output}")
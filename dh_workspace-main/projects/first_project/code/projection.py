@@ -0,0 +1,14 @@
+"""經緯度 -> Web Mercator 座標（vector_tiles 的圖磚座標與 static_render 的像素座標共用）"""
+import math
+
+import numpy as np
+
+
+def project(points, zoom):
+    """經緯度 -> 該縮放層級的 Web Mercator 圖磚座標（浮點數，整數部分為圖磚編號）"""
+    points = np.asarray(points, dtype=float)
+    scale = 2 ** zoom
+    lat = np.clip(points[:, 1], -85.0511, 85.0511)
+    x = (points[:, 0] + 180.0) / 360.0 * scale
+    y = (1.0 - np.log(np.tan(np.radians(lat)) + 1.0 / np.cos(np.radians(lat))) / math.pi) / 2.0 * scale
+    return np.column_stack([x, y])
@@ -0,0 +1,165 @@
+// 台澎金馬語言分布地圖的頁面腳本
+// 只讀取 Python 預先算好的數值（languageMapConfig）：每個區域的資料列號寫在 feature 的 row 屬性，
+// 兩種模式的顏色、樣式與各年份、各年齡層的數值都已算好，頁面不做名稱對應或主要語言的計算。
+document.addEventListener('DOMContentLoaded', function() {
+    var config = window.languageMapConfig;
+    var languageLayer = window[config.layer];
+    // data: {languages: [...], columns: [[各區域的華語], ...], colors: {normal: [...], exclude: [...]}}
+    var data = config.data;
+    var excludeMode = config.excludeMandarin;
+    var currentYear = config.year;
+    // 年齡層的索引（-1 為全部年齡）
+    var currentBand = -1;
+    var yearCache = {};
+    yearCache[currentYear] = {columns: data.columns, colors: data.colors, ages: data.ages};
+    // 目前顯示的欄陣列與顏色，由年份與年齡層決定
+    var view = yearCache[currentYear];
+
+    function loadYear(year) {
+        if (yearCache[year]) return Promise.resolve(yearCache[year]);
+        return fetch(config.yearFiles[year]).then(function(response) {
+            if (!response.ok) throw new Error(response.status);
+            return response.json();
+        }).then(function(payload) {
+            yearCache[year] = payload;
+            return payload;
+        });
+    }
+
+    // 年齡層的數值與主要語言是攤平的數字陣列（年齡層, 語言, 區域），切出一個年齡層即可
+    function bandView(ages, band) {
+        var languages = data.languages.length;
+        var regions = ages.values.length / (ages.bands.length * languages);
+        var columns = data.languages.map(function(lang, j) {
+            var start = (band * languages + j) * regions;
+            return ages.values.slice(start, start + regions);
+        });
+        function colors(dominant) {
+            return dominant.slice(band * regions, (band + 1) * regions).map(function(index) {
+                return index < 0 ? config.noDataColor : config.palette[index];
+            });
+        }
+        return {columns: columns, colors: {normal: colors(ages.dominant.normal), exclude: colors(ages.dominant.exclude)}};
+    }
+
+    // 沒有年齡層數據的年份：所有區域顯示為沒有數據
+    function emptyView(payload) {
+        var empty = payload.colors.normal.map(function() { return null; });
+        var noData = empty.map(function() { return config.noDataColor; });
+        return {columns: data.languages.map(function() { return empty; }), colors: {normal: noData, exclude: noData}};
+    }
+
+    function updateView() {
+        var payload = yearCache[currentYear];
+        if (currentBand < 0) view = payload;
+        else view = payload.ages ? bandView(payload.ages, currentBand) : emptyView(payload);
+    }
+
+    function featureStyle(feature) {
+        var row = feature.properties.row;
+        var color = row === null || row === undefined ? config.noDataColor
+            : view.colors[excludeMode ? 'exclude' : 'normal'][row];
+        var style = color === config.noDataColor ? config.styles.noData : config.styles.data;
+        return Object.assign({}, style, {fillColor: color});
+    }
+
+    // 彈窗內容在開啟時才依目前的模式、年份與年齡層產生（備註只適用於內嵌年份的全部年齡）
+    function popupContent(feature) {
+        var row = feature.properties.row;
+        var name = feature.properties.region_name;
+        var values = [];
+        data.languages.forEach(function(lang, j) {
+            var value = view.columns[j][row];
+            if (value !== null && !(excludeMode && config.exclude.indexOf(lang) >= 0)) values.push([lang, value]);
+        });
+        if (currentBand >= 0) {
+            return languagePopup(name + '（' + data.ages.bands[currentBand] + '）', values, null);
+        }
+        return languagePopup(name, values, currentYear === config.year ? config.notes[name] : null);
+    }
+
+    // 切換模式、年份或年齡層：只改變既有圖層的樣式，不重新建立圖層
+    function applyStyles() {
+        languageLayer.eachLayer(function(geoLayer) {
+            geoLayer.eachLayer(function(layer) { layer.setStyle(featureStyle(layer.feature)); });
+        });
+    }
+
+    languageLayer.eachLayer(function(geoLayer) {
+        // 預設樣式改為讀取目前模式，滑鼠移出時 resetStyle 才會還原成正確的顏色
+        geoLayer.options.style = featureStyle;
+        geoLayer.eachLayer(function(layer) {
+            var row = layer.feature.properties.row;
+            if (row === null || row === undefined) return;
+            layer.bindPopup(function() { return popupContent(layer.feature); }, {maxWidth: 300});
+            // TopoJSON 圖層沒有 folium 的滑鼠懸停效果，在此補上
+            if (config.bindHighlight) {
+                layer.on('mouseover', function() { this.setStyle(config.styles.highlight); });
+                layer.on('mouseout', function() { geoLayer.resetStyle(this); });
+            }
+        });
+    });
+
+    document.querySelectorAll('input[name="language_mode"]').forEach(function(radio) {
+        radio.addEventListener('change', function() {
+            excludeMode = this.value === 'exclude';
+            applyStyles();
+        });
+    });
+
+    // 年份滑桿：換掉數值與顏色後重新套用目前的模式，幾何不變
+    var yearSlider = document.getElementById('census-year');
+    if (yearSlider) {
+        yearSlider.addEventListener('input', function() {
+            var year = config.years[this.value];
+            loadYear(year).then(function() {
+                currentYear = year;
+                updateView();
+                document.getElementById('census-year-label').textContent = year;
+                applyStyles();
+            }).catch(function(error) {
+                document.getElementById('census-year-label').textContent = year + '（無法載入）';
+                console.error('載入普查年份失敗', year, error);
+            });
+        });
+    }
+
+    // 年齡層選單：換成該年齡層的數值與顏色，幾何不變
+    var ageSelect = document.getElementById('age-band');
+    if (ageSelect) {
+        ageSelect.addEventListener('change', function() {
+            currentBand = Number(this.value);
+            updateView();
+            applyStyles();
+        });
+    }
+
+    // 監看模式（map_watch.py）：定期讀取即時數據檔，數值或備註變動時換掉各年份的數值與顏色再重新套用樣式；
+    // 頁面版本不同（幾何或區域清單改變，頁面已重新產生）時重新載入整頁
+    if (config.live) {
+        var liveVersion = null;
+        var pollLive = function() {
+            fetch(config.live.file, {cache: 'no-store'}).then(function(response) {
+                if (!response.ok) throw new Error(response.status);
+                return response.json();
+            }).then(function(live) {
+                if (live.page !== config.live.page) {
+                    location.reload();
+                    return;
+                }
+                if (live.version === liveVersion) return;
+                liveVersion = live.version;
+                Object.keys(live.years).forEach(function(year) { yearCache[year] = live.years[year]; });
+                if (live.years[config.year] && live.years[config.year].ages) data.ages = live.years[config.year].ages;
+                config.notes = live.notes;
+                updateView();
+                applyStyles();
+            }).catch(function(error) {
+                console.error('載入即時數據失敗', error);
+            }).then(function() {
+                setTimeout(pollLive, config.live.poll);
+            });
+        };
+        pollLive();
+    }
+});
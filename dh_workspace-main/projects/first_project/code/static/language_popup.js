@@ -0,0 +1,19 @@
+// 語言比例彈窗：languagePopup(名稱, [[語言, 數值], ...], 備註)
+// 模板與顏色由頁面上的 languagePopupConfig 提供（taiwan_language_map_new.POPUP_TEMPLATES），
+// 與 Python 的 create_popup_content 產生相同的 HTML。
+var languagePopup = (function() {
+    var config = window.languagePopupConfig;
+    function fill(template, values) {
+        return template.replace(/\{(\w+)\}/g, function(match, key) { return values[key]; });
+    }
+    return function(name, values, note) {
+        if (!values.length) return fill(config.templates.empty, {name: name});
+        var rows = values.slice().sort(function(a, b) { return b[1] - a[1]; }).map(function(item) {
+            var color = config.colors[item[0]] || config.defaultColor;
+            return fill(config.templates.row, {language: item[0], value: item[1], width: Math.min(item[1], 100),
+                                               color: color});
+        });
+        return fill(config.templates.popup, {name: name, rows: rows.join(''),
+                                             note: note ? fill(config.templates.note, {note: note}) : ''});
+    };
+})();
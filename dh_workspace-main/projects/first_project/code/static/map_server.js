@@ -0,0 +1,80 @@
+// 地圖伺服器頁面的腳本：幾何、顏色與彈窗都由伺服器的端點提供（設定見 languageServerConfig）
+document.addEventListener('DOMContentLoaded', function() {
+    var config = window.languageServerConfig;
+    var mapObj = window[config.map];
+    var currentYear = config.year;
+    var exclude = config.exclude;
+    var colors = [];
+    var regionLayers = [];
+    var popupCache = {};
+
+    function query() {
+        var params = ['level=' + encodeURIComponent(config.level)];
+        if (currentYear !== null) params.push('year=' + currentYear);
+        if (exclude.length) params.push('exclude=' + encodeURIComponent(exclude.join(',')));
+        return params.join('&');
+    }
+
+    function getJSON(url) {
+        return fetch(url).then(function(response) {
+            if (!response.ok) throw new Error(response.status);
+            return response.json();
+        });
+    }
+
+    function regionStyle(i) {
+        var color = colors[i] || config.noDataColor;
+        var style = color === config.noDataColor ? config.styles.noData : config.styles.data;
+        return Object.assign({}, style, {fillColor: color});
+    }
+
+    // 取得目前年份與模式的顏色，只改變既有圖層的樣式
+    function applyStyle() {
+        return getJSON('/style?' + query()).then(function(payload) {
+            colors = payload.colors;
+            regionLayers.forEach(function(layer, i) { layer.setStyle(regionStyle(i)); });
+        });
+    }
+
+    // 點擊區域時才載入彈窗內容
+    function openPopup(region, latlng) {
+        var url = '/popup/' + encodeURIComponent(region) + '?' + query();
+        var request = popupCache[url] || (popupCache[url] = getJSON(url));
+        request.then(function(payload) {
+            L.popup({maxWidth: 300}).setLatLng(latlng).setContent(payload.html).openOn(mapObj);
+        });
+    }
+
+    getJSON('/geometry?level=' + encodeURIComponent(config.level)).then(function(geojson) {
+        var languageLayer = L.geoJSON(geojson, {
+            style: function() { return regionStyle(-1); },
+            onEachFeature: function(feature, layer) {
+                var i = regionLayers.length;
+                regionLayers.push(layer);
+                layer.on('click', function(e) {
+                    if (feature.properties.region_name) openPopup(feature.properties.region_name, e.latlng);
+                });
+                layer.on('mouseover', function() { this.setStyle(config.styles.highlight); });
+                layer.on('mouseout', function() { this.setStyle(regionStyle(i)); });
+            }
+        }).addTo(mapObj);
+        mapObj.fitBounds(languageLayer.getBounds());
+        return applyStyle();
+    });
+
+    document.querySelectorAll('input[name="language_mode"]').forEach(function(radio) {
+        radio.addEventListener('change', function() {
+            exclude = this.value === 'exclude' ? config.modeExclude : [];
+            applyStyle();
+        });
+    });
+
+    var yearSlider = document.getElementById('census-year');
+    if (yearSlider) {
+        yearSlider.addEventListener('input', function() {
+            currentYear = config.years[this.value];
+            document.getElementById('census-year-label').textContent = currentYear;
+            applyStyle();
+        });
+    }
+});
@@ -0,0 +1,35 @@
+// 向量圖磚頁面的腳本：樣式與彈窗只讀取圖磚屬性中預先算好的主要語言與比例（設定見 languageTileConfig）
+// languageTileStyle 在建立圖層時就會用到，必須在頁面載入完成前定義
+var languageTileMode = window.languageTileConfig.excludeMandarin ? 'dominant_exclude' : 'dominant';
+
+function languageTileStyle(properties) {
+    var config = window.languageTileConfig;
+    var color = config.colors[properties[languageTileMode]];
+    return Object.assign({fill: true, fillColor: color || config.noDataColor},
+                         color ? config.styles.data : config.styles.noData);
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    var config = window.languageTileConfig;
+    var mapObj = window[config.map];
+    var tileLayer = window[config.layer];
+
+    // 彈窗內容直接由圖磚中的屬性，以共用的 languagePopup 模板產生
+    tileLayer.on('click', function(e) {
+        var properties = e.layer.properties;
+        var excludeMode = languageTileMode === 'dominant_exclude';
+        var values = config.languages.filter(function(lang) {
+            return properties[lang] !== undefined && !(excludeMode && config.exclude.indexOf(lang) >= 0);
+        }).map(function(lang) { return [lang, properties[lang]]; });
+        L.popup({maxWidth: 300}).setLatLng(e.latlng)
+            .setContent(languagePopup(properties.region_name, values)).openOn(mapObj);
+    });
+
+    // 切換模式：只改變樣式函數讀取的欄位並重繪已載入的圖磚
+    document.querySelectorAll('input[name="language_mode"]').forEach(function(radio) {
+        radio.addEventListener('change', function() {
+            languageTileMode = this.value === 'exclude' ? 'dominant_exclude' : 'dominant';
+            tileLayer.redraw();
+        });
+    });
+});
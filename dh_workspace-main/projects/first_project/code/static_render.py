@@ -0,0 +1,368 @@
+"""不經瀏覽器，直接將主要語言分布圖輸出成 PNG 或 SVG（供 PDF 報告與儀表板嵌入）
+
+用法：
+    python static_render.py --offline --output taiwan_language_map.png
+    python static_render.py --level township --exclude-mandarin --output township.svg
+
+邊界投影（Web Mercator）後的座標依「邊界內容 + 簡化參數」快取在 cache_dir/projected，
+同一份邊界產生多種變化（年份、排除華語、縣市範圍、尺寸）時只需投影一次。
+PNG 以 numpy 掃描線一次填滿所有區域，再以 zlib 編碼，不需要其他影像套件。
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+import boundary_cache
+import census_ingest
+import county_names
+import geometry_prep
+import instrumentation
+import language_model
+import projection
+import taiwan_language_map_new as tlm
+
+logger = instrumentation.get_logger('static_render')
+
+DEFAULT_WIDTH = 1200
+DEFAULT_ZOOM = 9        # 簡化程度（相當於網頁地圖的縮放層級）
+MARGIN = 20             # 地圖四周的留白（像素）
+FILL_OPACITY = 0.7      # 與網頁地圖相同的填色透明度
+BORDER_COLOR = '#333333'
+BACKGROUND_COLOR = '#ffffff'
+LEGEND_TITLE = '台澎金馬語言分布地圖'
+LEGEND_SUBTITLE = '(基於人口普查真實數據)'
+
+# 同一行程內重複產生時直接沿用投影結果
+_PROJECTED = {}
+
+
+def projected_geometry(level='county', offline=False, refresh=False, cache_dir=boundary_cache.DEFAULT_CACHE_DIR,
+                       zoom=DEFAULT_ZOOM):
+    """取得簡化並投影後的邊界，缺少邊界時回傳 None
+
+    回傳 {'properties': [...], 'xy': (點數, 2) 的 Web Mercator 座標（0~1）,
+          'ring_offsets': 每個環的起點, 'feature_rings': 每個區域的第一個環}；
+    屬性為原始邊界屬性，區域名稱在每次繪製時才對應（名稱表可能隨語言數據更新）。
+    """
+    # 已快取的邊界（未要求更新時）直接查投影快取，不必再讀取簡化後的 GeoJSON
+    entry = boundary_cache.cache_entry(tlm.boundary_url(level), cache_dir)
+    prepared = None
+    if not entry or refresh:
+        prepared = tlm.load_prepared_boundaries(level, offline, refresh, cache_dir, zoom)
+        if not prepared:
+            return None
+        entry = boundary_cache.cache_entry(tlm.boundary_url(level), cache_dir)
+    options = json.dumps([level, zoom])
+    key = entry['sha256'][:16] + '-' + hashlib.sha1(options.encode('utf-8')).hexdigest()[:12]
+    if key in _PROJECTED:
+        return _PROJECTED[key]
+
+    path = os.path.join(cache_dir, 'projected', key + '.npz')
+    if os.path.exists(path) and not refresh:
+        try:
+            with np.load(path) as cached:
+                geometry = {
+                    'properties': json.loads(str(cached['properties'])),
+                    'xy': cached['xy'],
+                    'ring_offsets': cached['ring_offsets'],
+                    'feature_rings': cached['feature_rings'],
+                }
+            _PROJECTED[key] = geometry
+            return geometry
+        except (OSError, ValueError, KeyError):
+            pass
+
+    prepared = prepared or tlm.load_prepared_boundaries(level, offline, refresh, cache_dir, zoom)
+    if not prepared:
+        return None
+    geojson = prepared[0]
+    rings, feature_rings = [], [0]
+    for feature in geojson['features']:
+        for polygon in geometry_prep.polygons(feature['geometry']):
+            rings.extend(ring for ring in polygon if len(ring) >= 3)
+        feature_rings.append(len(rings))
+    lengths = np.array([len(ring) for ring in rings], dtype=np.int64)
+    points = [point for ring in rings for point in ring]
+    geometry = {
+        'properties': [feature['properties'] for feature in geojson['features']],
+        'xy': projection.project(points, 0) if points else np.zeros((0, 2)),
+        'ring_offsets': np.concatenate([[0], np.cumsum(lengths)]),
+        'feature_rings': np.array(feature_rings, dtype=np.int64),
+    }
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, properties=json.dumps(geometry['properties'], ensure_ascii=False),
+             xy=geometry['xy'], ring_offsets=geometry['ring_offsets'], feature_rings=geometry['feature_rings'])
+    os.replace(tmp_path, path)
+    _PROJECTED[key] = geometry
+    return geometry
+
+
+def select_features(geometry, counties=None):
+    """指定縣市時只保留其中的區域，回傳區域序號陣列"""
+    features = np.arange(len(geometry['properties']))
+    if counties:
+        selected = {county_names.canonical_name(name) or name for name in counties}
+        features = np.array([i for i in features if geometry['properties'][i].get('county_name') in selected],
+                            dtype=np.int64)
+    return features
+
+
+def _edges(geometry, features):
+    """所選區域的所有邊：(起點, 終點, 區域序號)"""
+    ring_offsets = geometry['ring_offsets']
+    feature_rings = geometry['feature_rings']
+    ring_ids = np.concatenate([np.arange(feature_rings[i], feature_rings[i + 1]) for i in features]
+                              or [np.zeros(0, dtype=np.int64)])
+    if len(ring_ids) == 0:
+        return np.zeros((0, 2)), np.zeros((0, 2)), np.zeros(0, dtype=np.int64)
+    # 每個環的點（相鄰兩點成一條邊，最後一點連回第一點）
+    starts, ends = ring_offsets[ring_ids], ring_offsets[ring_ids + 1]
+    counts = ends - starts
+    point_ids = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    next_ids = point_ids + 1
+    ring_end = np.cumsum(counts) - 1
+    next_ids[ring_end] = starts
+    ring_feature = np.repeat(features, feature_rings[features + 1] - feature_rings[features])
+    return geometry['xy'][point_ids], geometry['xy'][next_ids], np.repeat(ring_feature, counts)
+
+
+def view_transform(geometry, features, width, height=None, margin=MARGIN):
+    """由所選區域的範圍算出 (縮放比例, 左上角座標, 寬, 高)"""
+    ring_offsets = geometry['ring_offsets']
+    feature_rings = geometry['feature_rings']
+    spans = [(ring_offsets[feature_rings[i]], ring_offsets[feature_rings[i + 1]]) for i in features]
+    xy = np.concatenate([geometry['xy'][start:end] for start, end in spans if end > start])
+    low, high = xy.min(axis=0), xy.max(axis=0)
+    size = np.maximum(high - low, 1e-12)
+    scale = (width - 2 * margin) / size[0]
+    if height is None:
+        height = int(round(size[1] * scale)) + 2 * margin
+    else:
+        scale = min(scale, (height - 2 * margin) / size[1])
+    # 置中
+    origin = low - (np.array([width, height]) / scale - size) / 2
+    return scale, origin, width, height
+
+
+def rasterize(geometry, features, scale, origin, width, height):
+    """以掃描線（像素中心）填滿所有區域，回傳 (高, 寬) 的區域序號陣列（背景為 -1）
+
+    所有邊與掃描線的交點一次算出，依（區域, 列, x）排序後兩兩配對成填色區段；
+    每個像素取同一列中最近一個區段起點的區域，再以差分陣列算出的覆蓋次數去掉區段外的像素。
+    共用邊在相鄰區域算出的交點相同，簡化後少數重疊的像素由較晚開始的區段決定。
+    """
+    start, end, edge_feature = _edges(geometry, features)
+    start = (start - origin) * scale
+    end = (end - origin) * scale
+    y_low = np.minimum(start[:, 1], end[:, 1])
+    y_high = np.maximum(start[:, 1], end[:, 1])
+    row_first = np.clip(np.ceil(y_low - 0.5), 0, height).astype(np.int64)
+    row_last = np.clip(np.ceil(y_high - 0.5), 0, height).astype(np.int64)
+    counts = np.maximum(row_last - row_first, 0)
+
+    edge_ids = np.repeat(np.arange(len(counts)), counts)
+    rows = row_first[edge_ids] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    s, e = start[edge_ids], end[edge_ids]
+    xs = s[:, 0] + (rows + 0.5 - s[:, 1]) * (e[:, 0] - s[:, 0]) / (e[:, 1] - s[:, 1])
+    owners = edge_feature[edge_ids]
+
+    order = np.lexsort((xs, rows, owners))
+    xs, rows, owners = xs[order], rows[order], owners[order]
+    span_start = np.clip(np.ceil(xs[0::2] - 0.5), 0, width).astype(np.int64)
+    span_end = np.clip(np.ceil(xs[1::2] - 0.5), 0, width).astype(np.int64)
+    span_rows, span_owner = rows[0::2], owners[0::2]
+    keep = span_end > span_start
+    span_start, span_end, span_rows, span_owner = span_start[keep], span_end[keep], span_rows[keep], span_owner[keep]
+
+    stride = width + 1
+    coverage = np.bincount(span_rows * stride + span_start, minlength=height * stride)
+    coverage -= np.bincount(span_rows * stride + span_end, minlength=height * stride)
+    covered = np.cumsum(coverage.reshape(height, stride)[:, :width], axis=1) > 0
+
+    owner_at = np.full(height * stride, -1, dtype=np.int64)
+    owner_at[span_rows * stride + span_start] = span_owner
+    owner_at = owner_at.reshape(height, stride)[:, :width]
+    columns = np.where(owner_at >= 0, np.arange(width), 0)
+    np.maximum.accumulate(columns, axis=1, out=columns)
+    labels = np.take_along_axis(owner_at, columns, axis=1)
+    return np.where(covered, labels, -1)
+
+
+def _rgb(color):
+    color = color.lstrip('#')
+    return [int(color[i:i + 2], 16) for i in (0, 2, 4)]
+
+
+def region_colors(geometry, table, level='county', township_index=None, exclude_mandarin=False):
+    """每個區域的主要語言顏色（依 properties 順序）"""
+    properties = {'features': [{'properties': dict(p)} for p in geometry['properties']]}
+    unmatched = tlm.stamp_regions(properties, level, township_index)
+    if unmatched:
+        logger.warning(f"無法對應名稱的區域：{'、'.join(str(name) for name in unmatched)}")
+    regions = [feature['properties']['region_name'] or '' for feature in properties['features']]
+    aligned = language_model.align_table(table, regions)
+    colors = language_model.dominant_colors(aligned, ['華語'] if exclude_mandarin else ())
+    return colors.tolist(), properties['features']
+
+
+def compose_image(labels, colors, background=BACKGROUND_COLOR, border=BORDER_COLOR, opacity=FILL_OPACITY):
+    """由區域序號陣列產生 RGB 影像：半透明填色疊在背景上，區域交界畫上邊框"""
+    background_rgb = np.array(_rgb(background), dtype=float)
+    palette = np.array([_rgb(color) for color in colors] + [list(background_rgb)], dtype=float)
+    palette[:-1] = palette[:-1] * opacity + background_rgb * (1 - opacity)
+    image = palette[labels].astype(np.uint8)    # -1（背景）取到最後一列
+
+    edges = np.zeros(labels.shape, dtype=bool)
+    edges[:, 1:] |= labels[:, 1:] != labels[:, :-1]
+    edges[1:, :] |= labels[1:, :] != labels[:-1, :]
+    image[edges] = _rgb(border)
+    return image
+
+
+def draw_legend(image, languages, font=None, margin=MARGIN):
+    """在右下角畫上圖例；font 為支援中文的字型檔（需要 Pillow），未指定時只畫色塊"""
+    swatch, gap = 16, 8
+    label_width = 80 if font else 0
+    box_width = swatch + label_width + 3 * gap
+    box_height = len(languages) * (swatch + gap) + gap
+    height, width = image.shape[:2]
+    top, left = height - margin - box_height, width - margin - box_width
+    if top < 0 or left < 0:
+        return image
+    image[top:top + box_height, left:left + box_width] = 255
+    image[top, left:left + box_width] = image[top + box_height - 1, left:left + box_width] = 128
+    image[top:top + box_height, left] = image[top:top + box_height, left + box_width - 1] = 128
+    for i, language in enumerate(languages):
+        y, x = top + gap + i * (swatch + gap), left + gap
+        image[y:y + swatch, x:x + swatch] = 0
+        image[y + 1:y + swatch - 1, x + 1:x + swatch - 1] = _rgb(language_model.LANGUAGE_COLORS[language])
+
+    if font:
+        from PIL import Image, ImageDraw, ImageFont
+
+        canvas = Image.fromarray(image)
+        draw = ImageDraw.Draw(canvas)
+        typeface = ImageFont.truetype(font, 14)
+        for i, language in enumerate(languages):
+            draw.text((left + 2 * gap + swatch, top + gap + i * (swatch + gap)), language, fill=(0, 0, 0),
+                      font=typeface)
+        image = np.asarray(canvas).copy()
+    return image
+
+
+def encode_png(image):
+    """將 (高, 寬, 3) 的 uint8 陣列編碼成 PNG（每列前加上 filter 0，zlib 壓縮）"""
+    height, width = image.shape[:2]
+    raw = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    raw[:, 1:] = image.reshape(height, width * 3)
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header)
+            + chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)) + chunk(b'IEND', b''))
+
+
+def render_svg(geometry, features, colors, scale, origin, width, height, languages, year=None):
+    """輸出 SVG：每個區域一個 path（evenodd 填色處理飛地與內環），加上與網頁相同的圖例文字"""
+    ring_offsets = geometry['ring_offsets']
+    feature_rings = geometry['feature_rings']
+    xy = np.round((geometry['xy'] - origin) * scale, 1)
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}">',
+        f'<rect width="100%" height="100%" fill="{BACKGROUND_COLOR}"/>',
+        f'<g stroke="{BORDER_COLOR}" stroke-width="0.5" fill-opacity="{FILL_OPACITY}" fill-rule="evenodd">',
+    ]
+    for i in features:
+        path = []
+        for ring in range(feature_rings[i], feature_rings[i + 1]):
+            points = xy[ring_offsets[ring]:ring_offsets[ring + 1]]
+            coords = ' '.join(f'{x:g},{y:g}' for x, y in points.tolist())
+            path.append(f'M{coords}Z')
+        if path:
+            name = geometry['properties'][i].get('region_name') or ''
+            parts.append(f'<path fill="{colors[i]}" d="{"".join(path)}"><title>{name}</title></path>')
+    parts.append('</g>')
+
+    # 圖例
+    row = 22
+    box_height = 70 + row * len(languages)
+    left, top = width - MARGIN - 200, height - MARGIN - box_height
+    title = LEGEND_TITLE + (f'（{year}）' if year else '')
+    parts.append(f'<g font-family="sans-serif" font-size="14" transform="translate({left},{top})">')
+    parts.append(f'<rect width="200" height="{box_height}" fill="white" fill-opacity="0.9" stroke="grey" stroke-width="2"/>')
+    parts.append(f'<text x="10" y="22" font-weight="bold">{title}</text>')
+    parts.append(f'<text x="10" y="40" font-size="11" fill="#666">{LEGEND_SUBTITLE}</text>')
+    parts.append('<text x="10" y="60" font-weight="bold">顏色代表主要使用語言：</text>')
+    for j, language in enumerate(languages):
+        y = 68 + j * row
+        parts.append(f'<rect x="10" y="{y}" width="18" height="18" fill="{language_model.LANGUAGE_COLORS[language]}" '
+                     f'stroke="black"/><text x="36" y="{y + 14}">{language}</text>')
+    parts.append('</g></svg>')
+    return '\n'.join(parts)
+
+
+def render_map(output, level='county', year=None, exclude_mandarin=False, counties=None, width=DEFAULT_WIDTH,
+               height=None, offline=False, refresh=False, cache_dir=boundary_cache.DEFAULT_CACHE_DIR,
+               zoom=DEFAULT_ZOOM, font=None, store=None):
+    """產生一張靜態地圖，格式依副檔名（.png / .svg），回傳耗時秒數（失敗時回傳 None）"""
+    start = time.perf_counter()
+    geometry = projected_geometry(level, offline, refresh, cache_dir, zoom)
+    if not geometry:
+        logger.error("無法產生地圖：缺少地理數據")
+        return None
+
+    table, _, township_index = tlm.load_language_table(level, year, store)
+    colors, stamped = region_colors(geometry, table, level, township_index, exclude_mandarin)
+    geometry = dict(geometry, properties=[feature['properties'] for feature in stamped])
+    features = select_features(geometry, counties)
+    if len(features) == 0:
+        logger.error(f"找不到指定的縣市：{'、'.join(counties)}")
+        return None
+
+    scale, origin, width, height = view_transform(geometry, features, width, height)
+    languages = [language for language in table['languages'] if language in language_model.LANGUAGE_COLORS]
+    if output.lower().endswith('.svg'):
+        content = render_svg(geometry, features, colors, scale, origin, width, height, languages, year)
+        with open(output, 'w', encoding='utf-8') as file:
+            file.write(content)
+    else:
+        labels = rasterize(geometry, features, scale, origin, width, height)
+        image = draw_legend(compose_image(labels, colors), languages, font)
+        with open(output, 'wb') as file:
+            file.write(encode_png(image))
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='將語言分布圖輸出成 PNG / SVG（不需瀏覽器）')
+    parser.add_argument('--output', default='taiwan_language_map.png', help='輸出檔名（.png 或 .svg）')
+    parser.add_argument('--level', choices=['county', 'township'], default='county', help='行政區層級')
+    parser.add_argument('--year', type=int, help='普查年份（預設最新）')
+    parser.add_argument('--exclude-mandarin', action='store_true', help='以排除華語後的主要語言上色')
+    parser.add_argument('--counties', nargs='+', help='只畫出這些縣市並縮放到其範圍')
+    parser.add_argument('--width', type=int, default=DEFAULT_WIDTH, help='寬度（像素）')
+    parser.add_argument('--height', type=int, help='高度（像素，預設依範圍比例）')
+    parser.add_argument('--zoom', type=float, default=DEFAULT_ZOOM, help='邊界簡化程度（對應網頁地圖縮放層級）')
+    parser.add_argument('--font', help='PNG 圖例使用的中文字型檔（需要 Pillow）')
+    parser.add_argument('--offline', action='store_true', help='只使用本地快取的邊界數據，不連網')
+    parser.add_argument('--refresh', action='store_true', help='連網檢查邊界數據是否有更新')
+    parser.add_argument('--cache-dir', default=boundary_cache.DEFAULT_CACHE_DIR, help='邊界快取目錄')
+    args = parser.parse_args()
+    instrumentation.configure_logging()
+
+    seconds = render_map(args.output, args.level, args.year, args.exclude_mandarin, args.counties, args.width,
+                         args.height, args.offline, args.refresh, args.cache_dir, args.zoom, args.font,
+                         census_ingest.ensure_store())
+    if seconds is not None:
+        print(f"地圖已保存為 {args.output}（{seconds:.2f} 秒）")
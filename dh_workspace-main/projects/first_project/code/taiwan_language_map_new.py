@@ -1,546 +1,404 @@
-import folium
+import argparse
+import hashlib
+import importlib.util
 import json
-import requests
-import csv
 import os
+import sys
 
-def download_taiwan_geojson():
-    """下載台灣縣市邊界的 GeoJSON 數據"""
-    url = "https://raw.githubusercontent.com/g0v/twgeojson/master/json/twCounty2010.geo.json"
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return response.json()
-    except Exception as e:
-        print(f"無法下載台灣地理數據：{e}")
-        return None
+import boundary_cache
+import county_names
+import geometry_prep
+import instrumentation
+
+
+def _lazy_import(name):
+    """延後載入的模組：第一次讀取屬性時才真正匯入（importlib 文件中 LazyLoader 的作法）
+
+    folium、numpy 與 openpyxl 佔了匯入時間的大部分，只在產生地圖或讀取數據時才需要。
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+folium = _lazy_import('folium')
+aggregation = _lazy_import('aggregation')
+census_ingest = _lazy_import('census_ingest')
+html_writer = _lazy_import('html_writer')
+language_model = _lazy_import('language_model')
+
+TAIWAN_GEOJSON_URL = "https://raw.githubusercontent.com/g0v/twgeojson/master/json/twCounty2010.geo.json"
+# 鄉鎮市區邊界（1982 年的名稱，改制後的名稱由 county_names 對應）
+TOWNSHIP_GEOJSON_URL = "https://raw.githubusercontent.com/g0v/twgeojson/master/json/twTown1982.geo.json"
+# 各普查年份的數據檔（與 HTML 放在同一層，由頁面在切換年份時才載入）
+YEAR_SIDECAR_DIR = 'taiwan_language_map_years'
+# 頁面腳本（靜態檔案，產生頁面時壓縮後內嵌，數據另以設定物件提供）
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+# 區域樣式（Python 的樣式函數與頁面腳本共用，fillColor 另外填入）
+REGION_STYLE = {'color': 'black', 'weight': 1, 'fillOpacity': 0.7}
+NO_DATA_STYLE = {'color': 'black', 'weight': 1, 'fillOpacity': 0.3}
+HIGHLIGHT_STYLE = {'fillColor': '#43484A', 'color': 'black', 'weight': 2, 'fillOpacity': 0.7}
+
+# 已讀取並壓縮的頁面腳本
+_STATIC_SCRIPTS = {}
+
+logger = instrumentation.get_logger('taiwan_language_map')
+
+def download_taiwan_geojson(offline=False, refresh=False, cache_dir=boundary_cache.DEFAULT_CACHE_DIR,
+                            url=TAIWAN_GEOJSON_URL):
+    """取得台灣縣市（或鄉鎮市區）邊界的 GeoJSON 數據（優先讀取本地快取）"""
+    return boundary_cache.load_boundaries(
+        url,
+        cache_dir=cache_dir,
+        offline=offline,
+        refresh=refresh
+    )
 
 def normalize_county_name(name):
     """統一處理縣市名稱，處理各種異體字和行政區劃變更"""
     if not name:
         return name
     
-    # 處理台/臺的轉換
-    name = name.replace('台', '臺')
-    
-    # 處理簡繁體字轉換
-    char_mapping = {
-        '云': '雲',  # 云林縣 -> 雲林縣
-        '慄': '栗',  # 苗慄縣 -> 苗栗縣
-    }
-    
-    for old_char, new_char in char_mapping.items():
-        name = name.replace(old_char, new_char)
-    
-    # 處理特殊的縣市轉換（因行政區劃調整）
-    county_city_mapping = {
-        '桃園縣': '桃園市',
-        '臺北縣': '新北市',
-        '台北縣': '新北市'
-    }
-    
-    return county_city_mapping.get(name, name)
+    # 已知的縣市直接查表；其他名稱只統一異體字
+    return county_names.canonical_name(name) or county_names.fold_variants(name)
 
-def load_language_data():
-    """從CSV文件載入真實的語言使用數據"""
-    language_data = {}
-    language_notes = {}
-    
-    # 獲取CSV文件路徑
-    csv_path = os.path.join(os.path.dirname(__file__), 'language_data.csv')
-    
+def feature_county_name(feature):
+    """讀取 feature 上已對應好的區域名稱（縣市或鄉鎮，尚未對應時才即時查詢縣市）"""
+    properties = feature['properties']
+    if 'region_name' in properties:
+        return properties['region_name']
+    return county_names.canonical_name(properties.get('COUNTYNAME'))
+
+def load_language_data(dataset=None):
+    """從普查報表的欄式資料檔載入縣市層級的語言使用數據（一次讀入整個檔案）
+
+    資料檔由 census_ingest 建立，報表有變動時會先增量重建。
+    數值為主要與次要使用語言相加之和，備註沿用 language_data.csv 的「備注」欄。
+    dataset 為 LanguageMap，未指定時使用 default_map()。
+    """
+    dataset = default_map() if dataset is None else dataset
     try:
-        with open(csv_path, 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            rows = list(reader)
-            
-            # 跳過標題行（前兩行）
-            for row in rows[2:]:
-                if len(row) >= 5 and row[0].strip():  # 確保有足夠的欄位且縣市名稱不為空
-                    county = row[0].strip()
-                    try:
-                        mandarin = float(row[1].strip()) if row[1].strip() else 0
-                        taiwanese = float(row[2].strip()) if row[2].strip() else 0
-                        hakka = float(row[3].strip()) if row[3].strip() else 0
-                        indigenous = float(row[4].strip()) if row[4].strip() else 0
-                        note = row[5].strip() if len(row) > 5 and row[5].strip() else None
-                        
-                        # 處理縣市名稱標準化
-                        normalized_county = normalize_county_name(county)
-                        
-                        # 儲存語言數據
-                        lang_dict = {
-                            "華語": mandarin,
-                            "閩南語": taiwanese,
-                            "客家話": hakka,
-                            "原住民語": indigenous
-                        }
-                        
-                        # 同時保存原始名稱和標準化名稱
-                        language_data[county] = lang_dict
-                        language_data[normalized_county] = lang_dict
-                        
-                        # 保存備註信息
-                        if note:
-                            language_notes[county] = note
-                            language_notes[normalized_county] = note
-                            
-                    except ValueError as e:
-                        print(f"數據轉換錯誤 - {county}: {e}")
-                        continue
-                        
-    except FileNotFoundError:
-        print(f"找不到CSV文件: {csv_path}")
-        return {}, {}
+        language_data, language_notes, _ = dataset.table('county')
     except Exception as e:
-        print(f"讀取CSV文件錯誤: {e}")
-        return {}, {}
+        logger.error(f"讀取語言數據錯誤: {e}")
+        return language_model.empty_table(), {}
     
-    print(f"成功載入 {len(language_data)} 個縣市的語言數據")
+    logger.info(f"成功載入 {len(language_data['regions'])} 個縣市的語言數據")
     return language_data, language_notes
 
-# 載入真實的語言數據
-language_data, language_notes = load_language_data()
+def __getattr__(name):
+    """模組層級的 language_data / language_notes 在第一次讀取時才載入（匯入模組時不讀取任何檔案）"""
+    if name in ('language_data', 'language_notes'):
+        return getattr(default_map(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-def get_dominant_language(lang_data, exclude_mandarin=False):
-    """獲取使用比例最高的語言，可選擇是否排除華語"""
-    if not lang_data:
-        return None
-    
-    # 創建要比較的語言數據
-    data_to_compare = {}
-    for lang, value in lang_data.items():
-        if exclude_mandarin and lang == "華語":
-            continue
-        data_to_compare[lang] = value
-    
-    if not data_to_compare:
-        return None
-        
-    return max(data_to_compare.items(), key=lambda x: x[1])
+# 彈窗的 HTML 模板（Python 與頁面腳本共用同一份，{欄位} 由兩端各自填入）
+POPUP_TEMPLATES = {
+    'popup': '<div class="lang-popup"><h4>{name}語言使用比例</h4>{rows}{note}</div>',
+    'row': ('<div class="lang-row"><div class="lang-head"><b style="color: {color}">{language}</b>'
+            '<span>{value}%</span></div><div class="lang-bar"><div style="width: {width}%; '
+            'background-color: {color}"></div></div></div>'),
+    'note': '<div class="lang-note"><b>📝 備註：</b>{note}</div>',
+    'empty': '<h4>{name}</h4>暫無語言數據',
+}
+# 語言沒有指定顏色時的進度條顏色
+DEFAULT_BAR_COLOR = '#4188e0'
 
-def create_popup_content(area_name, lang_data, exclude_mandarin=False):
-    """創建彈窗內容，可以選擇是否排除華語數據，並包含備註信息"""
-    if not lang_data:
-        return f"<h4>{area_name}</h4>暫無語言數據"
+POPUP_CSS = '''
+<style>
+    .lang-popup { min-width: 300px; padding: 0 10px; }
+    .lang-popup h4 { text-align: center; }
+    .lang-row { margin: 10px 0; }
+    .lang-head { display: flex; justify-content: space-between; margin-bottom: 2px; }
+    .lang-bar { background-color: #f0f0f0; border-radius: 4px; height: 20px; overflow: hidden; }
+    .lang-bar div { height: 100%; }
+    .lang-note { margin-top: 15px; padding: 8px; border-top: 1px solid #ddd; border-radius: 4px;
+                 background-color: #f8f9fa; font-size: 12px; color: #495057; }
+    .lang-note b { color: #6c757d; }
+</style>
+'''
+
+def minify_js(source):
+    """簡單壓縮頁面腳本：去掉縮排、空行與整行註解（保留換行，不改變語意）"""
+    lines = (line.strip() for line in source.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+def static_script(name):
+    """讀取 static/ 下的頁面腳本並壓縮（每個行程只讀一次）"""
+    if name not in _STATIC_SCRIPTS:
+        with open(os.path.join(STATIC_DIR, name), 'r', encoding='utf-8') as file:
+            _STATIC_SCRIPTS[name] = minify_js(file.read())
+    return _STATIC_SCRIPTS[name]
+
+def script_element(name, config_name=None, config=None):
+    """頁面腳本的 HTML：先以 config_name 宣告設定物件，再內嵌壓縮後的靜態腳本"""
+    html = ''
+    if config_name:
+        html += f"<script>var {config_name} = {json.dumps(config, ensure_ascii=False, separators=(',', ':'))};</script>\n"
+        if instrumentation.enabled():
+            instrumentation.size(f"html.config.{config_name}", html)
+    script = f"<script>\n{static_script(name)}\n</script>"
+    if instrumentation.enabled():
+        instrumentation.size(f"html.script.{name}", script)
+    return folium.Element(html + script)
+
+def add_popup_assets(m):
+    """在頁面加入彈窗的 CSS 與 languagePopup 模板函數（每頁只加一次）"""
+    m.get_root().header.add_child(folium.Element(POPUP_CSS))
+    if instrumentation.enabled():
+        instrumentation.size('html.popup_css', POPUP_CSS)
+    m.get_root().html.add_child(script_element('language_popup.js', 'languagePopupConfig', {
+        'templates': POPUP_TEMPLATES,
+        'colors': language_model.LANGUAGE_COLORS,
+        'defaultColor': DEFAULT_BAR_COLOR,
+    }))
+
+def create_popup_content(area_name, lang_data, exclude_mandarin=False, notes=None):
+    """創建彈窗內容，可以選擇是否排除華語數據，並包含備註信息
+
+    與頁面腳本的 languagePopup 使用同一份 POPUP_TEMPLATES，樣式由 POPUP_CSS 的 class 提供。
+    """
+    notes = default_map().language_notes if notes is None else notes
+    values = [(lang, percentage) for lang, percentage in (lang_data or {}).items()
+              if not (exclude_mandarin and lang == "華語")]
+    if not values:
+        return POPUP_TEMPLATES['empty'].format(name=area_name)
 
-    content = f'''
-    <div style="min-width: 300px">
-        <h4 style="text-align: center">{area_name}語言使用比例</h4>
-        <div style="padding: 10px;">
-    '''
-    
     # 按使用比例從高到低排序
-    sorted_languages = sorted(lang_data.items(), key=lambda x: x[1], reverse=True)
-    for lang, percentage in sorted_languages:
-        if exclude_mandarin and lang == "華語":
-            continue
-            
-        # 根據語言類型設定進度條顏色
-        color_map = {
-            '華語': '#FF6B6B',
-            '閩南語': '#4ECB71',
-            '客家話': '#6B8EFF',
-            '原住民語': '#FFD93D'
-        }
-        bar_color = color_map.get(lang, '#4188e0')
-            
-        content += f'''
-            <div style="margin: 10px 0;">
-                <div style="display: flex; justify-content: space-between; margin-bottom: 2px;">
-                    <span style="font-weight: bold; color: {bar_color}">{lang}</span>
-                    <span>{percentage}%</span>
-                </div>
-                <div style="background-color: #f0f0f0; border-radius: 4px; height: 20px; overflow: hidden;">
-                    <div style="width: {min(percentage, 100)}%; height: 100%; background-color: {bar_color};"></div>
-                </div>
-            </div>
-        '''
-    
-    # 添加備註信息（如果有的話）
-    if area_name in language_notes:
-        note = language_notes[area_name]
-        content += f'''
-            <hr style="margin: 15px 0; border: none; border-top: 1px solid #ddd;">
-            <div style="background-color: #f8f9fa; padding: 8px; border-radius: 4px; font-size: 12px;">
-                <span style="font-weight: bold; color: #6c757d;">📝 備註：</span>
-                <span style="color: #495057;">{note}</span>
-            </div>
-        '''
-    
-    content += '</div></div>'
-    return content
+    rows = ''.join(
+        POPUP_TEMPLATES['row'].format(
+            # 以 g 格式輸出數字，與頁面腳本的寫法相同（2.0 -> 2）
+            language=lang, value=f'{percentage:g}', width=f'{min(percentage, 100):g}',
+            color=language_model.LANGUAGE_COLORS.get(lang, DEFAULT_BAR_COLOR)
+        )
+        for lang, percentage in sorted(values, key=lambda x: x[1], reverse=True)
+    )
+    note = POPUP_TEMPLATES['note'].format(note=notes[area_name]) if area_name in notes else ''
+    return POPUP_TEMPLATES['popup'].format(name=area_name, rows=rows, note=note)
 
-def create_style_function(exclude_mandarin=False):
+def create_style_function(exclude_mandarin=False, data=None):
     """創建樣式函數，可以設置是否排除華語"""
+    data = default_map().language_data if data is None else data
+    # 所有區域的主要語言一次以 argmax 算好，樣式函數只需查表
+    colors = language_model.dominant_colors(data, ['華語'] if exclude_mandarin else [])
+    
     def style_function(feature):
         """定義區域的樣式"""
-        properties = feature['properties']
-        county_name = properties.get('COUNTYNAME')
-        
-        # 使用相同的名稱匹配邏輯
-        normalized_name = normalize_county_name(county_name)
-        possible_names = {
-            normalized_name,
-            county_name,
-            normalized_name.replace('縣', '市') if '縣' in normalized_name else normalized_name,
-            county_name.replace('縣', '市') if '縣' in county_name else county_name
-        }
+        # 名稱已在載入時對應成標準名稱，直接查表
+        row = language_model.region_row(data, feature_county_name(feature))
         
-        # 尋找匹配的語言數據
-        lang_data = None
-        for name in possible_names:
-            if name in language_data:
-                lang_data = language_data[name]
-                break
+        if row is not None and colors[row] != language_model.NO_DATA_COLOR:
+            return dict(REGION_STYLE, fillColor=str(colors[row]))
         
-        if lang_data:
-            dominant = get_dominant_language(lang_data, exclude_mandarin)
-            if dominant:
-                # 根據主要語言設定顏色
-                color_map = {
-                    '華語': '#FF6B6B',     # 紅色
-                    '閩南語': '#4ECB71',   # 綠色
-                    '客家話': '#6B8EFF',   # 藍色
-                    '原住民語': '#FFD93D'  # 黃色
-                }
-                
-                return {
-                    'fillColor': color_map.get(dominant[0], '#cccccc'),
-                    'color': 'black',
-                    'weight': 1,
-                    'fillOpacity': 0.7
-                }
-        
-        return {
-            'fillColor': '#cccccc',
-            'color': 'black',
-            'weight': 1,
-            'fillOpacity': 0.3
-        }
+        return dict(NO_DATA_STYLE, fillColor=language_model.NO_DATA_COLOR)
     
     return style_function
 
 def highlight_function(feature):
     """定義滑鼠懸停時的樣式"""
-    return {
-        'fillColor': "#43484A",
-        'color': 'black',
-        'weight': 2,
-        'fillOpacity': 0.7
-    }
-
-def create_language_layers(m, taiwan_geojson, exclude_mandarin=False):
-    """創建地圖圖層，根據是否排除華語來顯示數據"""
+    return dict(HIGHLIGHT_STYLE)
+
+def create_batched_layer(layer, taiwan_geojson, exclude_mandarin=False, data=None):
+    """將整個 FeatureCollection 輸出成單一 GeoJson 圖層
+
+    樣式預先寫入各 feature 的屬性，不必為每個區域產生獨立的圖層與樣式函數；
+    彈窗在點擊時才由頁面腳本產生，不寫入頁面。
+    """
+    data = default_map().language_data if data is None else data
+    style_func = create_style_function(exclude_mandarin, data)
+    features = []
+    
+    for feature in taiwan_geojson['features']:
+        display_name = feature_county_name(feature)
+        lang_data = language_model.region_values(data, display_name)
+        
+        if lang_data:
+            properties = dict(feature['properties'])
+            properties['style'] = style_func(feature)
+            features.append({'type': 'Feature', 'properties': properties, 'geometry': feature['geometry']})
+    
+    folium.GeoJson(
+        {'type': 'FeatureCollection', 'features': features},
+        name='語言分布',
+        highlight_function=highlight_function
+    ).add_to(layer)
+    return layer
+
+def create_language_layers(m, taiwan_geojson, exclude_mandarin=False, topology=None, batched=False,
+                           data=None):
+    """創建地圖圖層，根據是否排除華語來顯示數據
+
+    提供 topology 時以單一 TopoJSON 圖層輸出幾何；
+    batched=True 時整個 FeatureCollection 合併成一個 GeoJson 圖層。
+    彈窗一律由頁面腳本在點擊時產生，圖層本身不含彈窗 HTML。
+    data 預設為 default_map() 縣市層級的語言數據。
+    """
+    data = default_map().language_data if data is None else data
     layer = folium.FeatureGroup(name='語言分布' + ('（排除華語）' if exclude_mandarin else ''))
     
-    style_func = create_style_function(exclude_mandarin)
+    style_func = create_style_function(exclude_mandarin, data)
+    
+    if batched and not topology:
+        return create_batched_layer(layer, taiwan_geojson, exclude_mandarin, data)
+    
+    if topology:
+        folium.TopoJson(
+            topology,
+            'objects.counties',
+            name='語言分布',
+            style_function=style_func
+        ).add_to(layer)
+        return layer
     
     for feature in taiwan_geojson['features']:
         county_name = feature['properties']['COUNTYNAME']
-        normalized_name = normalize_county_name(county_name)
-        display_name = normalized_name
-        
-        # 嘗試不同的名稱版本來匹配語言數據
-        possible_names = {
-            normalized_name,
-            county_name, 
-            normalized_name.replace('縣', '市') if '縣' in normalized_name else normalized_name,
-            county_name.replace('縣', '市') if '縣' in county_name else county_name
-        }
-        
-        # 尋找第一個匹配的數據
-        lang_data = None
-        for name in possible_names:
-            if name in language_data:
-                lang_data = language_data[name]
-                display_name = name
-                break
+        display_name = feature_county_name(feature)
+        lang_data = language_model.region_values(data, display_name)
         
         if lang_data:
-            popup_content = create_popup_content(display_name, lang_data, exclude_mandarin)
             folium.GeoJson(
                 feature,
                 name=county_name,
                 style_function=style_func,
-                highlight_function=highlight_function,
-                popup=folium.Popup(popup_content, max_width=300)
+                highlight_function=highlight_function
             ).add_to(layer)
     
     return layer
 
-def create_language_map():
-    """創建台灣語言分布地圖"""
-    # 創建地圖對象，將中心點設在台灣中心位置
-    m = folium.Map(
-        location=[23.5, 121], 
-        zoom_start=7.5,
-        tiles='CartoDB positron'
-    )
-    
-    # 下載台灣縣市邊界的 GeoJSON 數據
-    taiwan_geojson = download_taiwan_geojson()
+def year_language_tables(store, years, base, level='county', township_index=None, groupings=None):
+    """各普查年份的語言數據表，區域順序對齊到 base（頁面上共用同一份區域與幾何）
+
+    鄉鎮層級的名稱會隨行政區改制變動，先以鄉鎮索引對應到 base 的區域名稱。
+    """
+    tables = {}
+    for year in years:
+        if level not in aggregation.BASE_LEVELS:
+            data = aggregation.level_table(store, level, year, groupings)
+        elif level == 'township':
+            table = census_ingest.build_township_table(store, year)
+            regions = [
+                county_names.resolve_township(county, township, township_index) or region
+                for county, township, region in zip(table['county'].tolist(), table['township'].tolist(),
+                                                    table['region'].tolist())
+            ]
+            data = census_ingest.township_language_data(table)
+            data = language_model.make_table(regions, data['values'], data['languages'])
+        else:
+            data, _ = census_ingest.county_language_data(store, year)
+        tables[year] = language_model.align_table(data, base['regions'])
+    return tables
+
+def age_table(store, year, base, level='county'):
+    """年齡層數據表，區域順序對齊到 base；報表的年齡分類只有縣市層級，其他層級回傳 None"""
+    if level != 'county':
+        return None
+    ages = census_ingest.county_age_data(store, year)
+    if not ages['bands']:
+        return None
+    return language_model.align_table(ages, base['regions'])
+
+def write_year_sidecars(tables, sidecar_dir=YEAR_SIDECAR_DIR, level='county', age_tables=None):
+    """將每個年份的數值與預先算好的顏色（及年齡層數據）寫成獨立的 JSON 檔，回傳 {年份: 檔名}"""
+    os.makedirs(sidecar_dir, exist_ok=True)
+    age_tables = age_tables or {}
+    files = {}
+    for year, table in tables.items():
+        name = f"{level}-{year}.json"
+        payload = language_model.year_payload(table, year, age_tables.get(year))
+        with open(os.path.join(sidecar_dir, name), 'w', encoding='utf-8') as file:
+            json.dump(payload, file, ensure_ascii=False, separators=(',', ':'))
+        files[year] = name
+    return files
+
+def boundary_level(level='county', groupings=None):
+    """地圖畫在哪一種邊界上：彙整層級（區域、本島與離島…）沿用成員的縣市或鄉鎮邊界"""
+    if level in ('county', 'township'):
+        return level
+    return aggregation.base_level(level, groupings)
+
+def boundary_url(level='county', groupings=None):
+    """各行政區層級的邊界數據來源"""
+    return TOWNSHIP_GEOJSON_URL if boundary_level(level, groupings) == 'township' else TAIWAN_GEOJSON_URL
+
+def load_prepared_boundaries(level='county', offline=False, refresh=False,
+                             cache_dir=boundary_cache.DEFAULT_CACHE_DIR, zoom=10, tolerance=None,
+                             precision=geometry_prep.DEFAULT_PRECISION, topojson=False, groupings=None):
+    """取得邊界並完成幾何前處理，回傳 (geojson, topology, report)，缺少邊界時回傳 None
+
+    簡化結果依邊界內容與參數快取在 cache_dir，批次產生多張地圖時只需計算一次。
+    """
+    level = boundary_level(level, groupings)
+    url = boundary_url(level)
+    taiwan_geojson = download_taiwan_geojson(offline, refresh, cache_dir, url)
     if not taiwan_geojson:
-        print("無法創建地圖：缺少地理數據")
         return None
     
-    # 默認只添加包含華語的圖層
-    normal_layer = create_language_layers(m, taiwan_geojson, False)
-    normal_layer.add_to(m)
-    
-    # 添加自定義的單選按鈕控制
-    toggle_html = '''
-    <div id="language-toggle" style="position: fixed; 
-                top: 10px; right: 10px; 
-                z-index: 1000;
-                background-color: white;
-                border: 2px solid #ccc;
-                border-radius: 8px;
-                padding: 15px;
-                box-shadow: 0 2px 10px rgba(0,0,0,0.3);
-                font-family: Arial, sans-serif;">
-        <div style="font-weight: bold; margin-bottom: 12px; color: #333; font-size: 14px;">
-            語言顯示模式
-        </div>
-        <label style="display: block; margin-bottom: 10px; cursor: pointer; font-size: 13px;">
-            <input type="radio" name="language_mode" value="normal" checked 
-                   style="margin-right: 8px; transform: scale(1.2);">
-            <span style="color: #333;">包含華語</span>
-        </label>
-        <label style="display: block; cursor: pointer; font-size: 13px;">
-            <input type="radio" name="language_mode" value="exclude" 
-                   style="margin-right: 8px; transform: scale(1.2);">
-            <span style="color: #333;">排除華語</span>
-        </label>
-    </div>
-    
-    <script>
-        // 等待地圖完全載入
-        document.addEventListener('DOMContentLoaded', function() {
-            // 獲取地圖實例
-            var mapObj = window[Object.keys(window).find(key => key.startsWith('map_'))];
-            
-            // 預先創建兩種模式的GeoJSON數據
-            var normalData = ''' + json.dumps(taiwan_geojson) + ''';
-            var excludeData = ''' + json.dumps(taiwan_geojson) + ''';
-            var languageData = ''' + json.dumps(language_data) + ''';
-            var languageNotes = ''' + json.dumps(language_notes) + ''';
-            
-            // 當前顯示的圖層
-            var currentLayers = [];
-            
-            // 縣市名稱標準化函數
-            function normalizeCountyName(name) {
-                if (!name) return name;
-                
-                // 處理台/臺的轉換
-                name = name.replace(/台/g, '臺');
-                
-                // 處理簡繁體字轉換
-                name = name.replace(/云/g, '雲');  // 云林縣 -> 雲林縣
-                name = name.replace(/慄/g, '栗');  // 苗慄縣 -> 苗栗縣
-                
-                // 處理行政區劃變更
-                var mapping = {
-                    '桃園縣': '桃園市',
-                    '臺北縣': '新北市',
-                    '台北縣': '新北市'
-                };
-                return mapping[name] || name;
-            }
-            
-            // 獲取主要語言
-            function getDominantLanguage(langData, excludeMandarin) {
-                if (!langData) return null;
-                var dataToCompare = {};
-                for (var lang in langData) {
-                    if (excludeMandarin && lang === "華語") continue;
-                    dataToCompare[lang] = langData[lang];
-                }
-                if (Object.keys(dataToCompare).length === 0) return null;
-                
-                var maxLang = null;
-                var maxValue = -1;
-                for (var lang in dataToCompare) {
-                    if (dataToCompare[lang] > maxValue) {
-                        maxValue = dataToCompare[lang];
-                        maxLang = lang;
-                    }
-                }
-                return maxLang ? [maxLang, maxValue] : null;
-            }
-            
-            // 創建彈窗內容
-            function createPopupContent(areaName, langData, excludeMandarin) {
-                if (!langData) return "<h4>" + areaName + "</h4>暫無語言數據";
-                
-                var content = '<div style="min-width: 300px"><h4 style="text-align: center">' + 
-                             areaName + '語言使用比例</h4><div style="padding: 10px;">';
-                
-                var sortedLangs = Object.keys(langData).map(function(lang) {
-                    return [lang, langData[lang]];
-                }).sort(function(a, b) { return b[1] - a[1]; });
-                
-                var colorMap = {
-                    '華語': '#FF6B6B',
-                    '閩南語': '#4ECB71', 
-                    '客家話': '#6B8EFF',
-                    '原住民語': '#FFD93D'
-                };
-                
-                for (var i = 0; i < sortedLangs.length; i++) {
-                    var lang = sortedLangs[i][0];
-                    var percentage = sortedLangs[i][1];
-                    if (excludeMandarin && lang === "華語") continue;
-                    
-                    var barColor = colorMap[lang] || '#4188e0';
-                    var widthPercent = Math.min(percentage, 100); // 確保寬度不超過100%
-                    content += '<div style="margin: 10px 0;">' +
-                              '<div style="display: flex; justify-content: space-between; margin-bottom: 2px;">' +
-                              '<span style="font-weight: bold; color: ' + barColor + '">' + lang + '</span>' +
-                              '<span>' + percentage + '%</span></div>' +
-                              '<div style="background-color: #f0f0f0; border-radius: 4px; height: 20px; overflow: hidden;">' +
-                              '<div style="width: ' + widthPercent + '%; height: 100%; background-color: ' + barColor + ';"></div>' +
-                              '</div></div>';
-                }
-                
-                // 添加備註信息（如果有的話）
-                if (languageNotes[areaName]) {
-                    var note = languageNotes[areaName];
-                    content += '<hr style="margin: 15px 0; border: none; border-top: 1px solid #ddd;">' +
-                              '<div style="background-color: #f8f9fa; padding: 8px; border-radius: 4px; font-size: 12px;">' +
-                              '<span style="font-weight: bold; color: #6c757d;">📝 備註：</span>' +
-                              '<span style="color: #495057;">' + note + '</span>' +
-                              '</div>';
-                }
-                
-                content += '</div></div>';
-                return content;
-            }
-            
-            // 獲取樣式
-            function getStyle(feature, excludeMandarin) {
-                var countyName = feature.properties.COUNTYNAME;
-                var normalizedName = normalizeCountyName(countyName);
-                
-                var possibleNames = [
-                    normalizedName,
-                    countyName,
-                    normalizedName.replace('縣', '市'),
-                    countyName.replace('縣', '市')
-                ];
-                
-                var langData = null;
-                for (var i = 0; i < possibleNames.length; i++) {
-                    if (languageData[possibleNames[i]]) {
-                        langData = languageData[possibleNames[i]];
-                        break;
-                    }
-                }
-                
-                if (langData) {
-                    var dominant = getDominantLanguage(langData, excludeMandarin);
-                    if (dominant) {
-                        var colorMap = {
-                            '華語': '#FF6B6B',
-                            '閩南語': '#4ECB71',
-                            '客家話': '#6B8EFF', 
-                            '原住民語': '#FFD93D'
-                        };
-                        return {
-                            fillColor: colorMap[dominant[0]] || '#cccccc',
-                            color: 'black',
-                            weight: 1,
-                            fillOpacity: 0.7
-                        };
-                    }
-                }
-                
-                return {
-                    fillColor: '#cccccc',
-                    color: 'black', 
-                    weight: 1,
-                    fillOpacity: 0.3
-                };
-            }
-            
-            // 清除當前圖層
-            function clearCurrentLayers() {
-                currentLayers.forEach(function(layer) {
-                    mapObj.removeLayer(layer);
-                });
-                currentLayers = [];
-            }
-            
-            // 添加圖層
-            function addLanguageLayers(excludeMandarin) {
-                clearCurrentLayers();
-                
-                normalData.features.forEach(function(feature) {
-                    var countyName = feature.properties.COUNTYNAME;
-                    var normalizedName = normalizeCountyName(countyName);
-                    
-                    var possibleNames = [
-                        normalizedName,
-                        countyName,
-                        normalizedName.replace('縣', '市'),
-                        countyName.replace('縣', '市')
-                    ];
-                    
-                    var langData = null;
-                    var displayName = normalizedName;
-                    for (var i = 0; i < possibleNames.length; i++) {
-                        if (languageData[possibleNames[i]]) {
-                            langData = languageData[possibleNames[i]];
-                            displayName = possibleNames[i];
-                            break;
-                        }
-                    }
-                    
-                    if (langData) {
-                        var style = getStyle(feature, excludeMandarin);
-                        var popupContent = createPopupContent(displayName, langData, excludeMandarin);
-                        
-                        var layer = L.geoJson(feature, {
-                            style: style,
-                            onEachFeature: function(feature, layer) {
-                                layer.bindPopup(popupContent, {maxWidth: 300});
-                                layer.on('mouseover', function() {
-                                    this.setStyle({
-                                        fillColor: "#43484A",
-                                        color: 'black',
-                                        weight: 2,
-                                        fillOpacity: 0.7
-                                    });
-                                });
-                                layer.on('mouseout', function() {
-                                    this.setStyle(style);
-                                });
-                            }
-                        }).addTo(mapObj);
-                        
-                        currentLayers.push(layer);
-                    }
-                });
-            }
-            
-            // 初始化顯示正常模式
-            addLanguageLayers(false);
-            
-            // 監聽單選按鈕變化
-            document.querySelectorAll('input[name="language_mode"]').forEach(function(radio) {
-                radio.addEventListener('change', function() {
-                    var excludeMandarin = this.value === 'exclude';
-                    addLanguageLayers(excludeMandarin);
-                });
-            });
-        });
-    </script>
-    '''
-    
-    m.get_root().html.add_child(folium.Element(toggle_html))
-    
-    # 添加圖例
+    # 幾何前處理：共用邊簡化與座標取捨（依邊界內容與參數快取）
+    return geometry_prep.prepare_geometry_cached(
+        taiwan_geojson, boundary_cache.cache_entry(url, cache_dir)['sha256'], cache_dir,
+        tolerance=tolerance, zoom=zoom, precision=precision, topojson=topojson,
+        name_property='TOWNNAME' if level == 'township' else 'COUNTYNAME'
+    )
+
+def load_language_table(level='county', year=None, store=None, groupings=None):
+    """載入某個行政區層級與年份的語言數據，回傳 (數據表, 備註, 鄉鎮索引)
+
+    鄉鎮索引只在邊界為鄉鎮時建立，用來把邊界上的鄉鎮名稱對應到數據表；
+    彙整層級的數值由 aggregation 以人口加權算出，沒有備註。
+    """
+    store = census_ingest.ensure_store() if store is None else store
+    if level not in aggregation.BASE_LEVELS:
+        _, _, township_index = load_language_table(boundary_level(level, groupings), year, store)
+        return aggregation.level_table(store, level, year, groupings), {}, township_index
+    if level == 'township':
+        # 鄉鎮市區：邊界與普查報表的鄉鎮數據
+        data, township_table = census_ingest.load_township_data(year=year, store=store)
+        township_index = county_names.build_township_index(
+            zip(township_table['county'], township_table['township'], township_table['region'])
+        )
+        return data, {}, township_index
+    data, notes = census_ingest.county_language_data(store, year)
+    return data, notes, None
+
+def stamp_regions(geojson, level='county', township_index=None, store=None, groupings=None):
+    """將標準區域名稱寫入 feature 屬性，回傳無法對應的名稱列表
+
+    彙整層級先寫入成員（縣市或鄉鎮）的名稱，再把 region_name 換成所屬的組名；
+    不屬於任何組的區域 region_name 為 None，地圖上當作沒有數據。
+    """
+    base = boundary_level(level, groupings)
+    if base == 'township':
+        unmatched = county_names.stamp_townships(geojson, township_index)
+    else:
+        unmatched = county_names.stamp_features(geojson)
+    if level != base:
+        groups = aggregation.region_groups(level, store, groupings)
+        for feature in geojson['features']:
+            properties = feature['properties']
+            properties['region_name'] = groups.get(properties['region_name'])
+    return unmatched
+
+def geojson_bounds(geojson):
+    """FeatureCollection 的範圍 [[南, 西], [北, 東]]"""
+    points = [
+        point
+        for feature in geojson['features']
+        for polygon in geometry_prep.polygons(feature['geometry'])
+        for ring in polygon
+        for point in ring
+    ]
+    return [[min(p[1] for p in points), min(p[0] for p in points)],
+            [max(p[1] for p in points), max(p[0] for p in points)]]
+
+def add_legend(m):
+    """添加圖例（顏色代表主要使用語言）"""
     legend_html = '''
     <div style="position: fixed; 
                 bottom: 50px; right: 50px; 
@@ -577,15 +435,425 @@ def create_language_map():
         </div>
     </div>
     '''
+    if instrumentation.enabled():
+        instrumentation.size('html.legend', legend_html)
     m.get_root().html.add_child(folium.Element(legend_html))
+
+def create_language_map(offline=False, refresh=False, cache_dir=boundary_cache.DEFAULT_CACHE_DIR,
+                        zoom=10, tolerance=None, precision=geometry_prep.DEFAULT_PRECISION,
+                        topojson=False, geometry_report=False, batched=False, level='county',
+                        year=None, sidecar_dir=YEAR_SIDECAR_DIR, tiles='CartoDB positron',
+                        exclude_mandarin=False, counties=None, store=None, groupings=None, prepared=None,
+                        live=None):
+    """創建台灣語言分布地圖
+
+    level='township' 時改用鄉鎮市區邊界與各縣市普查報表的鄉鎮數據，
+    並固定使用合併圖層輸出。level 也可以是 groupings.json 中的彙整層級
+    （region、island、hakka_belt…）：數值以人口加權彙整，每個成員的邊界以所屬組的顏色畫出。
+
+    zoom / tolerance 控制邊界簡化的程度，precision 為座標保留的小數位數；
+    topojson=True 時幾何以 TopoJSON 輸出，由瀏覽器端解碼；
+    batched=True 時所有區域合併成單一 GeoJson 圖層（適合鄉鎮等大量區域）。
+    幾何只隨圖層輸出一次，切換模式時由頁面腳本直接改變同一圖層的樣式。
+
+    資料檔中有多個普查年份時，頁面上加入年份滑桿：HTML 只內嵌 year（預設最新）
+    的數據，其他年份寫到 sidecar_dir，切換時才由瀏覽器載入（需以 HTTP 開啟頁面）。
+    縣市層級另有年齡層選單，各年齡層的數值與主要語言一併預先算好，切換時只改變樣式。
+
+    tiles 為底圖；exclude_mandarin=True 時頁面預設為「排除華語」模式；
+    counties 指定縣市名稱時只畫出這些縣市（鄉鎮層級則為其中的鄉鎮），並縮放到其範圍。
+
+    store / groupings 未指定時讀取預設的資料檔與分組設定；prepared 為已完成前處理的
+    (geojson, topology, report)，提供時不再讀取邊界。通常由 LanguageMap.create_map 傳入。
+    live 為 {'file': 即時數據檔網址, 'poll': 毫秒, 'page': 頁面版本} 時，頁面定期讀取該檔（map_watch.py）。
+    """
+    lap = instrumentation.stage_timer('map', level=level)
+    # 創建地圖對象，將中心點設在台灣中心位置
+    m = folium.Map(
+        location=[23.5, 121], 
+        zoom_start=7.5,
+        tiles=tiles
+    )
+    
+    store = census_ingest.ensure_store() if store is None else store
+    years = census_ingest.census_years(store)
+    year = year or (years[-1] if years else None)
+    data, notes, township_index = load_language_table(level, year, store, groupings)
+    ages = age_table(store, year, data, level)
+    if boundary_level(level, groupings) == 'township':
+        batched = True
+    lap('language_data', regions=len(data['regions']), years=len(years))
+    
+    # 取得邊界的 GeoJSON 數據並完成幾何前處理
+    if prepared is None:
+        prepared = load_prepared_boundaries(level, offline, refresh, cache_dir, zoom, tolerance, precision,
+                                            topojson, groupings)
+    if not prepared:
+        logger.error("無法創建地圖：缺少地理數據")
+        return None
+    taiwan_geojson, topology, report = prepared
+    if geometry_report:
+        geometry_prep.log_report(report, report['tolerance'])
+    lap('geometry', features=len(taiwan_geojson['features']))
+    
+    # 區域名稱只在載入時對應一次，之後直接讀取屬性；
+    # 數據表的列號也寫入屬性，頁面腳本直接以列號讀取數值與顏色
+    unmatched = stamp_regions(taiwan_geojson, level, township_index, store, groupings)
+    for feature in taiwan_geojson['features']:
+        feature['properties']['row'] = language_model.region_row(data, feature['properties']['region_name'])
+    if topology:
+        # TopoJSON 的 geometries 與 GeoJSON 的 features 依序一一對應（屬性來源相同），直接沿用對應結果
+        for geometry, feature in zip(topology['objects']['counties']['geometries'], taiwan_geojson['features']):
+            geometry['properties'] = dict(feature['properties'])
+    if unmatched:
+        logger.warning(f"無法對應名稱的區域：{'、'.join(str(name) for name in unmatched)}")
+    if instrumentation.enabled():
+        instrumentation.count('features.matched', len(taiwan_geojson['features']) - len(unmatched), level=level)
+        instrumentation.count('features.unmatched', len(unmatched), level=level)
+        if boundary_level(level, groupings) == 'county':
+            aliases = county_names.duplicate_aliases(taiwan_geojson)
+        elif level == 'township':
+            aliases = county_names.duplicate_aliases(taiwan_geojson, 'region_name', ('COUNTYNAME', 'TOWNNAME'))
+        else:
+            aliases = {}
+        instrumentation.count('features.duplicate_aliases', len(aliases), level=level, regions=aliases)
+    lap('name_resolution')
+    
+    # 只畫出指定的縣市
+    if counties:
+        selected = {county_names.canonical_name(name) or name for name in counties}
+        taiwan_geojson = dict(taiwan_geojson, features=[
+            feature for feature in taiwan_geojson['features']
+            if feature['properties']['county_name'] in selected
+        ])
+        if topology:
+            geometries = topology['objects']['counties']['geometries']
+            topology = dict(topology, objects={'counties': dict(
+                topology['objects']['counties'],
+                geometries=[g for g in geometries if g['properties']['county_name'] in selected]
+            )})
+        if not taiwan_geojson['features']:
+            logger.error(f"找不到指定的縣市：{'、'.join(counties)}")
+            return None
+        m.fit_bounds(geojson_bounds(taiwan_geojson))
+    missing_data = sorted({
+        feature['properties']['region_name'] for feature in taiwan_geojson['features']
+        if feature['properties']['region_name'] and feature['properties']['region_name'] not in data['index']
+    })
+    if missing_data:
+        logger.warning(f"缺少語言數據的區域：{'、'.join(missing_data)}")
+    instrumentation.count('regions.missing_data', len(missing_data), level=level)
+    lap('filter', features=len(taiwan_geojson['features']))
+    
+    # 只添加一個圖層（預設為包含華語），另一種模式由頁面腳本切換
+    normal_layer = create_language_layers(m, taiwan_geojson, exclude_mandarin, topology, batched, data)
+    normal_layer.add_to(m)
+    if instrumentation.enabled():
+        # 幾何在 m.save 時才序列化，這裡以同樣的緊湊 JSON 估計大小
+        instrumentation.size('html.geometry', json.dumps(topology or taiwan_geojson, ensure_ascii=False,
+                                                         separators=(',', ':')))
+    lap('layers', batched=bool(batched), topojson=bool(topology))
+    
+    # 其他普查年份：只寫出數值與顏色，幾何與區域名稱沿用頁面上的這一份
+    year_files = {}
+    if len(years) > 1:
+        tables = year_language_tables(store, years, data, level, township_index, groupings)
+        age_tables = {other: age_table(store, other, data, level) for other in years} if ages else None
+        year_files = write_year_sidecars(tables, sidecar_dir, level, age_tables)
+    lap('year_sidecars', files=len(year_files))
+    # 頁面以相對路徑載入各年份的數據檔
+    sidecar_url = os.path.basename(os.path.normpath(sidecar_dir))
+    page_year_files = {year: f"{sidecar_url}/{name}" for year, name in year_files.items()}
+    year_slider = ''
+    if year_files:
+        year_slider = f'''
+        <div style="font-weight: bold; margin: 12px 0 6px; color: #333; font-size: 14px;">
+            普查年份：<span id="census-year-label">{year}</span>
+        </div>
+        <input type="range" id="census-year" min="0" max="{len(years) - 1}" step="1"
+               value="{years.index(year)}" style="width: 100%;">
+        <div style="display: flex; justify-content: space-between; font-size: 11px; color: #666;">
+            <span>{years[0]}</span><span>{years[-1]}</span>
+        </div>
+        '''
+    age_select = ''
+    if ages:
+        options = ''.join(f'<option value="{i}">{band}</option>' for i, band in enumerate(ages['bands']))
+        age_select = f'''
+        <div style="font-weight: bold; margin: 12px 0 6px; color: #333; font-size: 14px;">年齡層</div>
+        <select id="age-band" style="width: 100%;">
+            <option value="-1" selected>全部年齡</option>{options}
+        </select>
+        '''
+    
+    # 添加自定義的單選按鈕控制
+    toggle_html = '''
+    <div id="language-toggle" style="position: fixed; 
+                top: 10px; right: 10px; 
+                z-index: 1000;
+                background-color: white;
+                border: 2px solid #ccc;
+                border-radius: 8px;
+                padding: 15px;
+                box-shadow: 0 2px 10px rgba(0,0,0,0.3);
+                font-family: Arial, sans-serif;">
+        <div style="font-weight: bold; margin-bottom: 12px; color: #333; font-size: 14px;">
+            語言顯示模式
+        </div>
+        <label style="display: block; margin-bottom: 10px; cursor: pointer; font-size: 13px;">
+            <input type="radio" name="language_mode" value="normal"''' + ('' if exclude_mandarin else ' checked') + '''
+                   style="margin-right: 8px; transform: scale(1.2);">
+            <span style="color: #333;">包含華語</span>
+        </label>
+        <label style="display: block; cursor: pointer; font-size: 13px;">
+            <input type="radio" name="language_mode" value="exclude"''' + (' checked' if exclude_mandarin else '') + '''
+                   style="margin-right: 8px; transform: scale(1.2);">
+            <span style="color: #333;">排除華語</span>
+        </label>''' + year_slider + age_select + '''
+    </div>
+    '''
+    
+    m.get_root().html.add_child(folium.Element(toggle_html))
+    if instrumentation.enabled():
+        instrumentation.size('html.controls', toggle_html)
+    add_popup_assets(m)
+    
+    # 頁面腳本是固定的靜態檔案，只讀取這裡預先算好的數值：
+    # 語言數據以欄陣列輸出（區域以 feature 的 row 屬性對應），兩種模式的顏色與樣式也已算好
+    m.get_root().html.add_child(script_element('language_map.js', 'languageMapConfig', {
+        'layer': normal_layer.get_name(),
+        'data': language_model.to_page_json(data, ages),
+        'palette': [language_model.LANGUAGE_COLORS.get(language, language_model.NO_DATA_COLOR)
+                    for language in data['languages']],
+        'notes': notes,
+        'noDataColor': language_model.NO_DATA_COLOR,
+        'styles': {'data': REGION_STYLE, 'noData': NO_DATA_STYLE, 'highlight': HIGHLIGHT_STYLE},
+        'bindHighlight': bool(topology),
+        'exclude': ['華語'],
+        'excludeMandarin': bool(exclude_mandarin),
+        'years': years,
+        'year': year,
+        'yearFiles': page_year_files,
+        'live': live,
+    }))
+    lap('page')
+    
+    # 添加圖例
+    add_legend(m)
+    lap('legend')
     
     return m
 
+def save_map(m, path, stream=False):
+    """將地圖寫成 HTML（幾何與各元件在這一步才序列化），記錄耗時與檔案大小
+
+    stream=True 時以 html_writer 串流寫出：幾何逐個 feature 寫入檔案，不在記憶體中組成整頁字串，
+    適合鄉鎮以下的大量區域；檔名以 .gz 結尾時另以 gzip 壓縮。
+    """
+    with instrumentation.span('map.save', path=path, stream=bool(stream)):
+        if stream:
+            html_writer.write_map(m, path)
+        else:
+            m.save(path)
+    instrumentation.emit('bytes', 'html.total', bytes=os.path.getsize(path))
+
+def _copy_prepared(prepared):
+    """複製前處理結果的 feature 與屬性（幾何與 arcs 共用），產生地圖時寫入的名稱與列號不會互相影響"""
+    geojson, topology, report = prepared
+    geojson = dict(geojson, features=[dict(feature, properties=dict(feature['properties']))
+                                      for feature in geojson['features']])
+    if topology:
+        counties = topology['objects']['counties']
+        topology = dict(topology, objects=dict(topology['objects'], counties=dict(counties, geometries=[
+            dict(geometry, properties=dict(geometry['properties'])) for geometry in counties['geometries']
+        ])))
+    return geojson, topology, report
+
+class LanguageMap:
+    """一份語言數據與邊界的來源（報表目錄、資料檔、備註、分組設定與邊界快取）
+
+    建立時不讀取任何檔案；資料檔、各層級與年份的數據表與前處理後的邊界在第一次使用時
+    才載入並保留在物件上。同一個行程可以建立多個 LanguageMap（例如兩份不同的報表目錄），
+    彼此的數據不會混用。
+
+        atlas = LanguageMap(data_dir='other/Language_data', store_path='other.npz')
+        m = atlas.create_map(level='township')
+        atlas.save(m, 'other.html', stream=True)
+
+    data_dir 未指定時使用 census_ingest 的預設目錄；store_path / notes_csv 未指定時
+    放在 data_dir 中（與預設目錄相同的檔名）。只另外指定 notes_csv 時，資料檔名會加上
+    備註檔路徑的雜湊，不與使用預設備註的資料檔共用。
+    """
+
+    def __init__(self, data_dir=None, store_path=None, notes_csv=None, groupings_path=None,
+                 cache_dir=boundary_cache.DEFAULT_CACHE_DIR, offline=False, refresh=False, workers=None):
+        self.data_dir = data_dir
+        self.store_path = store_path
+        self.notes_csv = notes_csv
+        self.groupings_path = groupings_path
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.refresh = refresh
+        self.workers = workers
+        self._store = None
+        self._groupings = None
+        self._tables = {}
+        self._boundaries = {}
+
+    def paths(self):
+        """實際使用的 (報表目錄, 資料檔, 備註檔)"""
+        if self.data_dir is None:
+            data_dir = census_ingest.LANGUAGE_DATA_DIR
+            store_path, notes_csv = census_ingest.STORE_PATH, census_ingest.NOTES_CSV
+        else:
+            data_dir = self.data_dir
+            store_path = os.path.join(data_dir, os.path.basename(census_ingest.STORE_PATH))
+            notes_csv = os.path.join(data_dir, os.path.basename(census_ingest.NOTES_CSV))
+        if self.notes_csv and os.path.abspath(self.notes_csv) != os.path.abspath(notes_csv):
+            notes_csv = self.notes_csv
+            key = hashlib.sha1(os.path.abspath(notes_csv).encode('utf-8')).hexdigest()[:10]
+            root, ext = os.path.splitext(store_path)
+            store_path = f'{root}-{key}{ext}'
+        return data_dir, self.store_path or store_path, notes_csv
+
+    @property
+    def store(self):
+        """欄式資料檔（報表有變動時先增量重建）"""
+        if self._store is None:
+            data_dir, store_path, notes_csv = self.paths()
+            self._store = census_ingest.ensure_store(self.workers, store_path, data_dir, notes_csv)
+        return self._store
+
+    @property
+    def groupings(self):
+        """彙整層級的分組設定"""
+        if self._groupings is None:
+            self._groupings = aggregation.load_groupings(self.groupings_path or aggregation.GROUPINGS_PATH)
+        return self._groupings
+
+    @property
+    def years(self):
+        return census_ingest.census_years(self.store)
+
+    def levels(self):
+        return aggregation.levels(self.groupings)
+
+    def table(self, level='county', year=None):
+        """某個層級與年份（預設最新）的 (數據表, 備註, 鄉鎮索引)"""
+        year = year or (self.years[-1] if self.years else None)
+        if (level, year) not in self._tables:
+            self._tables[level, year] = load_language_table(level, year, self.store, self.groupings)
+        return self._tables[level, year]
+
+    @property
+    def language_data(self):
+        """最新普查年份縣市層級的語言數據表"""
+        return self.table('county')[0]
+
+    @property
+    def language_notes(self):
+        """縣市備註"""
+        return self.table('county')[1]
+
+    def boundaries(self, level='county', zoom=10, tolerance=None, precision=geometry_prep.DEFAULT_PRECISION,
+                   topojson=False):
+        """前處理後的邊界 (geojson, topology, report)，每次回傳可以自由寫入屬性的副本；缺少邊界時回傳 None"""
+        key = (boundary_level(level, self.groupings), zoom, tolerance, precision, topojson)
+        if key not in self._boundaries:
+            self._boundaries[key] = load_prepared_boundaries(
+                level, self.offline, self.refresh, self.cache_dir, zoom, tolerance, precision, topojson,
+                self.groupings
+            )
+        prepared = self._boundaries[key]
+        return _copy_prepared(prepared) if prepared else None
+
+    def create_map(self, level='county', zoom=10, tolerance=None, precision=geometry_prep.DEFAULT_PRECISION,
+                   topojson=False, **options):
+        """以這份數據與邊界產生地圖，其他參數與 create_language_map 相同"""
+        prepared = self.boundaries(level, zoom, tolerance, precision, topojson)
+        if not prepared:
+            logger.error("無法創建地圖：缺少地理數據")
+            return None
+        return create_language_map(
+            self.offline, self.refresh, self.cache_dir, zoom=zoom, tolerance=tolerance, precision=precision,
+            topojson=topojson, level=level, store=self.store, groupings=self.groupings, prepared=prepared,
+            **options
+        )
+
+    def save(self, m, path, stream=False):
+        save_map(m, path, stream)
+
+    def reload(self, boundaries=False):
+        """報表、備註或分組設定變動後重新載入：資料檔增量重建（只重新解析變動的報表），數據表重新計算
+
+        boundaries=True 時前處理後的邊界也一併重新讀取。
+        """
+        data_dir, store_path, notes_csv = self.paths()
+        self._store, _, _ = census_ingest.build_store(workers=self.workers, store_path=store_path,
+                                                      notes_csv=notes_csv, data_dir=data_dir)
+        self._groupings = None
+        self._tables = {}
+        if boundaries:
+            self._boundaries = {}
+
+# 預設數據來源（倉庫內的報表與快取），第一次需要時才建立
+_DEFAULT_MAP = None
+
+def default_map():
+    """未指定數據時使用的 LanguageMap（預設路徑），整個行程共用一個"""
+    global _DEFAULT_MAP
+    if _DEFAULT_MAP is None:
+        _DEFAULT_MAP = LanguageMap()
+    return _DEFAULT_MAP
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='產生台澎金馬語言分布地圖')
+    parser.add_argument('--offline', action='store_true', help='只使用本地快取的邊界數據，不連網')
+    parser.add_argument('--refresh', action='store_true', help='連網檢查邊界數據是否有更新')
+    parser.add_argument('--seed', metavar='GEOJSON', help='將本地的縣市邊界 GeoJSON 匯入快取')
+    parser.add_argument('--cache-dir', default=boundary_cache.DEFAULT_CACHE_DIR, help='邊界快取目錄')
+    parser.add_argument('--output', default='taiwan_language_map.html', help='輸出的 HTML 檔名')
+    parser.add_argument('--zoom', type=float, default=10, help='依縮放層級決定邊界簡化程度')
+    parser.add_argument('--tolerance', type=float, help='直接指定簡化容許誤差（經緯度），優先於 --zoom')
+    parser.add_argument('--precision', type=int, default=geometry_prep.DEFAULT_PRECISION, help='座標小數位數')
+    parser.add_argument('--topojson', action='store_true', help='以 TopoJSON 輸出幾何，由瀏覽器端解碼')
+    parser.add_argument('--geometry-report', action='store_true', help='列印簡化前後的大小與頂點數')
+    parser.add_argument('--batched', action='store_true', help='所有區域合併成單一圖層輸出')
+    parser.add_argument('--level', choices=aggregation.levels(), default='county',
+                        help='地圖的行政區層級，或 groupings.json 中的彙整層級')
+    parser.add_argument('--seed-townships', metavar='GEOJSON', help='將本地的鄉鎮市區邊界 GeoJSON 匯入快取')
+    parser.add_argument('--year', type=int, help='頁面初始顯示的普查年份（預設最新）')
+    parser.add_argument('--tiles', default='CartoDB positron', help='底圖名稱或圖磚網址')
+    parser.add_argument('--exclude-mandarin', action='store_true', help='頁面預設為排除華語模式')
+    parser.add_argument('--counties', nargs='+', help='只畫出這些縣市')
+    parser.add_argument('--stream', action='store_true',
+                        help='以串流方式寫出 HTML（輸出檔名以 .gz 結尾時另以 gzip 壓縮）')
+    parser.add_argument('--verbose', action='store_true', help='顯示各階段的耗時、計數與輸出大小')
+    parser.add_argument('--log-json', metavar='PATH', help='將訊息與量測事件寫成 JSON lines 檔')
+    parser.add_argument('--profile', choices=instrumentation.PROFILE_MODES,
+                        help='以 cProfile 或 tracemalloc 分析整個流程')
+    parser.add_argument('--profile-output', metavar='PATH', help='效能分析結果的輸出檔')
+    args = parser.parse_args()
+    instrumentation.configure_logging(args.verbose, args.log_json)
+
+    if args.seed:
+        boundary_cache.seed_cache(args.seed, TAIWAN_GEOJSON_URL, args.cache_dir)
+    if args.seed_townships:
+        boundary_cache.seed_cache(args.seed_townships, TOWNSHIP_GEOJSON_URL, args.cache_dir)
+
     # 創建並保存地圖
-    m = create_language_map()
+    with instrumentation.profiled(args.profile, args.profile_output):
+        m = create_language_map(
+            args.offline, args.refresh, args.cache_dir,
+            zoom=args.zoom, tolerance=args.tolerance, precision=args.precision,
+            topojson=args.topojson, geometry_report=args.geometry_report, batched=args.batched,
+            level=args.level, year=args.year, tiles=args.tiles,
+            exclude_mandarin=args.exclude_mandarin, counties=args.counties,
+            sidecar_dir=os.path.splitext(args.output)[0] + '_years'
+        )
+        if m:
+            save_map(m, args.output, args.stream)
     if m:
-        m.save('taiwan_language_map.html')
-        print("地圖已保存為 'taiwan_language_map.html'")
+        logger.info(f"地圖已保存為 '{args.output}'")
     else:
-        print("地圖創建失敗")
\ No newline at end of file
+        logger.error("地圖創建失敗")
\ No newline at end of file
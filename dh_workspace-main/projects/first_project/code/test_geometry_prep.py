@@ -0,0 +1,110 @@
+"""geometry_prep 的共用邊拓樸：相鄰區域共用一條 arc，組回的環與原本相同"""
+import geometry_prep
+
+
+def square(x, y, size):
+    return [[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]
+
+
+def collection(*rings):
+    return {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'properties': {'id': i}, 'geometry': {'type': 'Polygon', 'coordinates': [ring]}}
+        for i, ring in enumerate(rings)
+    ]}
+
+
+def arc_uses(shapes):
+    """每條 arc 被引用的次數（不分方向）"""
+    uses = {}
+    for feature_shape in shapes:
+        for polygon in feature_shape:
+            for arc_refs in polygon:
+                for ref in arc_refs:
+                    arc = ref if ref >= 0 else ~ref
+                    uses[arc] = uses.get(arc, 0) + 1
+    return uses
+
+
+def same_ring(ring, expected):
+    """兩個閉合的環是否相同（起點可以不同）"""
+    ring, expected = [tuple(point) for point in ring[:-1]], [tuple(point) for point in expected[:-1]]
+    start = ring.index(expected[0])
+    return ring[start:] + ring[:start] == expected
+
+
+def test_shared_edge_is_one_arc():
+    left, right = square(0, 0, 1), square(1, 0, 1)
+    arcs, shapes = geometry_prep.build_topology(collection(left, right))
+
+    assert len(arcs) == 3
+    uses = arc_uses(shapes)
+    shared = [arc for arc, count in uses.items() if count == 2]
+    assert len(shared) == 1
+    assert sorted(arcs[shared[0]]) == [(1, 0), (1, 1)]
+    assert sorted(uses.values()) == [1, 1, 2]
+    # 兩側以相反方向使用共用的 arc
+    refs = [ref for feature_shape in shapes for ref in feature_shape[0][0] if ref in (shared[0], ~shared[0])]
+    assert sorted(refs) == [~shared[0], shared[0]]
+
+    for feature_shape, ring in zip(shapes, (left, right)):
+        assert same_ring(geometry_prep._ring_from_arcs(feature_shape[0][0], arcs), ring)
+
+
+def test_shared_edge_with_opposite_winding():
+    # 右邊的正方形反向繪製時，兩側以相同方向使用共用的 arc
+    arcs, shapes = geometry_prep.build_topology(collection(square(0, 0, 1), square(1, 0, 1)[::-1]))
+    assert len(arcs) == 3
+    uses = arc_uses(shapes)
+    assert sorted(uses.values()) == [1, 1, 2]
+    shared = next(arc for arc, count in uses.items() if count == 2)
+    assert all(shared in feature_shape[0][0] for feature_shape in shapes)
+
+
+def test_touching_corner_and_disjoint_squares_share_nothing():
+    for rings in ((square(0, 0, 1), square(1, 1, 1)), (square(0, 0, 1), square(5, 5, 1))):
+        arcs, shapes = geometry_prep.build_topology(collection(*rings))
+        assert len(arcs) == 2
+        assert sorted(arc_uses(shapes).values()) == [1, 1]
+        for feature_shape, ring in zip(shapes, rings):
+            assert same_ring(geometry_prep._ring_from_arcs(feature_shape[0][0], arcs), ring)
+
+
+def test_three_squares_in_a_row():
+    # 中間的正方形上下兩條邊各自在兩個交會點之間，成為獨立的 arc
+    arcs, shapes = geometry_prep.build_topology(collection(square(0, 0, 1), square(1, 0, 1), square(2, 0, 1)))
+    assert len(arcs) == 6
+    assert sorted(arc_uses(shapes).values()) == [1, 1, 1, 1, 2, 2]
+
+
+def test_simplified_shared_edge_stays_identical():
+    # 共用邊在兩側簡化成相同的點，不會出現縫隙
+    left = [[0, 0], [1, 0], [1, 0.3], [1.001, 0.5], [1, 0.7], [1, 1], [0, 1], [0, 0]]
+    right = [[1, 0], [2, 0], [2, 1], [1, 1], [1, 0.7], [1.001, 0.5], [1, 0.3], [1, 0]]
+    prepared, topology, _ = geometry_prep.prepare_geometry(collection(left, right), tolerance=0.01, topojson=True)
+    for feature in prepared['features']:
+        ring = feature['geometry']['coordinates'][0]
+        assert {tuple(point) for point in ring if 0.5 < point[0] < 1.5} == {(1, 0), (1, 1)}
+    assert len(topology['arcs']) == 3
+
+
+def test_topojson_keeps_the_same_rings_as_geojson():
+    # 簡化後退化的環在 GeoJSON 中捨棄，TopoJSON 也不應保留；整個區域都退化時兩者都保留原始外環
+    island = square(20, 20, 0.01)
+    neighbour = square(20.01, 20, 0.01)
+    source = {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'properties': {'id': 0},
+         'geometry': {'type': 'MultiPolygon', 'coordinates': [[square(0, 0, 10)], [island]]}},
+        {'type': 'Feature', 'properties': {'id': 1}, 'geometry': {'type': 'Polygon', 'coordinates': [neighbour]}},
+    ]}
+    prepared, topology, _ = geometry_prep.prepare_geometry(source, tolerance=0.5, topojson=True)
+    geometries = topology['objects']['counties']['geometries']
+    assert [feature['geometry']['type'] for feature in prepared['features']] == ['Polygon', 'Polygon']
+    assert [geometry['type'] for geometry in geometries] == ['Polygon', 'Polygon']
+    assert len(topology['arcs']) == 2
+
+
+def test_topojson_without_arcs():
+    arcs, shapes = [], [[]]
+    topology = geometry_prep.to_topojson({'features': [{'properties': {'id': 0}}]}, arcs, shapes)
+    assert topology['arcs'] == []
+    assert topology['objects']['counties']['geometries'] == [{'type': None, 'properties': {'id': 0}}]
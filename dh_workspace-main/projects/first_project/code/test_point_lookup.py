@@ -0,0 +1,93 @@
+"""point_lookup 的索引查詢與 benchmarks 中逐點測試的 naive_locate 結果一致"""
+import numpy as np
+
+import point_lookup
+from benchmarks.bench_point_lookup import naive_locate
+
+
+def square(x, y, size):
+    return [[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]
+
+
+def collection(*geometries):
+    return {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'properties': {'id': i}, 'geometry': geometry} for i, geometry in enumerate(geometries)
+    ]}
+
+
+def polygon(*rings):
+    return {'type': 'Polygon', 'coordinates': list(rings)}
+
+
+def check(geojson, lon, lat, **options):
+    """索引查詢的結果與 naive_locate 相同，回傳查詢結果"""
+    index = point_lookup.build_index(geojson)
+    result = point_lookup.locate(index, lon, lat, **options)
+    np.testing.assert_array_equal(result, naive_locate(geojson, lon, lat))
+    return result
+
+
+def test_hole_is_outside():
+    geojson = collection(polygon(square(0, 0, 10), square(3, 3, 4)[::-1]))
+    result = check(geojson, [1, 5, 3.5, 9, 11], [1, 5, 5, 9, 5])
+    assert result.tolist() == [0, point_lookup.NO_REGION, point_lookup.NO_REGION, 0, point_lookup.NO_REGION]
+
+
+def test_island_in_hole_belongs_to_its_own_feature():
+    geojson = collection(polygon(square(0, 0, 10), square(3, 3, 4)[::-1]), polygon(square(4, 4, 2)))
+    result = check(geojson, [1, 3.5, 5], [1, 3.5, 5])
+    assert result.tolist() == [0, point_lookup.NO_REGION, 1]
+
+
+def test_shared_edge_belongs_to_one_region():
+    # 共用的邊（含端點）上的座標只會落在其中一個區域，不會查不到
+    geojson = collection(*(polygon(square(x, y, 1)) for y in (0, 1) for x in (0, 1)))
+    lon = [1, 1, 1, 1.5, 0.5, 0.25, 1]
+    lat = [0.5, 1.25, 1, 1, 1, 1, 1.75]
+    result = check(geojson, lon, lat)
+    assert point_lookup.NO_REGION not in result.tolist()
+
+
+def test_overlapping_border_resolves_to_lower_id():
+    # 兩側各自數位化的邊界略有重疊時，重疊處的座標取編號較小的區域
+    for first, second in ((square(0, 0, 1.01), square(1, 0, 1)), (square(1, 0, 1), square(0, 0, 1.01))):
+        geojson = collection(polygon(first), polygon(second))
+        result = check(geojson, [1.005, 1.005], [0.2, 0.8])
+        assert result.tolist() == [0, 0]
+
+
+def test_nan_coordinates_have_no_region():
+    geojson = collection(polygon(square(0, 0, 1)))
+    result = check(geojson, [0.5, np.nan, 0.5, np.nan], [0.5, 0.5, np.nan, np.nan])
+    assert result.tolist() == [0] + [point_lookup.NO_REGION] * 3
+
+
+def test_empty_index():
+    for geojson in (collection(), collection(None), collection(polygon([[0, 0], [1, 1]]))):
+        result = check(geojson, [0.5, 2], [0.5, 2])
+        assert result.tolist() == [point_lookup.NO_REGION] * 2
+    index = point_lookup.build_index(collection(polygon(square(0, 0, 1))))
+    assert point_lookup.locate(index, [], []).tolist() == []
+
+
+def test_many_polygons_and_workers():
+    # 足夠多的多邊形讓 R-tree 有多層；多行程與單一行程、naive_locate 的結果相同
+    rng = np.random.default_rng(0)
+    geometries = []
+    for row in range(12):
+        for column in range(12):
+            x, y = column * 2.0, row * 2.0
+            if (row + column) % 5 == 0:
+                geometries.append(polygon(square(x, y, 2), square(x + 0.5, y + 0.5, 1)[::-1]))
+            else:
+                geometries.append({'type': 'MultiPolygon', 'coordinates': [[square(x, y, 1.5)],
+                                                                           [square(x + 1.6, y + 1.6, 0.3)]]})
+    geojson = collection(*geometries)
+    lon = rng.uniform(-1, 25, 3000)
+    lat = rng.uniform(-1, 25, 3000)
+    index = point_lookup.build_index(geojson)
+    assert len(index['tree']) > 1
+
+    expected = check(geojson, lon, lat)
+    result = point_lookup.locate(index, lon, lat, workers=2, chunk_size=500)
+    np.testing.assert_array_equal(result, expected)
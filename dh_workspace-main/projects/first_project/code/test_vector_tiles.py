@@ -0,0 +1,56 @@
+"""vector_tiles 的 MVT 編碼：以 mapbox_vector_tile 解碼後與輸入相同"""
+import pytest
+
+import vector_tiles
+
+mapbox_vector_tile = pytest.importorskip('mapbox_vector_tile')
+
+
+def decode(data):
+    return mapbox_vector_tile.decode(data, default_options={'y_coord_down': True})[vector_tiles.LAYER_NAME]
+
+
+def closed(ring):
+    return [list(point) for point in ring] + [list(ring[0])]
+
+
+def test_encode_tile_round_trip():
+    outer = [[0, 0], [4096, 0], [4096, 4096], [0, 4096]]        # 圖磚座標（y 向下）中順時針
+    hole = [[1000, 1000], [1000, 3000], [3000, 3000], [3000, 1000]]
+    islands = [[[5000, 10], [5100, 10], [5100, 90]], [[-50, -50], [-10, -50], [-10, -10], [-50, -10]]]
+    features = [
+        (1, {'region_name': '花蓮縣', 'county_name': None, '華語': 59.3, 'dominant': '華語', 'rank': 3}, [outer, hole]),
+        (2, {'region_name': '連江縣', 'dominant': '華語', 'offset': -7, 'visible': True}, islands),
+    ]
+    layer = decode(vector_tiles.encode_tile(features))
+
+    assert layer['extent'] == vector_tiles.EXTENT
+    assert layer['version'] == 2
+    first, second = layer['features']
+    assert first['id'] == 1
+    assert first['properties'] == {'region_name': '花蓮縣', '華語': 59.3, 'dominant': '華語', 'rank': 3}
+    assert first['geometry'] == {'type': 'Polygon', 'coordinates': [closed(outer), closed(hole)]}
+    assert second['id'] == 2
+    assert second['properties'] == {'region_name': '連江縣', 'dominant': '華語', 'offset': -7, 'visible': True}
+    assert second['geometry'] == {'type': 'MultiPolygon',
+                                  'coordinates': [[closed(ring)] for ring in islands]}
+
+
+def test_tiled_feature_round_trip():
+    # 經緯度的多邊形（含洞）切成圖磚後，每個圖磚解碼出來仍是外環包著洞、落在緩衝範圍內
+    geometry = {'type': 'Polygon', 'coordinates': [
+        [[120.0, 22.0], [122.0, 22.0], [122.0, 25.0], [120.0, 25.0], [120.0, 22.0]],
+        [[120.5, 23.0], [120.5, 24.0], [121.5, 24.0], [121.5, 23.0], [120.5, 23.0]],
+    ]}
+    tiles = vector_tiles.tile_feature_rings(geometry, 7)
+    assert len(tiles) > 1
+    low, high = -vector_tiles.BUFFER, vector_tiles.EXTENT + vector_tiles.BUFFER
+    holes = 0
+    for rings in tiles.values():
+        (feature,) = decode(vector_tiles.encode_tile([(1, {'region_name': 'x'}, rings)]))['features']
+        assert feature['geometry']['type'] == 'Polygon'
+        coordinates = feature['geometry']['coordinates']
+        assert coordinates == [closed(ring) for ring in rings]
+        assert all(low <= value <= high for ring in coordinates for point in ring for value in point)
+        holes += len(coordinates) - 1
+    assert holes >= 1
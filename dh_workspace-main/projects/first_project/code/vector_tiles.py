@@ -0,0 +1,395 @@
+"""將邊界與語言數據切成 Mapbox Vector Tiles（MVT）目錄，並產生按需載入圖磚的頁面
+
+用法：
+    python vector_tiles.py --level township --offline
+    cd ../research/outputs/tiles && python -m http.server
+
+每個縮放層級使用 geometry_prep 的共用邊簡化（容許誤差依 ZOOM_TOLERANCES），
+圖磚寫成 {z}/{x}/{y}.pbf，頁面以 Leaflet.VectorGrid 載入並在瀏覽器端依主要語言上色，
+不論區域多少，HTML 本身都只有幾 KB。
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import struct
+import time
+
+import numpy as np
+
+import boundary_cache
+import census_ingest
+import geometry_prep
+import instrumentation
+import language_model
+import projection
+import taiwan_language_map_new as tlm
+
+logger = instrumentation.get_logger('vector_tiles')
+
+EXTENT = 4096        # 圖磚內的座標範圍
+BUFFER = 64          # 圖磚邊緣外多保留的範圍，避免相鄰圖磚接縫處出現細縫
+LAYER_NAME = 'regions'
+DEFAULT_MINZOOM = 6
+DEFAULT_MAXZOOM = 12
+# 預設輸出到研究成果目錄
+DEFAULT_OUTPUT_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                  '..', 'research', 'outputs', 'tiles'))
+
+# 圖磚屬性中兩種模式的主要語言欄位與各自排除的語言
+DOMINANT_MODES = {'dominant': (), 'dominant_exclude': ('華語',)}
+
+# MVT 幾何指令
+MOVE_TO, LINE_TO, CLOSE_PATH = 1, 2, 7
+POLYGON = 3
+
+
+# ---- protobuf 編碼（MVT 只用到 varint、length-delimited 與 64-bit 三種型別） ----
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field, wire_type):
+    return _varint((field << 3) | wire_type)
+
+
+def _bytes_field(field, data):
+    return _key(field, 2) + _varint(len(data)) + data
+
+
+def _varint_field(field, value):
+    return _key(field, 0) + _varint(value)
+
+
+def _packed_field(field, values):
+    return _bytes_field(field, b''.join(_varint(value) for value in values))
+
+
+def _encode_value(value):
+    """MVT 的 Value 訊息：字串、整數或浮點數"""
+    if isinstance(value, bool):
+        return _varint_field(7, int(value))
+    if isinstance(value, int):
+        return _varint_field(6, _zigzag(value)) if value < 0 else _varint_field(4, value)
+    if isinstance(value, float):
+        return _key(3, 1) + struct.pack('<d', value)
+    return _bytes_field(1, str(value).encode('utf-8'))
+
+
+def encode_geometry(rings):
+    """將多邊形的環（已是圖磚座標、外環順時針）編碼成 MVT 幾何指令"""
+    commands = []
+    cursor_x = cursor_y = 0
+    for ring in rings:
+        commands.append((1 << 3) | MOVE_TO)
+        x, y = ring[0]
+        commands.extend((_zigzag(x - cursor_x), _zigzag(y - cursor_y)))
+        cursor_x, cursor_y = x, y
+        commands.append(((len(ring) - 1) << 3) | LINE_TO)
+        for x, y in ring[1:]:
+            commands.extend((_zigzag(x - cursor_x), _zigzag(y - cursor_y)))
+            cursor_x, cursor_y = x, y
+        commands.append((1 << 3) | CLOSE_PATH)
+    return commands
+
+
+def encode_tile(features, layer_name=LAYER_NAME, extent=EXTENT):
+    """features 為 (id, 屬性 dict, 環列表)；回傳單一圖層的 MVT 位元組"""
+    keys, values = {}, {}
+    encoded_features = []
+    for feature_id, properties, rings in features:
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value).__name__, value), len(values)))
+        message = (_varint_field(1, feature_id) + _packed_field(2, tags) + _varint_field(3, POLYGON)
+                   + _packed_field(4, encode_geometry(rings)))
+        encoded_features.append(_bytes_field(2, message))
+
+    layer = _varint_field(15, 2) + _bytes_field(1, layer_name.encode('utf-8'))
+    layer += b''.join(encoded_features)
+    layer += b''.join(_bytes_field(3, key.encode('utf-8')) for key in keys)
+    layer += b''.join(_bytes_field(4, _encode_value(value)) for _, value in values)
+    layer += _varint_field(5, extent)
+    return _bytes_field(3, layer)
+
+
+# ---- 投影與裁切 ----
+
+def clip_ring(ring, axis, low, high):
+    """以 Sutherland-Hodgman 將環在某一軸上裁切到 [low, high]（每條邊以 numpy 一次處理）"""
+    if len(ring) == 0 or (ring[:, axis].min() >= low and ring[:, axis].max() <= high):
+        return ring
+    for bound, keep_above in ((low, True), (high, False)):
+        if len(ring) == 0:
+            break
+        following = np.roll(ring, -1, axis=0)
+        inside = ring[:, axis] >= bound if keep_above else ring[:, axis] <= bound
+        next_inside = np.roll(inside, -1)
+        delta = following[:, axis] - ring[:, axis]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(delta != 0, (bound - ring[:, axis]) / delta, 0.0)
+        crossing = ring + (following - ring) * t[:, None]
+        points = np.stack([crossing, following], axis=1)
+        emit = np.stack([inside != next_inside, next_inside], axis=1)
+        ring = points[emit]
+    return ring
+
+
+def _ring_area(ring):
+    """圖磚座標（y 向下）的有號面積，正值為順時針"""
+    x, y = ring[:, 0], ring[:, 1]
+    return (np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)) / 2.0
+
+
+def _tile_ring(ring, exterior):
+    """四捨五入成整數座標、去除重複點並調整方向；退化時回傳 None"""
+    ring = np.rint(ring).astype(np.int64)
+    keep = np.any(ring != np.roll(ring, 1, axis=0), axis=1)
+    ring = ring[keep]
+    if len(ring) < 3:
+        return None
+    area = _ring_area(ring)
+    if area == 0:
+        return None
+    if (area > 0) != exterior:
+        ring = ring[::-1]
+    return ring.tolist()
+
+
+def tile_feature_rings(geometry, zoom, extent=EXTENT, buffer=BUFFER):
+    """將一個區域切到它覆蓋的每個圖磚，回傳 {(x, y): 環列表}"""
+    tiles = {}
+    low, high = -buffer / extent, 1 + buffer / extent
+    for polygon in geometry_prep.polygons(geometry):
+        projected = []
+        for ring in polygon:
+            points = projection.project(ring, zoom)
+            if len(points) > 1 and np.array_equal(points[0], points[-1]):
+                points = points[:-1]
+            projected.append(points)
+        if not projected or len(projected[0]) < 3:
+            continue
+        outer = projected[0]
+        min_x, min_y = np.floor(outer.min(axis=0) - buffer / extent).astype(int)
+        max_x, max_y = np.floor(outer.max(axis=0) + buffer / extent).astype(int)
+        # 先裁成一整欄，再從欄中裁出每個圖磚，避免每個圖磚都處理整個環
+        for tile_x in range(max(min_x, 0), min(max_x, 2 ** zoom - 1) + 1):
+            column = [clip_ring(points, 0, tile_x + low, tile_x + high) for points in projected]
+            if len(column[0]) == 0:
+                continue
+            for tile_y in range(max(min_y, 0), min(max_y, 2 ** zoom - 1) + 1):
+                rings = []
+                for ring_index, points in enumerate(column):
+                    local = clip_ring(points, 1, tile_y + low, tile_y + high)
+                    local = local - (tile_x, tile_y)
+                    ring = _tile_ring(local * extent, exterior=ring_index == 0) if len(local) else None
+                    if ring is None:
+                        if ring_index == 0:
+                            break
+                        continue
+                    rings.append(ring)
+                if rings:
+                    tiles.setdefault((tile_x, tile_y), []).extend(rings)
+    return tiles
+
+
+# ---- 匯出 ----
+
+def dominant_rows(table):
+    """兩種模式下每個區域的主要語言列號（整張表各以 argmax 算一次）"""
+    return {mode: language_model.dominant_languages(table, exclude).tolist()
+            for mode, exclude in DOMINANT_MODES.items()}
+
+
+def feature_properties(feature, table, dominant):
+    """圖磚中每個區域的屬性：名稱、各語言比例與兩種模式的主要語言（dominant 為 dominant_rows 的結果）"""
+    properties = feature['properties']
+    region = properties.get('region_name')
+    result = {'region_name': region, 'county_name': properties.get('county_name')}
+    row = language_model.region_row(table, region)
+    if row is not None:
+        for language, value in zip(table['languages'], table['values'][row].tolist()):
+            if not math.isnan(value):
+                result[language] = round(value, 1)
+        for mode, rows in dominant.items():
+            index = rows[row]
+            if index >= 0:
+                result[mode] = table['languages'][index]
+    return result
+
+
+def export_tiles(geojson, table, output_dir, minzoom=DEFAULT_MINZOOM, maxzoom=DEFAULT_MAXZOOM,
+                 precision=geometry_prep.DEFAULT_PRECISION):
+    """將已寫入 region_name 的邊界切成各縮放層級的 MVT 圖磚，回傳中繼資料
+
+    每個縮放層級各自簡化（共用邊只簡化一次，相鄰區域不會出現縫隙）；
+    沒有任何區域的圖磚不會寫出，頁面載入時顯示為空白。
+    """
+    start = time.perf_counter()
+    zooms = list(range(minzoom, maxzoom + 1))
+    levels = geometry_prep.prepare_levels(geojson, zooms, precision)
+    dominant = dominant_rows(table)
+    properties = [feature_properties(feature, table, dominant) for feature in geojson['features']]
+
+    tile_dir = os.path.join(output_dir, 'tiles')
+    if os.path.isdir(tile_dir):
+        shutil.rmtree(tile_dir)
+
+    tile_count = 0
+    total_bytes = 0
+    per_zoom = {}
+    for zoom in zooms:
+        tiles = {}
+        for feature_id, feature in enumerate(levels[zoom]['features'], start=1):
+            if not feature['geometry']:
+                continue
+            for tile, rings in tile_feature_rings(feature['geometry'], zoom).items():
+                tiles.setdefault(tile, []).append((feature_id, properties[feature_id - 1], rings))
+        for (tile_x, tile_y), features in tiles.items():
+            path = os.path.join(tile_dir, str(zoom), str(tile_x), f'{tile_y}.pbf')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            data = encode_tile(features)
+            with open(path, 'wb') as file:
+                file.write(data)
+            total_bytes += len(data)
+        tile_count += len(tiles)
+        per_zoom[zoom] = len(tiles)
+
+    (south, west), (north, east) = tlm.geojson_bounds(geojson)
+    metadata = {
+        'name': 'taiwan-language',
+        'format': 'pbf',
+        'tiles': ['tiles/{z}/{x}/{y}.pbf'],
+        'layer': LAYER_NAME,
+        'minzoom': minzoom,
+        'maxzoom': maxzoom,
+        'bounds': [west, south, east, north],
+        'languages': table['languages'],
+        'colors': language_model.LANGUAGE_COLORS,
+        'features': len(geojson['features']),
+        'tile_count': tile_count,
+        'tiles_per_zoom': per_zoom,
+        'tile_bytes': total_bytes,
+        'seconds': round(time.perf_counter() - start, 2),
+    }
+    with open(os.path.join(output_dir, 'metadata.json'), 'w', encoding='utf-8') as file:
+        json.dump(metadata, file, ensure_ascii=False, indent=2)
+    return metadata
+
+
+def create_tile_map(metadata, exclude_mandarin=False, tiles='CartoDB positron', tile_url=None):
+    """建立以 VectorGrid 按需載入圖磚的地圖頁面（樣式與彈窗都在瀏覽器端產生）"""
+    # folium 只有產生頁面時才需要，匯出圖磚（或 static_render 使用投影）不必載入
+    import folium
+    from folium.plugins import VectorGridProtobuf
+
+    west, south, east, north = metadata['bounds']
+    m = folium.Map(location=[(south + north) / 2, (west + east) / 2], zoom_start=metadata['minzoom'] + 1,
+                   tiles=tiles)
+    m.fit_bounds([[south, west], [north, east]])
+
+    url = tile_url or metadata['tiles'][0]
+    options = '''{
+        rendererFactory: L.canvas.tile,
+        interactive: true,
+        minNativeZoom: ''' + str(metadata['minzoom']) + ''',
+        maxNativeZoom: ''' + str(metadata['maxzoom']) + ''',
+        getFeatureId: function(feature) { return feature.id; },
+        vectorTileLayerStyles: {
+            ''' + metadata['layer'] + ''': function(properties) { return languageTileStyle(properties); }
+        }
+    }'''
+    grid = VectorGridProtobuf(url, '語言分布', options)
+    grid.add_to(m)
+
+    toggle_html = '''
+    <div id="language-toggle" style="position: fixed; top: 10px; right: 10px; z-index: 1000;
+                background-color: white; border: 2px solid #ccc; border-radius: 8px; padding: 15px;
+                box-shadow: 0 2px 10px rgba(0,0,0,0.3); font-family: Arial, sans-serif;">
+        <div style="font-weight: bold; margin-bottom: 12px; color: #333; font-size: 14px;">語言顯示模式</div>
+        <label style="display: block; margin-bottom: 10px; cursor: pointer; font-size: 13px;">
+            <input type="radio" name="language_mode" value="normal"''' + ('' if exclude_mandarin else ' checked') + '''
+                   style="margin-right: 8px; transform: scale(1.2);"> 包含華語
+        </label>
+        <label style="display: block; cursor: pointer; font-size: 13px;">
+            <input type="radio" name="language_mode" value="exclude"''' + (' checked' if exclude_mandarin else '') + '''
+                   style="margin-right: 8px; transform: scale(1.2);"> 排除華語
+        </label>
+    </div>
+    '''
+    m.get_root().html.add_child(folium.Element(toggle_html))
+    tlm.add_popup_assets(m)
+    # 樣式與點擊只讀取圖磚屬性中預先算好的數值，腳本本身是固定的靜態檔案
+    m.get_root().html.add_child(tlm.script_element('vector_tiles.js', 'languageTileConfig', {
+        'map': m.get_name(),
+        'layer': grid.get_name(),
+        'languages': metadata['languages'],
+        'colors': metadata['colors'],
+        'noDataColor': language_model.NO_DATA_COLOR,
+        'styles': {'data': tlm.REGION_STYLE, 'noData': tlm.NO_DATA_STYLE},
+        'exclude': ['華語'],
+        'excludeMandarin': bool(exclude_mandarin),
+    }))
+    tlm.add_legend(m)
+    return m
+
+
+def build_tiles(level='county', output_dir=DEFAULT_OUTPUT_DIR, offline=False, refresh=False,
+                cache_dir=boundary_cache.DEFAULT_CACHE_DIR, year=None, minzoom=DEFAULT_MINZOOM,
+                maxzoom=DEFAULT_MAXZOOM, exclude_mandarin=False, tiles='CartoDB positron'):
+    """取得邊界與語言數據、切出圖磚並寫出 index.html，回傳中繼資料（缺少邊界時回傳 None）"""
+    geojson = tlm.download_taiwan_geojson(offline, refresh, cache_dir, tlm.boundary_url(level))
+    if not geojson:
+        logger.error("無法產生圖磚：缺少地理數據")
+        return None
+
+    store = census_ingest.ensure_store()
+    table, _, township_index = tlm.load_language_table(level, year, store)
+    unmatched = tlm.stamp_regions(geojson, level, township_index)
+    if unmatched:
+        logger.warning(f"無法對應名稱的區域：{'、'.join(str(name) for name in unmatched)}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    metadata = export_tiles(geojson, table, output_dir, minzoom, maxzoom)
+    create_tile_map(metadata, exclude_mandarin, tiles).save(os.path.join(output_dir, 'index.html'))
+    return metadata
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='將語言地圖切成向量圖磚（MVT）')
+    parser.add_argument('--level', choices=['county', 'township'], default='township', help='行政區層級')
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR, help='輸出目錄（圖磚、metadata.json 與 index.html）')
+    parser.add_argument('--offline', action='store_true', help='只使用本地快取的邊界數據，不連網')
+    parser.add_argument('--refresh', action='store_true', help='連網檢查邊界數據是否有更新')
+    parser.add_argument('--cache-dir', default=boundary_cache.DEFAULT_CACHE_DIR, help='邊界快取目錄')
+    parser.add_argument('--year', type=int, help='普查年份（預設最新）')
+    parser.add_argument('--minzoom', type=int, default=DEFAULT_MINZOOM, help='最小縮放層級')
+    parser.add_argument('--maxzoom', type=int, default=DEFAULT_MAXZOOM, help='最大縮放層級（更大時放大此層級的圖磚）')
+    parser.add_argument('--exclude-mandarin', action='store_true', help='頁面預設為排除華語模式')
+    parser.add_argument('--tiles', default='CartoDB positron', help='底圖名稱或圖磚網址')
+    args = parser.parse_args()
+    instrumentation.configure_logging()
+
+    metadata = build_tiles(args.level, args.output_dir, args.offline, args.refresh, args.cache_dir, args.year,
+                           args.minzoom, args.maxzoom, args.exclude_mandarin, args.tiles)
+    if metadata:
+        print(f"已產生 {metadata['tile_count']} 個圖磚（{metadata['tile_bytes']:,} bytes，"
+              f"{metadata['features']} 個區域），耗時 {metadata['seconds']} 秒 -> {args.output_dir}")
+        print(f"以 HTTP 開啟：cd {args.output_dir} && python -m http.server")